@@ -0,0 +1,223 @@
+"""Per-currency amount formatting and parsing.
+
+Everything that turns integer minor units into text, or text back into minor
+units, goes through one AmountFormat per currency. Each is built once from
+CURRENCY_DATA and looked up with amount_format(currency), so the hot paths
+never re-read the currency table or compile anything per call:
+
+    eur = amount_format("EUR")
+    eur.format(123450)                      # '€1.234,50'
+    eur.parse("1.234,5")                    # 123450
+    eur.reformat_input("12345,6", 5)        # ('12.345,6', 6)
+    format_amounts([1250, 300], ["USD", "JPY"])   # ['$12.50', '¥300']
+
+Only the standard library is used; expense_core re-exports the module-level
+helpers.
+"""
+import re
+from decimal import Decimal, DecimalException, ROUND_HALF_UP
+
+# Largest amount in minor units that fits SQLite's 64-bit INTEGER
+MAX_AMOUNT = 2 ** 63 - 1
+
+# Currency data with symbols and formatting; decimals is the number of minor
+# unit digits, amounts are stored as integers in those minor units. These are
+# the built-in currencies every new database is seeded with; currencies added
+# to a database's currencies table join them through register_currency
+CURRENCY_DATA = {
+    'USD': {'symbol': '$', 'decimal_sep': '.', 'thousand_sep': ',', 'decimals': 2},
+    'EUR': {'symbol': '€', 'decimal_sep': ',', 'thousand_sep': '.', 'decimals': 2},
+    'GBP': {'symbol': '£', 'decimal_sep': '.', 'thousand_sep': ',', 'decimals': 2},
+    'JPY': {'symbol': '¥', 'decimal_sep': '.', 'thousand_sep': ',', 'decimals': 0},
+    'AUD': {'symbol': '$', 'decimal_sep': '.', 'thousand_sep': ',', 'decimals': 2},
+    'CAD': {'symbol': '$', 'decimal_sep': '.', 'thousand_sep': ',', 'decimals': 2},
+    'CHF': {'symbol': 'CHF', 'decimal_sep': '.', 'thousand_sep': '\'', 'decimals': 2},
+    'CNY': {'symbol': '¥', 'decimal_sep': '.', 'thousand_sep': ',', 'decimals': 2},
+    'SEK': {'symbol': 'kr', 'decimal_sep': ',', 'thousand_sep': ' ', 'decimals': 2},
+    'NZD': {'symbol': '$', 'decimal_sep': '.', 'thousand_sep': ',', 'decimals': 2},
+    'CZK': {'symbol': 'Kč', 'decimal_sep': ',', 'thousand_sep': ' ', 'decimals': 2},
+    'PLN': {'symbol': 'zł', 'decimal_sep': ',', 'thousand_sep': ' ', 'decimals': 2},
+    'HUF': {'symbol': 'Ft', 'decimal_sep': ',', 'thousand_sep': ' ', 'decimals': 0},
+    'DKK': {'symbol': 'kr', 'decimal_sep': ',', 'thousand_sep': '.', 'decimals': 2},
+    'NOK': {'symbol': 'kr', 'decimal_sep': ',', 'thousand_sep': ' ', 'decimals': 2},
+    'RUB': {'symbol': '₽', 'decimal_sep': ',', 'thousand_sep': ' ', 'decimals': 2},
+    'TRY': {'symbol': '₺', 'decimal_sep': ',', 'thousand_sep': '.', 'decimals': 2},
+    'ISK': {'symbol': 'kr', 'decimal_sep': '.', 'thousand_sep': ',', 'decimals': 0},
+    'RON': {'symbol': 'lei', 'decimal_sep': ',', 'thousand_sep': '.', 'decimals': 2},
+    'HRK': {'symbol': 'kn', 'decimal_sep': ',', 'thousand_sep': '.', 'decimals': 2},
+    'SKK': {'symbol': 'Sk', 'decimal_sep': ',', 'thousand_sep': ' ', 'decimals': 2},  # Slovak Koruna (historic)
+    # Add more currencies as needed
+}
+
+# Used to display amounts stored with a currency code we have no data for
+UNKNOWN_CURRENCY = {'symbol': '', 'decimal_sep': '.', 'thousand_sep': ',', 'decimals': 2}
+
+
+def group_digits(digits, thousand_sep):
+    """Insert thousand_sep every three digits from the right, keeping leading zeros ("0012345" -> "0.012.345")."""
+    first = len(digits) % 3 or 3
+    return thousand_sep.join([digits[:first]] + [digits[index:index + 3] for index in range(first, len(digits), 3)])
+
+
+class AmountFormat:
+    """Formatting and parsing rules for one currency; get instances from amount_format()."""
+
+    __slots__ = ("symbol", "decimal_sep", "thousand_sep", "decimals", "factor", "input_pattern")
+
+    def __init__(self, currency_data):
+        self.symbol = currency_data['symbol']
+        self.decimal_sep = currency_data['decimal_sep']
+        self.thousand_sep = currency_data['thousand_sep']
+        self.decimals = currency_data['decimals']
+        self.factor = 10 ** self.decimals
+        # What the amount field accepts while typing, for QRegularExpressionValidator
+        self.input_pattern = f"^-?[0-9{re.escape(self.thousand_sep)}]*{re.escape(self.decimal_sep)}?[0-9]*$"
+
+    def format(self, amount):
+        """Minor units as display text with symbol and separators, e.g. €1.234,50 or £-3.00."""
+        sign = '-' if amount < 0 else ''
+        units, minor = divmod(-amount if sign else amount, self.factor)
+        units_text = f"{units:,}"
+        if self.thousand_sep != ',':
+            units_text = units_text.replace(',', self.thousand_sep)
+        if self.decimals:
+            return f"{self.symbol}{sign}{units_text}{self.decimal_sep}{minor:0{self.decimals}d}"
+        return f"{self.symbol}{sign}{units_text}"
+
+    def format_many(self, amounts):
+        """format() for a whole column of amounts in this currency."""
+        format_one = self.format
+        return [format_one(amount) for amount in amounts]
+
+    def format_plain(self, amount):
+        """Minor units as a plain decimal string such as "-12.50", for files and APIs."""
+        if not self.decimals:
+            return str(amount)
+        units, minor = divmod(abs(amount), self.factor)
+        return f"{'-' if amount < 0 else ''}{units}.{minor:0{self.decimals}d}"
+
+    def parse(self, text):
+        """Parse text typed with this currency's separators into minor units; ValueError if not a number."""
+        return self.parse_plain(text.replace(self.thousand_sep, '').replace(self.decimal_sep, '.'))
+
+    def parse_plain(self, text):
+        """Parse a plain decimal such as "-12.50" into minor units, rounding half up.
+
+        ValueError if text is not a plain decimal (exponents, NaN and
+        infinities included) or the amount does not fit in MAX_AMOUNT.
+        """
+        if 'e' in text.lower():
+            raise ValueError(f"Invalid amount {text!r}")
+        try:
+            amount = Decimal(text)
+            if not amount.is_finite():
+                raise ValueError(f"Invalid amount {text!r}")
+            minor = int((amount * self.factor).to_integral_value(ROUND_HALF_UP))
+        except DecimalException:
+            raise ValueError(f"Invalid amount {text!r}") from None
+        if abs(minor) > MAX_AMOUNT:
+            raise ValueError(f"Amount {text!r} is too large")
+        return minor
+
+    def reformat_input(self, text, cursor):
+        """Regroup the amount field as the user types; returns (text, cursor).
+
+        Thousand separators are redrawn around the digits typed so far, a
+        trailing decimal separator and leading zeros are kept, and the
+        cursor stays behind the same digit it was behind before.
+        """
+        thousand_sep, decimal_sep = self.thousand_sep, self.decimal_sep
+        raw = text.replace(thousand_sep, '')
+        if not raw:
+            return '', 0
+        # The cursor as an index into raw, which has no thousand separators
+        raw_cursor = cursor - text.count(thousand_sep, 0, cursor)
+
+        sign = ''
+        if raw.startswith('-'):
+            sign = '-'
+            raw = raw[1:]
+        integer_part, has_decimal, decimal_part = raw.partition(decimal_sep)
+        integer_part = ''.join(char for char in integer_part if char.isdecimal())
+        decimal_part = ''.join(char for char in decimal_part if char.isdecimal())
+
+        grouped = group_digits(integer_part, thousand_sep) if integer_part else ''
+        if decimal_part:
+            formatted = f"{sign}{grouped}{decimal_sep}{decimal_part}"
+        elif has_decimal and raw.endswith(decimal_sep):
+            formatted = f"{sign}{grouped}{decimal_sep}"
+        else:
+            formatted = f"{sign}{grouped}"
+
+        # Separators only appear between integer digits: count those left of the cursor
+        if raw_cursor <= 0:
+            return formatted, 0
+        digits_before = min(raw_cursor - len(sign), len(integer_part))
+        first_group = len(integer_part) % 3 or 3
+        separators = (digits_before - first_group - 1) // 3 + 1 if digits_before > first_group else 0
+        return formatted, min(raw_cursor + separators * len(thousand_sep), len(formatted))
+
+
+# One AmountFormat per currency, built at import
+AMOUNT_FORMATS = {currency: AmountFormat(data) for currency, data in CURRENCY_DATA.items()}
+UNKNOWN_AMOUNT_FORMAT = AmountFormat(UNKNOWN_CURRENCY)
+
+
+def amount_format(currency):
+    """The cached AmountFormat for currency; unknown codes get UNKNOWN_CURRENCY's rules."""
+    return AMOUNT_FORMATS.get(currency, UNKNOWN_AMOUNT_FORMAT)
+
+
+def register_currency(currency, currency_data):
+    """Add or replace the formatting rules of currency for the rest of the process."""
+    CURRENCY_DATA[currency] = currency_data
+    AMOUNT_FORMATS[currency] = AmountFormat(currency_data)
+
+
+def register_currencies(formats):
+    """register_currency for each {code: currency_data} that is not known yet; built-in rules always win."""
+    for currency, currency_data in formats.items():
+        if currency not in CURRENCY_DATA:
+            register_currency(currency, currency_data)
+
+
+def minor_unit_factor(currency):
+    """10 ** decimals: how many stored minor units make one unit of the currency."""
+    return amount_format(currency).factor
+
+
+def format_amount(amount, currency):
+    """Format integer minor units with the currency's symbol and separators, e.g. €1.234,50."""
+    return amount_format(currency).format(amount)
+
+
+def format_amounts(amounts, currencies):
+    """format_amount over parallel columns, e.g. a page of records or a summary table."""
+    formatters = {}
+    texts = []
+    for amount, currency in zip(amounts, currencies):
+        format_one = formatters.get(currency)
+        if format_one is None:
+            format_one = formatters[currency] = amount_format(currency).format
+        texts.append(format_one(amount))
+    return texts
+
+
+def parse_amount(amount_text, currency):
+    """Parse amount_text typed in the given currency's separators into integer minor units.
+
+    The text is parsed as a decimal, never a float, and rounded half up to
+    the currency's number of decimals. Raises ValueError if the text is not
+    a number.
+    """
+    return amount_format(currency).parse(amount_text)
+
+
+def decimal_to_minor(amount_text, currency):
+    """Convert a plain decimal string such as "-12.50" into integer minor units of currency."""
+    return amount_format(currency).parse_plain(amount_text)
+
+
+def format_decimal(amount, currency):
+    """Format integer minor units as a plain decimal string such as "-12.50"; the inverse of decimal_to_minor."""
+    return amount_format(currency).format_plain(amount)
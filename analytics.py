@@ -0,0 +1,320 @@
+"""Columnar in-memory copy of the expenses table for charts and statistics.
+
+    cache = AnalyticsCache(repository)          # one pass over expenses
+    cache.sync(repository)                      # later: apply what changed since
+    cache.totals(("month", "category"), ExpenseFilter(currency="EUR"))
+    cache.statistics(("category",), ExpenseFilter(currency="EUR", start="2024-01-01"))
+    cache.month_over_month(ExpenseFilter(currency="EUR"))
+
+Only the columns charts and statistics need are kept, one NumPy array each:
+expense id, day (days since 1970-01-01), category id, currency id and
+amount in minor units, 28 bytes per expense. Group-bys turn the key
+columns into one integer per row and use numpy.unique and bincount;
+percentiles sort once by (group, amount) and interpolate every group's
+quantiles at once, so nothing loops over rows or groups in Python. Keys and
+results follow ExpenseRepository.totals: the same group_by names, names and
+codes rather than ids, groups ordered by what is shown.
+
+The cache remembers the journal seq it is current to. sync() applies
+changes_since from there, so every write is seen whichever connection made
+it (the GUI, the worker, the CLI or the API server); after a journal
+compaction that removed entries it has not seen, it reads the table again.
+Text filters cannot be answered (descriptions are not cached).
+
+NumPy is optional, as in fx.py: available() tells whether it is installed,
+and it is only imported when a cache is built, so importing this module
+costs nothing at startup.
+"""
+import datetime
+import importlib.util
+from collections import namedtuple
+
+from expense_core import ExpenseFilter
+from profiling import timed
+
+GROUP_KEYS = ("category", "currency", "month", "year")
+# The cached columns, as read from SQLite: day is days since 1970-01-01, 0 stands for a missing id
+ROW_DTYPE = [("id", "int64"), ("day", "int32"), ("category", "int32"), ("currency", "int32"), ("amount", "int64")]
+QUANTILES = (0.5, 0.9)
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+# amounts are minor units of the one currency in the group; change is a fraction (0.25 = +25%)
+MonthChange = namedtuple("MonthChange", "month total change")
+
+
+def available():
+    """True if NumPy is installed."""
+    return importlib.util.find_spec("numpy") is not None
+
+
+def synced(repository, cache=None):
+    """cache brought up to date with repository, or a new cache if there is none (for DatabaseThread.submit)."""
+    if cache is None:
+        return AnalyticsCache(repository)
+    cache.sync(repository)
+    return cache
+
+
+class AnalyticsCache:
+    """NumPy columns of the expenses table; see the module docstring."""
+
+    FETCH_ROWS = 100000
+
+    def __init__(self, repository):
+        self.reload(repository)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @timed("analytics.reload")
+    def reload(self, repository):
+        """Read the whole table (in one read transaction, with the journal position it matches)."""
+        import numpy
+
+        with repository.transaction("DEFERRED"):
+            seq = repository.journal_head()
+            # Dates become day numbers in SQL; rows whose date is not a valid ISO date are left out
+            cursor = repository.connection.execute(
+                "SELECT id, CAST(julianday(date) - 2440587.5 AS INTEGER), COALESCE(category_id, 0), "
+                "COALESCE(currency_id, 0), amount FROM expenses WHERE julianday(date) IS NOT NULL ORDER BY id")
+            # Straight from the cursor into one record array: no list of a million tuples in between
+            table = numpy.fromiter(cursor, dtype=ROW_DTYPE)
+        self.set_columns(table)
+        self.seq = seq
+        self.load_names(repository)
+
+    def set_columns(self, table):
+        """Take the columns of a ROW_DTYPE record array."""
+        self.ids = table["id"].copy()
+        self.days = table["day"].copy()
+        self.categories = table["category"].copy()
+        self.currencies = table["currency"].copy()
+        self.amounts = table["amount"].copy()
+
+    def load_names(self, repository):
+        repository.categories.load()
+        repository.currencies.load()
+        self.category_names = dict(repository.categories.names)
+        self.currency_codes = dict(repository.currencies.names)
+
+    @timed("analytics.sync")
+    def sync(self, repository, limit=10000):
+        """Apply the journal entries written since the last reload or sync; returns how many there were."""
+        import numpy
+
+        seq = self.seq
+        latest = {}
+        while True:
+            try:
+                entries = repository.changes_since(seq, limit)
+            except LookupError:
+                self.reload(repository)
+                return 0
+            for entry in entries:
+                # Only the final state of each expense matters; None means it is gone
+                latest[entry.expense_id] = entry.after
+            if len(entries) < limit:
+                break
+            seq = entries[-1].seq
+        if not latest:
+            return 0
+        applied = seq if not entries else entries[-1].seq
+
+        self.load_names(repository)
+        category_ids = {name: key for key, name in self.category_names.items() if key is not None}
+        currency_ids = {code: key for key, code in self.currency_codes.items() if key is not None}
+        added = []
+        for expense_id, image in latest.items():
+            if image is None:
+                continue
+            _, date, category, amount, currency, _, _ = image
+            try:
+                day = datetime.date.fromisoformat(date).toordinal() - EPOCH_ORDINAL
+            except (TypeError, ValueError):
+                continue
+            added.append((expense_id, day, category_ids.get(category, 0), currency_ids.get(currency, 0), amount))
+
+        changed = numpy.fromiter(latest, dtype=numpy.int64, count=len(latest))
+        table = numpy.empty(len(self.ids), dtype=ROW_DTYPE)
+        table["id"], table["day"], table["category"] = self.ids, self.days, self.categories
+        table["currency"], table["amount"] = self.currencies, self.amounts
+        if len(self.ids) and changed.min() <= self.ids.max():
+            # Updates, deletes or restored ids: drop the old rows first (new ids need no search)
+            table = table[~numpy.isin(self.ids, changed)]
+        if added:
+            table = numpy.concatenate((table, numpy.array(added, dtype=ROW_DTYPE)))
+        self.set_columns(table)
+        self.seq = applied
+        return len(latest)
+
+    def currencies_used(self):
+        """Codes of the currencies that have expenses, sorted."""
+        import numpy
+
+        return sorted(code for code in map(self.currency_codes.get, numpy.unique(self.currencies).tolist()) if code)
+
+    def years(self):
+        """"yyyy" of every year that has expenses, oldest first."""
+        import numpy
+
+        years = numpy.unique(self.days.astype("datetime64[D]").astype("datetime64[Y]").astype("int64"))
+        return [self.shown_key("year", year) for year in years.tolist()]
+
+    def mask(self, expense_filter=None):
+        """Boolean array of the rows expense_filter selects (None for all rows)."""
+        import numpy
+
+        expense_filter = expense_filter or ExpenseFilter()
+        if expense_filter.text:
+            raise ValueError("The analytics cache cannot search text; use ExpenseRepository for that")
+        selected = numpy.ones(len(self.ids), dtype=bool)
+        if expense_filter.start is not None:
+            selected &= self.days >= datetime.date.fromisoformat(expense_filter.start).toordinal() - EPOCH_ORDINAL
+        if expense_filter.end is not None:
+            selected &= self.days < datetime.date.fromisoformat(expense_filter.end).toordinal() - EPOCH_ORDINAL
+        for column, names, value in ((self.categories, self.category_names, expense_filter.category),
+                                     (self.currencies, self.currency_codes, expense_filter.currency)):
+            if value is not None:
+                keys = [key for key, name in names.items() if name == value]
+                selected &= column == (keys[0] if keys else -1)
+        if expense_filter.min_amount is not None:
+            selected &= self.amounts >= expense_filter.min_amount
+        if expense_filter.max_amount is not None:
+            selected &= self.amounts <= expense_filter.max_amount
+        return selected
+
+    def key_column(self, column, selected):
+        if column == "category":
+            return self.categories[selected]
+        if column == "currency":
+            return self.currencies[selected]
+        if column == "month":
+            return self.days[selected].astype("datetime64[D]").astype("datetime64[M]").astype("int64")
+        if column == "year":
+            return self.days[selected].astype("datetime64[D]").astype("datetime64[Y]").astype("int64")
+        raise ValueError(f"Unknown group column {column!r}, expected one of {', '.join(GROUP_KEYS)}")
+
+    def shown_key(self, column, key):
+        if column == "category":
+            return self.category_names.get(key)
+        if column == "currency":
+            return self.currency_codes.get(key)
+        if column == "month":
+            return f"{1970 + key // 12:04d}-{key % 12 + 1:02d}"
+        return f"{1970 + key:04d}"
+
+    def groups(self, group_by, selected):
+        """Group the selected rows by group_by.
+
+        Returns (number of groups, group index per selected row, shown key
+        tuples in display order, group indexes in display order).
+        """
+        import numpy
+
+        combined = numpy.zeros(int(selected.sum()), dtype=numpy.int64)
+        columns = []
+        for column in group_by:
+            keys = self.key_column(column, selected)
+            low = int(keys.min()) if len(keys) else 0
+            radix = int(keys.max()) - low + 1 if len(keys) else 1
+            # Mixed-radix packing: one int64 per row groups like the tuple of keys
+            combined = combined * radix + (keys - low)
+            columns.append((column, low, radix))
+        unique, inverse = numpy.unique(combined, return_inverse=True)
+        if not group_by:
+            return len(unique), inverse, [()] * len(unique), numpy.arange(len(unique))
+
+        # Unpack each group's keys again; names are looked up and ranked once per distinct key
+        unpacked, ranks = [], []
+        rest = unique
+        for column, low, radix in reversed(columns):
+            rest, digits = numpy.divmod(rest, radix)
+            keys = digits + low
+            distinct = numpy.unique(keys)
+            names = {key: self.shown_key(column, key) for key in distinct.tolist()}
+            # Ordered by what is shown, missing names first (like NULL in SQL)
+            ranking = sorted(names, key=lambda key: (names[key] is not None, names[key]))
+            rank = numpy.empty(len(distinct), dtype=numpy.int64)
+            rank[numpy.searchsorted(distinct, ranking)] = numpy.arange(len(ranking))
+            ranks.append(rank[numpy.searchsorted(distinct, keys)])
+            unpacked.append((keys, names))
+        # lexsort's last key is the primary one: the first group_by column
+        order = numpy.lexsort(ranks)
+        shown = list(zip(*[[names[key] for key in keys[order].tolist()] for keys, names in reversed(unpacked)]))
+        return len(unique), inverse, shown, order
+
+    @timed("analytics.totals")
+    def totals(self, group_by=("category", "currency"), expense_filter=None):
+        """(*group values, sum, count) rows, like ExpenseRepository.totals."""
+        import numpy
+
+        selected = self.mask(expense_filter)
+        count, inverse, shown, order = self.groups(group_by, selected)
+        counts = numpy.bincount(inverse, minlength=count)[order]
+        sums = numpy.rint(numpy.bincount(inverse, weights=self.amounts[selected], minlength=count))[order]
+        return [(*keys, total, rows)
+                for keys, total, rows in zip(shown, sums.astype(numpy.int64).tolist(), counts.tolist())]
+
+    @timed("analytics.statistics")
+    def statistics(self, group_by=("category",), expense_filter=None, quantiles=QUANTILES):
+        """(*group values, count, sum, mean, *quantiles) rows; mean and quantiles in (fractional) minor units.
+
+        Amounts of different currencies cannot be compared, so either
+        group_by includes "currency" or expense_filter selects one currency.
+        Quantiles interpolate linearly, like numpy.quantile.
+        """
+        import numpy
+
+        if "currency" not in group_by and (expense_filter is None or expense_filter.currency is None):
+            raise ValueError("statistics need one currency per group: group by currency or filter on one")
+        selected = self.mask(expense_filter)
+        count, inverse, shown, order = self.groups(group_by, selected)
+        if not count:
+            return []
+        amounts = self.amounts[selected]
+        # Every group's amounts become one sorted run; quantiles are then index arithmetic on the runs
+        smallest = int(amounts.min())
+        span = int(amounts.max()) - smallest + 1
+        if count * span < 2 ** 62:
+            # (group, amount) packed into one int64 sorts many times faster than lexsort
+            ordered = (numpy.sort(inverse * span + (amounts - smallest)) % span + smallest).astype(numpy.float64)
+        else:
+            ordered = amounts[numpy.lexsort((amounts, inverse))].astype(numpy.float64)
+        counts = numpy.bincount(inverse, minlength=count)
+        starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+        sums = numpy.bincount(inverse, weights=amounts, minlength=count)
+        columns = []
+        for quantile in quantiles:
+            position = starts + quantile * (counts - 1)
+            low = numpy.floor(position).astype(numpy.int64)
+            high = numpy.minimum(low + 1, starts + counts - 1)
+            columns.append((ordered[low] + (ordered[high] - ordered[low]) * (position - low))[order].tolist())
+        counts, sums = counts[order], sums[order]
+        return [(*keys, rows, total, mean, *values)
+                for keys, rows, total, mean, *values in zip(
+                    shown, counts.tolist(), numpy.rint(sums).astype(numpy.int64).tolist(), (sums / counts).tolist(),
+                    *columns)]
+
+    @timed("analytics.month_over_month")
+    def month_over_month(self, expense_filter=None):
+        """MonthChange per calendar month from the first to the last selected expense, empty months included.
+
+        change is None for the first month and after a month with no spending.
+        Needs one currency, as statistics does.
+        """
+        import numpy
+
+        if expense_filter is None or expense_filter.currency is None:
+            raise ValueError("month_over_month needs a filter on one currency")
+        selected = self.mask(expense_filter)
+        months = self.key_column("month", selected)
+        if not len(months):
+            return []
+        first = int(months.min())
+        totals = numpy.bincount(months - first, weights=self.amounts[selected])
+        previous = numpy.concatenate(([0.0], totals[:-1]))
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            changes = numpy.where(previous != 0, (totals - previous) / numpy.abs(previous), numpy.nan)
+        return [MonthChange(self.shown_key("month", first + index), int(round(total)),
+                            None if numpy.isnan(change) else float(change))
+                for index, (total, change) in enumerate(zip(totals, changes))]
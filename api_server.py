@@ -0,0 +1,371 @@
+"""Local HTTP/JSON API over the expense database, for phones and scripts.
+
+    python expense_cli.py serve --port 8765
+    curl -d '{"date": "2024-05-01", "category": "Food", "amount": "12.50", "currency": "EUR"}' \\
+        http://127.0.0.1:8765/expenses
+    curl 'http://127.0.0.1:8765/expenses?category=Food&period=2024&limit=100'
+    curl 'http://127.0.0.1:8765/totals?by=month,currency&period=2024'
+
+Endpoints:
+
+    GET  /expenses       newest first, like the GUI table. Filters: period
+                         (yyyy or yyyy-mm), start and end (ISO dates, end
+                         exclusive), category, currency, min_amount and
+                         max_amount (need currency), q (full-text search).
+                         Pages: limit (default 100, at most 1000) and after,
+                         the "next" cursor of the previous page.
+    GET  /expenses/<id>  one expense
+    POST /expenses       a JSON object (date, category, amount, currency,
+                         optional description) or an array of them; an
+                         array is written in one transaction
+    GET  /totals         sum and count per group, by=month,category,... and
+                         the same filters as /expenses
+    GET  /health
+
+Amounts are decimal strings in major units ("12.50"), as in exporter, so no
+float rounding creeps in. Errors are {"error": message} with a 4xx or 5xx
+status.
+
+Connections are served by asyncio (HTTP/1.1 with keep-alive, standard
+library only). SQLite calls run on a ConnectionPool: a few reader threads
+sharing a small set of connections, and one writer thread with its own
+connection. SQLite allows one writer at a time anyway, so queuing writes in
+the process avoids spinning on the lock, and under WAL the readers keep
+answering while a write commits. Every write goes through the journal, so
+undo in the GUI or `expense_cli.py journal undo` reverts API writes too.
+"""
+import asyncio
+import datetime
+import json
+import queue
+import sqlite3
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from expense_core import (
+    CURRENCY_DATA, TUNING_PRAGMAS, ExpenseFilter, ExpenseRepository, decimal_to_minor, format_decimal, period_bounds
+)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_READERS = 4
+DEFAULT_PAGE = 100
+MAX_PAGE = 1000
+
+# Request bodies larger than this are refused with 413
+MAX_BODY = 8 * 1024 * 1024
+
+EXPENSE_FIELDS = ("id", "date", "category", "amount", "currency", "description")
+
+
+class ApiError(Exception):
+    """A request the client got wrong; answered with status and {"error": message}."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ConnectionPool:
+    """Runs repository calls on threads, each call with a connection of its own.
+
+    Reads take any idle connection from a pool of readers; writes all go to
+    one writer thread and its connection, in the order they were submitted.
+    """
+
+    def __init__(self, path, readers=DEFAULT_READERS, pragmas=TUNING_PRAGMAS):
+        self.path = path
+        # The pool hands each connection to one thread at a time, so sqlite3's same-thread check can go
+        self.writer = ExpenseRepository(path, pragmas, check_same_thread=False)
+        self.readers = [ExpenseRepository(path, pragmas, check_same_thread=False) for _ in range(readers)]
+        self.idle = queue.SimpleQueue()
+        for repository in self.readers:
+            self.idle.put(repository)
+        self.read_executor = ThreadPoolExecutor(readers, thread_name_prefix="expense-read")
+        self.write_executor = ThreadPoolExecutor(1, thread_name_prefix="expense-write")
+
+    def call_reader(self, function, args):
+        # Never blocks: there are as many reader threads as reader connections
+        repository = self.idle.get()
+        try:
+            return function(repository, *args)
+        finally:
+            self.idle.put(repository)
+
+    def call_writer(self, function, args):
+        return function(self.writer, *args)
+
+    async def read(self, function, *args):
+        """Await function(repository, *args) on a reader connection."""
+        return await asyncio.get_running_loop().run_in_executor(self.read_executor, self.call_reader, function, args)
+
+    async def write(self, function, *args):
+        """Await function(repository, *args) on the writer connection."""
+        return await asyncio.get_running_loop().run_in_executor(self.write_executor, self.call_writer, function, args)
+
+    def close(self):
+        self.read_executor.shutdown()
+        self.write_executor.shutdown()
+        for repository in self.readers + [self.writer]:
+            repository.close()
+
+
+def expense_json(record):
+    expense_id, date, category, amount, currency, description, _ = record
+    return dict(zip(EXPENSE_FIELDS, (expense_id, date, category, format_decimal(amount, currency), currency,
+                                     description)))
+
+
+def page_cursor(record):
+    # (position, id) of the last record, the keyset fetch_page continues from
+    return f"{record[6]},{record[0]}"
+
+
+def parse_cursor(text):
+    try:
+        position, expense_id = (int(part) for part in text.split(","))
+    except ValueError:
+        raise ApiError(400, f"Invalid cursor {text!r}") from None
+    return position, expense_id
+
+
+def iso_date(text, name):
+    try:
+        return datetime.datetime.strptime(text, "%Y-%m-%d").date().isoformat()
+    except (TypeError, ValueError):
+        raise ApiError(400, f"{name} must be a yyyy-mm-dd date, got {text!r}") from None
+
+
+def minor_units(text, currency, name):
+    if isinstance(text, bool) or not isinstance(text, (str, int, float)):
+        raise ApiError(400, f"{name} must be a decimal string such as \"12.50\"")
+    try:
+        return decimal_to_minor(str(text), currency)
+    except (ValueError, ArithmeticError):
+        raise ApiError(400, f"Invalid {name} {text!r}") from None
+
+
+def int_parameter(query, name, default):
+    text = query.get(name)
+    if text is None:
+        return default
+    try:
+        return int(text)
+    except ValueError:
+        raise ApiError(400, f"{name} must be an integer, got {text!r}") from None
+
+
+def read_filter(query):
+    """Build an ExpenseFilter from query parameters (see the module docstring)."""
+    start, end = query.get("start"), query.get("end")
+    if "period" in query:
+        try:
+            start, end = period_bounds(query["period"])
+        except ValueError as error:
+            raise ApiError(400, str(error)) from None
+    start = iso_date(start, "start") if start is not None else None
+    end = iso_date(end, "end") if end is not None else None
+
+    currency = query.get("currency")
+    if currency is not None and currency not in CURRENCY_DATA:
+        raise ApiError(400, f"Unknown currency {currency!r}")
+    bounds = []
+    for name in ("min_amount", "max_amount"):
+        text = query.get(name)
+        if text is not None and currency is None:
+            # Minor units of different currencies are not comparable
+            raise ApiError(400, f"{name} needs a currency")
+        bounds.append(minor_units(text, currency, name) if text is not None else None)
+
+    return ExpenseFilter(start, end, query.get("category"), currency, *bounds, query.get("q") or None)
+
+
+def read_expense(item):
+    """(date, category, amount, currency, description) from a posted JSON object."""
+    if not isinstance(item, dict):
+        raise ApiError(400, "Each expense must be a JSON object")
+    missing = [name for name in ("date", "category", "amount", "currency") if name not in item]
+    if missing:
+        raise ApiError(400, f"Missing field(s) {', '.join(missing)}")
+    currency = item["currency"]
+    if not isinstance(currency, str) or currency not in CURRENCY_DATA:
+        raise ApiError(400, f"Unknown currency {currency!r}")
+    category, description = item["category"], item.get("description", "")
+    if not isinstance(category, str) or not category.strip():
+        raise ApiError(400, "category must be a non-empty string")
+    if not isinstance(description, str):
+        raise ApiError(400, "description must be a string")
+    return (iso_date(item["date"], "date"), category.strip(), minor_units(item["amount"], currency, "amount"),
+            currency, description)
+
+
+class ApiServer:
+    """Routes HTTP requests to the repository through a ConnectionPool."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def load_currencies(self, codes):
+        """Read the currency table again if one of codes is new to this process, e.g. added by the GUI or CLI."""
+        if any(isinstance(code, str) and code not in CURRENCY_DATA for code in codes):
+            await self.pool.read(ExpenseRepository.register_currency_formats)
+
+    async def list_expenses(self, query):
+        await self.load_currencies([query.get("currency")])
+        expense_filter = read_filter(query)
+        limit = int_parameter(query, "limit", DEFAULT_PAGE)
+        if not 1 <= limit <= MAX_PAGE:
+            raise ApiError(400, f"limit must be between 1 and {MAX_PAGE}")
+        after = parse_cursor(query["after"]) if "after" in query else None
+        records = await self.pool.read(ExpenseRepository.fetch_page, after, limit, expense_filter)
+        await self.load_currencies({record[4] for record in records})
+        return 200, {
+            "expenses": [expense_json(record) for record in records],
+            "next": page_cursor(records[-1]) if len(records) == limit else None,
+        }
+
+    async def get_expense(self, expense_id):
+        record = await self.pool.read(ExpenseRepository.get, expense_id)
+        if record is None:
+            raise ApiError(404, f"No expense {expense_id}")
+        await self.load_currencies([record[4]])
+        return 200, expense_json(record)
+
+    async def add_expenses(self, body):
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            raise ApiError(400, "Body must be JSON") from None
+        items = payload if isinstance(payload, list) else [payload]
+        await self.load_currencies([item.get("currency") for item in items if isinstance(item, dict)])
+        if isinstance(payload, list):
+            rows = [read_expense(item) for item in payload]
+            added = await self.pool.write(partial(ExpenseRepository.add_many, label="Add expenses (API)"), rows)
+            return 201, {"added": added}
+        record = await self.pool.write(ExpenseRepository.add, *read_expense(payload))
+        return 201, expense_json(record)
+
+    async def totals(self, query):
+        group_by = [column for column in query.get("by", "category,currency").split(",") if column]
+        for column in group_by:
+            if column not in ExpenseRepository.GROUP_COLUMNS:
+                raise ApiError(400, f"Cannot group by {column!r}")
+        # As in expense_cli totals, minor units of different currencies cannot be added
+        if "currency" not in group_by:
+            group_by.append("currency")
+        await self.load_currencies([query.get("currency")])
+        rows = await self.pool.read(ExpenseRepository.totals, group_by, read_filter(query))
+        currency_column = group_by.index("currency")
+        await self.load_currencies({row[currency_column] for row in rows})
+        return 200, {"totals": [
+            {**dict(zip(group_by, keys)), "total": format_decimal(total, keys[currency_column]), "count": count}
+            for *keys, total, count in rows
+        ]}
+
+    async def dispatch(self, method, target, body):
+        """Return (status, JSON payload) for one request."""
+        url = urlsplit(target)
+        path = url.path.rstrip("/") or "/"
+        # Repeated parameters: the last one wins
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            if path == "/expenses":
+                if method == "GET":
+                    return await self.list_expenses(query)
+                if method == "POST":
+                    return await self.add_expenses(body)
+                raise ApiError(405, f"{method} not allowed on {path}")
+            if path.startswith("/expenses/"):
+                if method != "GET":
+                    raise ApiError(405, f"{method} not allowed on {path}")
+                expense_id = path[len("/expenses/"):]
+                if not expense_id.isdigit():
+                    raise ApiError(404, f"No such resource {path}")
+                return await self.get_expense(int(expense_id))
+            if path == "/totals" and method == "GET":
+                return await self.totals(query)
+            if path == "/health" and method == "GET":
+                return 200, {"status": "ok"}
+            raise ApiError(404, f"No such resource {method} {path}")
+        except ApiError as error:
+            return error.status, {"error": str(error)}
+        except sqlite3.Error as error:
+            return 500, {"error": f"Database error: {error}"}
+        except Exception as error:
+            # A bug should cost the client one 500, not the connection (and a response)
+            traceback.print_exc()
+            return 500, {"error": f"Internal error: {type(error).__name__}"}
+
+    async def handle_connection(self, reader, writer):
+        """Serve HTTP/1.1 requests on one connection until the client closes it."""
+        try:
+            while True:
+                try:
+                    request_line = await reader.readline()
+                    if not request_line:
+                        break
+                    method, target, version = request_line.decode("latin-1").split()
+                    headers = {}
+                    while True:
+                        line = await reader.readline()
+                        if line in (b"\r\n", b"\n", b""):
+                            break
+                        name, _, value = line.decode("latin-1").partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                    length = self.content_length(method, headers)
+                except ValueError:
+                    # Also raised by readline for lines over the stream limit
+                    await self.respond(writer, 400, {"error": "Malformed request"}, keep_alive=False)
+                    break
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, {"error": "Request body too large"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                status, payload = await self.dispatch(method, target, body)
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def content_length(method, headers):
+        """The request's body length; ValueError if Content-Length is missing on a POST, not a number or negative."""
+        text = headers.get("content-length")
+        if text is None:
+            if method == "POST":
+                raise ValueError("Content-Length required")
+            return 0
+        if not text.isdigit():
+            raise ValueError(f"Invalid Content-Length {text!r}")
+        return int(text)
+
+    async def respond(self, writer, status, payload, keep_alive=True):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+
+
+async def serve(path="expense.db", host=DEFAULT_HOST, port=DEFAULT_PORT, readers=DEFAULT_READERS, on_ready=None):
+    """Serve the API until cancelled. on_ready, if given, is called with the bound (host, port)."""
+    pool = ConnectionPool(path, readers)
+    try:
+        server = await asyncio.start_server(ApiServer(pool).handle_connection, host, port)
+        async with server:
+            if on_ready is not None:
+                on_ready(server.sockets[0].getsockname()[:2])
+            await server.serve_forever()
+    finally:
+        pool.close()
@@ -0,0 +1,481 @@
+"""Benchmarks for the hot paths, on seeded synthetic ledgers.
+
+    python bench.py --sizes 10000 100000 1000000 --output results.json
+    python bench.py --sizes 10000 --compare results.json
+    python bench.py --sizes 10000 --untuned --output untuned.json
+    python bench.py --sizes 100000 --startup-budget-ms 800
+
+Each size gets a fresh database filled by generate_ledger (same seed, same
+ledger) across every category in CATEGORIES and currency in CURRENCY_DATA.
+The benchmarks time loading the table the way the GUI does (through
+ExpenseTableModel on the offscreen Qt platform, or repository pages when
+PyQt5 is missing), add/insert/delete, filtering, aggregation, the
+analytics cache (when NumPy is installed) and the recurring-expense
+catch-up. Results are
+written as JSON so runs from different commits can be compared. --untuned
+opens the databases with SQLite's default pragmas instead of TUNING_PRAGMAS,
+to measure what the tuning profile buys.
+
+Cold start is measured in fresh processes (startup_benchmarks): from
+process start to the first paint of the window and to the first screenful
+of rows on screen. If the median of the latter exceeds --startup-budget-ms
+for any size, or it could not be measured although PyQt5 is installed, the
+exit status is 1 (after the results are written).
+
+The amount formatting code that amount_format replaced is kept below as
+legacy_*, to time against; tests/test_amount_format.py checks that both
+agree and that parse/format round-trip.
+"""
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import platform
+import random
+import re
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from expense_core import (
+    CATEGORIES, CURRENCY_DATA, TUNING_PRAGMAS, ExpenseFilter, ExpenseRepository, amount_format, format_amounts,
+    period_bounds
+)
+import analytics
+import fx
+import recurring
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+# Default --startup-budget-ms; tests/test_startup.py holds a small ledger to it as well
+STARTUP_BUDGET_MS = 1000.0
+WORDS = ["coffee", "lunch", "monthly", "ticket", "groceries", "refill", "gift", "online", "store", "annual",
+         "prague", "berlin", "airport", "pharmacy", "weekend", "delivery", "subscription", "repair", "book", "snack"]
+FIRST_DAY = datetime.date(2015, 1, 1)
+LAST_DAY = datetime.date(2025, 12, 31)
+
+
+def generate_ledger(repository, rows, seed=42):
+    """Append rows seeded random expenses spread over FIRST_DAY..LAST_DAY."""
+    generator = random.Random(seed)
+    currencies = sorted(CURRENCY_DATA)
+    first = FIRST_DAY.toordinal()
+    span = LAST_DAY.toordinal() - first
+
+    def expenses():
+        for _ in range(rows):
+            currency = generator.choice(currencies)
+            # Log-uniform amounts between 0.50 and 5,000.00 in major units
+            amount = round(10 ** generator.uniform(-0.3, 3.7) * 10 ** CURRENCY_DATA[currency]['decimals'])
+            yield (
+                datetime.date.fromordinal(first + generator.randrange(span + 1)).isoformat(),
+                generator.choice(CATEGORIES),
+                amount,
+                currency,
+                " ".join(generator.sample(WORDS, 3)),
+            )
+
+    repository.add_many(expenses(), batch_size=20000)
+
+
+def generate_rates(repository, seed=42):
+    """Store one seeded exchange rate per currency per month, so FX totals can be timed."""
+    generator = random.Random(seed)
+    rates = []
+    for currency in sorted(CURRENCY_DATA):
+        if currency == fx.BASE_CURRENCY:
+            continue
+        level = generator.uniform(0.5, 400)
+        for year in range(FIRST_DAY.year, LAST_DAY.year + 1):
+            for month in range(1, 13):
+                rates.append((currency, f"{year:04d}-{month:02d}-01", level * generator.uniform(0.95, 1.05)))
+    with repository.transaction():
+        repository.connection.executemany("INSERT OR REPLACE INTO fx_rates (currency, date, rate) VALUES (?, ?, ?)", rates)
+
+
+def measure(function, repeat):
+    """Run function repeat times and return timing statistics in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timing_stats(timings)
+
+
+def timing_stats(timings):
+    """Statistics of a list of timings in milliseconds, as measure() reports them."""
+    timings = sorted(timings)
+    repeat = len(timings)
+    return {
+        "repeat": repeat,
+        "min_ms": round(timings[0], 4),
+        "median_ms": round(statistics.median(timings), 4),
+        "mean_ms": round(statistics.fmean(timings), 4),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 4),
+    }
+
+
+def load_benchmarks(repository, repeat):
+    """Time the first screen and ten scrolled windows, like load_table in the GUI."""
+    try:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        from PyQt5.QtWidgets import QApplication
+        from main import ExpenseTableModel
+    except ImportError:
+        def load():
+            page = repository.fetch_page(None, 256)
+            for _ in range(10):
+                page = repository.fetch_page((page[-1][6], page[-1][0]), 256)
+        return {"load_pages": measure(load, repeat)}
+
+    application = QApplication.instance() or QApplication([])
+    model = ExpenseTableModel(repository)
+
+    def load():
+        model.reload()
+        for _ in range(10):
+            model.fetchMore()
+        model.data(model.index(0, 3))
+
+    results = {"load_model": measure(load, repeat)}
+    application.processEvents()
+    return results
+
+
+def mutation_benchmarks(repository, repeat):
+    generator = random.Random(7)
+    expense_ids = [row[0] for row in repository.connection.execute(
+        "SELECT id FROM expenses ORDER BY random() LIMIT ?", (repeat * 2,))]
+    expense = ("2025-06-15", "Food", 1250, "EUR", "benchmark")
+    added = []
+
+    def add():
+        added.append(repository.add(*expense)[0])
+
+    def insert_after():
+        added.append(repository.insert_after(generator.choice(expense_ids), *expense)[0][0])
+
+    def delete():
+        repository.delete(added.pop())
+
+    return {
+        "add": measure(add, repeat),
+        "insert_after": measure(insert_after, repeat),
+        "delete": measure(delete, repeat * 2),
+    }
+
+
+# Run in a fresh interpreter per sample by startup_benchmarks: builds and shows the window the way
+# main.py does and prints time.monotonic() at each milestone (the clock is shared between processes)
+STARTUP_PROBE = """
+import json, sys, time
+from PyQt5.QtCore import QEvent, QObject, QTimer
+from PyQt5.QtWidgets import QApplication
+import main
+
+marks = {"imported": time.monotonic()}
+app = QApplication([])
+window = main.ExpenseApp(main.ExpenseRepository(sys.argv[1]), main.DatabaseThread(sys.argv[1]))
+marks["constructed"] = time.monotonic()
+
+
+class PaintProbe(QObject):
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Paint:
+            marks.setdefault("first_paint", time.monotonic())
+            if window.model.rowCount() and "interactive" not in marks:
+                # First screenful painted; the next idle turn of the event loop ends the run
+                marks["interactive"] = time.monotonic()
+                QTimer.singleShot(0, app.quit)
+        return False
+
+
+probe = PaintProbe()
+window.table.viewport().installEventFilter(probe)
+QTimer.singleShot(30000, app.quit)
+window.show()
+app.exec_()
+marks["idle"] = time.monotonic()
+window.close()
+print(json.dumps(marks))
+"""
+
+
+def startup_benchmarks(path, repeat):
+    """Cold start of the GUI on path: process start to first paint, and to the first screenful of rows.
+
+    Every sample is a new interpreter, so imports, Qt initialisation, the
+    stylesheet and the first page are all paid again. Returns {} if a probe
+    fails (PyQt5 or a platform plugin missing, a crash), and leaves out
+    startup_interactive if rows were not painted within the probe's 30 s.
+    """
+    environment = dict(os.environ)
+    environment.setdefault("QT_QPA_PLATFORM", "offscreen")
+    samples = {}
+    for _ in range(repeat):
+        start = time.monotonic()
+        completed = subprocess.run([sys.executable, "-c", STARTUP_PROBE, path], capture_output=True, text=True,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)), env=environment)
+        if completed.returncode != 0 or not completed.stdout.strip():
+            print("Startup probe failed:", completed.stderr.strip().splitlines()[-1:], file=sys.stderr)
+            return {}
+        marks = json.loads(completed.stdout.splitlines()[-1])
+        if "interactive" not in marks:
+            print("Startup probe: no rows painted within 30 s", file=sys.stderr)
+        for name in ("imported", "constructed", "first_paint", "interactive"):
+            if name in marks:
+                samples.setdefault(f"startup_{name}", []).append((marks[name] - start) * 1000)
+    # A median over the runs that did paint rows would hide the ones that never did
+    if len(samples.get("startup_interactive", ())) < repeat:
+        samples.pop("startup_interactive", None)
+    return {name: timing_stats(timings) for name, timings in samples.items()}
+
+
+def recurring_benchmarks(repository, repeat, rules=300):
+    """Time catch_up writing a year of monthly occurrences for rules rules; each run covers the next year."""
+    generator = random.Random(11)
+    start = LAST_DAY + datetime.timedelta(days=1)
+    for number in range(rules):
+        recurring.add_rule(repository, generator.choice(CATEGORIES), generator.randrange(100, 20000),
+                           generator.choice(sorted(CURRENCY_DATA)), f"subscription {number}", "monthly",
+                           (start + datetime.timedelta(days=generator.randrange(28))).isoformat())
+    years = iter(range(start.year, start.year + repeat))
+    return {f"recurring_catch_up_{rules}_rules_year": measure(
+        lambda: recurring.catch_up(repository, datetime.date(next(years), 12, 31)), repeat)}
+
+
+def filter_benchmarks(repository, repeat):
+    start, end = period_bounds("2020-03")
+    filters = {
+        "filter_category": ExpenseFilter(category="Food"),
+        "filter_month": ExpenseFilter(start=start, end=end),
+        "filter_currency_amount": ExpenseFilter(currency="CZK", min_amount=100000, max_amount=200000),
+        "filter_text": ExpenseFilter(text="airport coff"),
+        "filter_combined": ExpenseFilter(start="2019-01-01", end="2021-01-01", category="Takeout", text="lunch"),
+    }
+    return {name: measure(lambda expense_filter=expense_filter: repository.fetch_page(None, 256, expense_filter), repeat)
+            for name, expense_filter in filters.items()}
+
+
+def aggregate_benchmarks(repository, repeat):
+    year = ExpenseFilter(*period_bounds("2024"))
+    converter = fx.FxConverter(repository)
+    return {
+        "totals_rollup_month_category_currency": measure(
+            lambda: repository.totals(("month", "category", "currency")), repeat),
+        "totals_scan_text_filter": measure(
+            lambda: repository.totals(("currency",), ExpenseFilter(text="pharmacy")), repeat),
+        "fx_total_year": measure(lambda: converter.total("EUR", year), repeat),
+    }
+
+
+def analytics_benchmarks(repository, repeat):
+    """Time building the analytics cache, syncing 1,000 new expenses into it and its queries (needs NumPy)."""
+    if not analytics.available():
+        return {}
+    results = {"analytics_build": measure(lambda: analytics.AnalyticsCache(repository), repeat)}
+    cache = analytics.AnalyticsCache(repository)
+    expense = ("2025-06-15", "Food", 1250, "EUR", "benchmark")
+    timings = []
+    for _ in range(repeat):
+        repository.add_many([expense] * 1000)
+        start = time.perf_counter()
+        cache.sync(repository)
+        timings.append((time.perf_counter() - start) * 1000)
+    results["analytics_sync_1000"] = timing_stats(timings)
+
+    euro = ExpenseFilter(currency="EUR")
+    results.update({
+        "analytics_totals_month_category_currency": measure(
+            lambda: cache.totals(("month", "category", "currency")), repeat),
+        "analytics_statistics_category": measure(lambda: cache.statistics(("category",), euro), repeat),
+        "analytics_month_over_month": measure(lambda: cache.month_over_month(euro), repeat),
+    })
+    return results
+
+
+def legacy_format_amount(amount, currency_data):
+    """How load_table formatted a (float, major unit) amount before amount_format existed."""
+    amount_str = "{:,.2f}".format(amount)
+    amount_str = amount_str.replace(',', 'TEMP').replace('.', currency_data['decimal_sep']).replace('TEMP', currency_data['thousand_sep'])
+    return f"{currency_data['symbol']}{amount_str}"
+
+
+def legacy_reformat_input(text, cursor_pos, decimal_sep, thousand_sep):
+    """ExpenseApp.format_amount before amount_format, as a pure function returning (text, cursor)."""
+    text_without_thousand_sep = text.replace(thousand_sep, '')
+    cursor_pos_without_thousand_sep = cursor_pos - text[:cursor_pos].count(thousand_sep)
+    if not text_without_thousand_sep:
+        return '', 0
+
+    negative = False
+    if text_without_thousand_sep.startswith('-'):
+        negative = True
+        text_without_thousand_sep = text_without_thousand_sep[1:]
+        cursor_pos_without_thousand_sep -= 1
+    if decimal_sep in text_without_thousand_sep:
+        integer_part, decimal_part = text_without_thousand_sep.split(decimal_sep, 1)
+    else:
+        integer_part = text_without_thousand_sep
+        decimal_part = ''
+    integer_part = re.sub(r'\D', '', integer_part)
+    decimal_part = re.sub(r'\D', '', decimal_part)
+    if integer_part:
+        reversed_integer = integer_part[::-1]
+        grouped = [reversed_integer[i:i+3] for i in range(0, len(reversed_integer), 3)]
+        integer_part_with_thousand_sep = thousand_sep.join(grouped)[::-1]
+    else:
+        integer_part_with_thousand_sep = ''
+    if decimal_part != '':
+        formatted_text = integer_part_with_thousand_sep + decimal_sep + decimal_part
+    elif decimal_sep in text_without_thousand_sep and text_without_thousand_sep.endswith(decimal_sep):
+        formatted_text = integer_part_with_thousand_sep + decimal_sep
+    else:
+        formatted_text = integer_part_with_thousand_sep
+    if negative:
+        formatted_text = '-' + formatted_text
+        cursor_pos_without_thousand_sep += 1
+
+    new_cursor_pos = 0
+    idx_without_thousand_sep = 0
+    for char in formatted_text:
+        if idx_without_thousand_sep >= cursor_pos_without_thousand_sep:
+            break
+        if char != thousand_sep:
+            idx_without_thousand_sep += 1
+        new_cursor_pos += 1
+    return formatted_text, new_cursor_pos
+
+
+def amount_benchmarks(seed, repeat, rows=10000):
+    """Micro-benchmarks of display formatting, parsing and keystroke reformatting."""
+    generator = random.Random(seed)
+    currencies = [generator.choice(sorted(CURRENCY_DATA)) for _ in range(rows)]
+    amounts = [round(10 ** generator.uniform(1, 7)) for _ in range(rows)]
+    typed = [amount_format(currency).format(amount)[len(amount_format(currency).symbol):]
+             for amount, currency in zip(amounts, currencies)]
+    euro = amount_format("EUR")
+    keystrokes = ["1234567,89"[:length] for length in range(1, 11)]
+    return {
+        f"format_column_{rows}": measure(lambda: format_amounts(amounts, currencies), repeat),
+        f"legacy_format_column_{rows}": measure(
+            lambda: [legacy_format_amount(amount / 100, CURRENCY_DATA[currency])
+                     for amount, currency in zip(amounts, currencies)], repeat),
+        f"parse_column_{rows}": measure(
+            lambda: [amount_format(currency).parse(text) for text, currency in zip(typed, currencies)], repeat),
+        "reformat_keystrokes_1000": measure(
+            lambda: [euro.reformat_input(text, len(text)) for _ in range(100) for text in keystrokes], repeat),
+        "legacy_reformat_keystrokes_1000": measure(
+            lambda: [legacy_reformat_input(text, len(text), ",", ".") for _ in range(100) for text in keystrokes],
+            repeat),
+    }
+
+
+def run(sizes, seed, repeat, workdir, pragmas, startup_runs=5):
+    results = {"amounts": amount_benchmarks(seed, repeat)}
+    for size in sizes:
+        path = os.path.join(workdir, f"bench-{size}-{seed}.db")
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+        repository = ExpenseRepository(path, pragmas)
+        start = time.perf_counter()
+        generate_ledger(repository, size, seed)
+        generate_rates(repository, seed)
+        generate_seconds = time.perf_counter() - start
+        print(f"{size:,} rows generated in {generate_seconds:.1f} s", file=sys.stderr)
+
+        size_results = {"generate_s": round(generate_seconds, 3)}
+        # First, while the ledger is exactly what generate_ledger wrote
+        size_results.update(startup_benchmarks(path, startup_runs))
+        for benchmarks in (load_benchmarks, filter_benchmarks, aggregate_benchmarks, analytics_benchmarks,
+                           mutation_benchmarks, recurring_benchmarks):
+            size_results.update(benchmarks(repository, repeat))
+        results[str(size)] = size_results
+
+        repository.close()
+        os.remove(path)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current):
+    """Print median ratios current/previous for every benchmark both runs have."""
+    for size, benchmarks in current["results"].items():
+        for name, stats in benchmarks.items():
+            before = previous["results"].get(size, {}).get(name)
+            if isinstance(stats, dict) and isinstance(before, dict) and before["median_ms"]:
+                ratio = stats["median_ms"] / before["median_ms"]
+                print(f"{size:>8} {name:<40} {before['median_ms']:>10.3f} -> {stats['median_ms']:>10.3f} ms  x{ratio:.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="ledger sizes in rows")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=20, help="runs per timed operation")
+    parser.add_argument("--workdir", default=tempfile.gettempdir(), help="where the generated databases go")
+    parser.add_argument("--output", help="write JSON results here (default: stdout)")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--untuned", action="store_true", help="use SQLite's default pragmas")
+    parser.add_argument("--startup-runs", type=int, default=5, help="fresh processes per cold-start benchmark")
+    parser.add_argument("--startup-budget-ms", type=float, default=STARTUP_BUDGET_MS,
+                        help="fail if the median time to the first screenful of rows is above this (0: no limit)")
+    args = parser.parse_args(argv)
+    pragmas = {} if args.untuned else TUNING_PRAGMAS
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "pragmas": pragmas,
+        "results": run(args.sizes, args.seed, args.repeat, args.workdir, pragmas, args.startup_runs),
+    }
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(json.load(previous), report)
+
+    if not args.startup_budget_ms or args.startup_runs < 1:
+        return 0
+    # Without PyQt5 there is nothing to measure; with it, a missing measurement is the worst regression of all
+    gui_available = importlib.util.find_spec("PyQt5") is not None
+    over_budget = []
+    for size, results in report["results"].items():
+        if size == "amounts":
+            continue
+        if "startup_interactive" not in results:
+            if gui_available:
+                print(f"Cold start not measured at {size} rows: the startup probe failed", file=sys.stderr)
+                over_budget.append(size)
+        elif results["startup_interactive"]["median_ms"] > args.startup_budget_ms:
+            print(f"Cold start over budget at {size} rows: {results['startup_interactive']['median_ms']:.0f} ms "
+                  f"> {args.startup_budget_ms:.0f} ms", file=sys.stderr)
+            over_budget.append(size)
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
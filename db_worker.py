@@ -0,0 +1,160 @@
+"""Background thread for database work, so the GUI event loop never waits on SQLite.
+
+SQLite connections belong to the thread that opened them, so the worker
+opens its own ExpenseRepository on the same file inside its thread. With WAL
+its reads do not wait for writes on the GUI connection, or the other way round.
+Calls run one at a time in the order they were submitted. Results, errors and
+progress come back to the GUI thread as queued signals:
+
+    database = DatabaseThread("expense.db")
+    task = database.submit(ExpenseRepository.fetch_page, None, 256, on_result=show_rows)
+    task.cancel()
+
+With profiling on, each task is timed as worker.<qualified name> and the
+time it spent queued behind earlier tasks as worker.queue_wait.
+
+Cancelling a task abandons it at the next SQLite progress-handler check or
+at its next progress report. Its callbacks never run after that.
+"""
+import time
+
+from PyQt5.QtCore import QObject, QThread, pyqtSignal, pyqtSlot
+
+import profiling
+from expense_core import TUNING_PRAGMAS, ExpenseRepository
+
+# SQLite VM instructions between cancellation checks: cheap enough not to
+# show in query times, frequent enough to stop a scan within a frame
+CANCEL_CHECK_INSTRUCTIONS = 10000
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class DatabaseTask:
+    """One submitted call. cancel() may be called from any thread."""
+
+    def __init__(self, function, args, on_result=None, on_error=None, on_progress=None):
+        self.function = function
+        self.args = args
+        self.on_result = on_result
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.cancelled = False
+        self.submitted_at = time.perf_counter()
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class DatabaseWorker(QObject):
+    """Lives on the worker thread and runs tasks against its own repository."""
+
+    finished = pyqtSignal(object, object)
+    failed = pyqtSignal(object, object)
+    progressed = pyqtSignal(object, object)
+
+    def __init__(self, path, pragmas=TUNING_PRAGMAS):
+        super().__init__()
+        self.path = path
+        self.pragmas = pragmas
+        self.repository = None
+
+    @pyqtSlot(object)
+    def run(self, task):
+        if task.cancelled:
+            profiling.increment("worker.cancelled_before_start")
+            self.failed.emit(task, TaskCancelled())
+            return
+        try:
+            if self.repository is None:
+                self.repository = ExpenseRepository(self.path, self.pragmas)
+            # A non-zero return from the handler makes SQLite abort the statement
+            self.repository.connection.set_progress_handler(lambda: task.cancelled, CANCEL_CHECK_INSTRUCTIONS)
+            kwargs = {"progress": lambda value: self.report(task, value)} if task.on_progress else {}
+            if profiling.ENABLED:
+                profiling.record("worker.queue_wait", (time.perf_counter() - task.submitted_at) * 1000)
+            with profiling.timed(f"worker.{task.function.__qualname__}"):
+                result = task.function(self.repository, *task.args, **kwargs)
+        except Exception as error:
+            # Forwarded to the GUI thread, which drops it if the task was
+            # cancelled (SQLite raises "interrupted", progress TaskCancelled)
+            self.failed.emit(task, error)
+        else:
+            self.finished.emit(task, result)
+        finally:
+            if self.repository is not None:
+                self.repository.connection.set_progress_handler(None, 0)
+
+    def report(self, task, value):
+        if task.cancelled:
+            raise TaskCancelled()
+        self.progressed.emit(task, value)
+
+    @pyqtSlot()
+    def close(self):
+        if self.repository is not None:
+            self.repository.close()
+            self.repository = None
+        # Queued behind every task already submitted, so this is the last event the thread handles
+        self.thread().quit()
+
+
+class DatabaseThread(QObject):
+    """GUI-side handle: submits calls to a DatabaseWorker and routes their signals back."""
+
+    submitted = pyqtSignal(object)
+    closing = pyqtSignal()
+
+    def __init__(self, path, pragmas=TUNING_PRAGMAS, parent=None):
+        super().__init__(parent)
+        self.pending = set()
+        self.worker_thread = QThread()
+        self.worker = DatabaseWorker(path, pragmas)
+        self.worker.moveToThread(self.worker_thread)
+
+        self.submitted.connect(self.worker.run)
+        self.closing.connect(self.worker.close)
+        self.worker.finished.connect(self.task_finished)
+        self.worker.failed.connect(self.task_failed)
+        self.worker.progressed.connect(self.task_progressed)
+        self.worker_thread.start()
+
+    def submit(self, function, *args, on_result=None, on_error=None, on_progress=None):
+        """Queue function(repository, *args) on the worker thread and return its DatabaseTask.
+
+        on_progress, if given, is passed to function as progress= and
+        receives every value it reports. A cancelled task stops at the next
+        report.
+        """
+        task = DatabaseTask(function, args, on_result, on_error, on_progress)
+        self.pending.add(task)
+        self.submitted.emit(task)
+        return task
+
+    def task_finished(self, task, result):
+        self.pending.discard(task)
+        if not task.cancelled and task.on_result is not None:
+            task.on_result(result)
+
+    def task_failed(self, task, error):
+        self.pending.discard(task)
+        if task.cancelled:
+            return
+        if task.on_error is not None:
+            task.on_error(error)
+        else:
+            print("Database Error in background task:", error)
+
+    def task_progressed(self, task, value):
+        if not task.cancelled and task.on_progress is not None:
+            task.on_progress(value)
+
+    def close(self):
+        """Cancel whatever is still queued, close the worker's connection and join the thread."""
+        for task in self.pending:
+            task.cancel()
+        self.pending.clear()
+        self.closing.emit()
+        self.worker_thread.wait()
@@ -0,0 +1,419 @@
+"""Headless command line tools for the expense database.
+
+    python expense_cli.py import bank.csv --currency EUR --category Food
+    python expense_cli.py export ledger.parquet --period 2024
+    python expense_cli.py totals --by month currency --period 2024
+    python expense_cli.py stats --by category --currency EUR --period 2024
+    python expense_cli.py report 2024/*.db --by month category --workers 4
+    python expense_cli.py rollups check
+    python expense_cli.py journal changes --since 1200
+    python expense_cli.py journal undo
+    python expense_cli.py categories add "Pet Food"
+    python expense_cli.py currencies add KWD --symbol KD --decimals 3
+    python expense_cli.py recurring add --category Rent --amount 950 --currency EUR --every monthly --start 2025-01-01
+    python expense_cli.py recurring run
+    python expense_cli.py fx load rates.csv
+    python expense_cli.py fx total --to EUR --period 2025
+    python expense_cli.py serve --port 8765
+    python expense_cli.py --profile totals.prof totals --by month
+"""
+import argparse
+import datetime
+import json
+import sqlite3
+import sys
+
+import analytics
+import exporter
+import fx
+import importer
+import profiling
+import recurring
+import report_engine
+from expense_core import (
+    CURRENCY_DATA, JOURNAL_KEEP_BATCHES, ExpenseFilter, ExpenseRepository, decimal_to_minor, format_amount,
+    period_bounds
+)
+
+
+def known_currency(repository, code):
+    """code in upper case if the database has that currency; ValueError otherwise."""
+    code = code.upper()
+    if repository.currencies.id(code) is None:
+        raise ValueError(f"Unknown currency {code!r}; add it first with `currencies add {code}`")
+    return code
+
+
+def command_import(args):
+    repository = ExpenseRepository(args.db)
+    try:
+        args.currency = known_currency(repository, args.currency)
+        for path in args.files:
+            result = importer.import_file(repository, path, args.currency, args.category, args.batch_size)
+            print(f"{path}: imported {result.rows:,} rows in {result.seconds:.2f} s "
+                  f"({result.rows_per_second:,.0f} rows/sec)")
+    except (OSError, ValueError, sqlite3.Error) as error:
+        print(f"Import failed: {error}", file=sys.stderr)
+        return 1
+    finally:
+        repository.close()
+    return 0
+
+
+def command_export(args):
+    repository = ExpenseRepository(args.db)
+    try:
+        start, end = args.period or (None, None)
+        result = exporter.export_file(repository, args.file, args.format, ExpenseFilter(start, end), args.page_size)
+    except (OSError, ValueError, ImportError, sqlite3.Error) as error:
+        print(f"Export failed: {error}", file=sys.stderr)
+        return 1
+    finally:
+        repository.close()
+    print(f"{args.file}: exported {result.rows:,} rows in {result.seconds:.2f} s "
+          f"({result.rows_per_second:,.0f} rows/sec)")
+    return 0
+
+
+def command_totals(args):
+    # Minor units of different currencies cannot be added, so totals are always split by currency
+    group_by = args.by if "currency" in args.by else args.by + ["currency"]
+    repository = ExpenseRepository(args.db)
+    try:
+        start, end = args.period or (None, None)
+        rows = repository.totals(group_by, ExpenseFilter(start, end))
+    finally:
+        repository.close()
+
+    currency_column = group_by.index("currency")
+    for *keys, total, count in rows:
+        amount = format_amount(total, keys[currency_column])
+        print("\t".join(str(key) for key in keys), amount, count, sep="\t")
+    return 0
+
+
+def command_stats(args):
+    if not analytics.available():
+        print("stats needs NumPy (pip install numpy)", file=sys.stderr)
+        return 1
+    # Without --currency every group is split by currency, as in totals
+    group_by = args.by if args.currency or "currency" in args.by else args.by + ["currency"]
+    repository = ExpenseRepository(args.db)
+    try:
+        start, end = args.period or (None, None)
+        expense_filter = ExpenseFilter(start, end, currency=args.currency)
+        rows = analytics.AnalyticsCache(repository).statistics(group_by, expense_filter)
+    finally:
+        repository.close()
+
+    for *keys, count, total, mean, median, high in rows:
+        currency = args.currency or keys[group_by.index("currency")]
+        print("\t".join(str(key) for key in keys), count,
+              *(format_amount(round(value), currency) for value in (total, mean, median, high)), sep="\t")
+    return 0
+
+
+def command_report(args):
+    # As in totals, minor units of different currencies cannot be added
+    group_by = args.by if "currency" in args.by else args.by + ["currency"]
+    start, end = args.period or (None, None)
+    try:
+        result = report_engine.report(args.files, group_by, ExpenseFilter(start, end), args.workers)
+    except (OSError, sqlite3.Error) as error:
+        print(f"Report failed: {error}", file=sys.stderr)
+        return 1
+
+    currency_column = group_by.index("currency")
+    for *keys, total, count, minimum, maximum in result.rows:
+        currency = keys[currency_column]
+        print("\t".join("" if key is None else str(key) for key in keys), format_amount(total, currency), count,
+              format_amount(minimum, currency), format_amount(maximum, currency), sep="\t")
+    print(f"{result.files} database(s) aggregated in {result.seconds:.2f} s by {result.workers} process(es)",
+          file=sys.stderr)
+    return 0
+
+
+def command_rollups(args):
+    repository = ExpenseRepository(args.db)
+    try:
+        if args.action == "rebuild":
+            repository.rebuild_rollups()
+            print("Rollups rebuilt.")
+            return 0
+
+        mismatches = repository.check_rollups()
+    finally:
+        repository.close()
+
+    for month, category, currency, stored, expected in mismatches:
+        print(f"{month}\t{category}\t{currency}\tstored={stored}\texpected={expected}")
+    if mismatches:
+        print(f"{len(mismatches)} rollup bucket(s) differ from a full recompute; run 'rollups rebuild'.",
+              file=sys.stderr)
+        return 1
+    print("Rollups match a full recompute.")
+    return 0
+
+
+def command_journal(args):
+    repository = ExpenseRepository(args.db)
+    try:
+        if args.action == "changes":
+            # JSON Lines, one change per line, for incremental consumers to replay in seq order
+            for entry in repository.changes_since(args.since, args.limit):
+                print(json.dumps(entry._asdict(), ensure_ascii=False))
+        elif args.action == "head":
+            print(repository.journal_head())
+        elif args.action == "compact":
+            removed = repository.compact_journal(args.keep)
+            print(f"Removed {removed:,} journal entries.")
+        else:
+            label = repository.undo() if args.action == "undo" else repository.redo()
+            print(f"{args.action.capitalize()}: {label}" if label else f"Nothing to {args.action}.")
+    except (LookupError, sqlite3.Error) as error:
+        print(f"Journal {args.action} failed: {error}", file=sys.stderr)
+        return 1
+    finally:
+        repository.close()
+    return 0
+
+
+def command_categories(args):
+    repository = ExpenseRepository(args.db)
+    try:
+        if args.action == "add":
+            for name in args.names:
+                repository.add_category(name)
+                print(f"Added {name.strip()}.")
+        else:
+            print("\n".join(repository.category_names()))
+    except (ValueError, sqlite3.Error) as error:
+        print(f"Categories {args.action} failed: {error}", file=sys.stderr)
+        return 1
+    finally:
+        repository.close()
+    return 0
+
+
+def command_currencies(args):
+    repository = ExpenseRepository(args.db)
+    try:
+        if args.action == "add":
+            if not args.code:
+                print("currencies add needs a currency code", file=sys.stderr)
+                return 1
+            repository.add_currency(args.code, args.symbol if args.symbol is not None else args.code,
+                                    args.decimal_sep, args.thousand_sep, args.decimals)
+            print(f"Added {args.code.upper()}: {format_amount(-123456789, args.code.upper())}")
+        else:
+            for code in sorted(CURRENCY_DATA):
+                print(code, format_amount(123456789, code), sep="\t")
+    except (ValueError, sqlite3.Error) as error:
+        print(f"Currencies {args.action} failed: {error}", file=sys.stderr)
+        return 1
+    finally:
+        repository.close()
+    return 0
+
+
+def command_recurring(args):
+    repository = ExpenseRepository(args.db)
+    try:
+        if args.action == "add":
+            if args.category is None or args.amount is None:
+                print("recurring add needs --category and --amount", file=sys.stderr)
+                return 1
+            args.currency = known_currency(repository, args.currency)
+            rule_id = recurring.add_rule(repository, args.category, decimal_to_minor(args.amount, args.currency),
+                                         args.currency, args.description, args.every, args.start, args.interval,
+                                         args.end)
+            print(f"Added recurring rule {rule_id}; run `recurring run` to write what is due.")
+        elif args.action == "list":
+            for rule in recurring.list_rules(repository):
+                every = rule.frequency if rule.interval == 1 else f"every {rule.interval} {rule.frequency[:-2]}s"
+                print(rule.id, rule.category, format_amount(rule.amount, rule.currency), every,
+                      f"{rule.start_date}..{rule.end_date or ''}", f"next {rule.next_date or 'ended'}",
+                      rule.description, sep="\t")
+        elif args.action == "delete":
+            if args.id is None:
+                print("recurring delete needs a rule id", file=sys.stderr)
+                return 1
+            recurring.delete_rule(repository, args.id)
+            print(f"Deleted recurring rule {args.id}; expenses it already wrote are kept.")
+        else:
+            result = recurring.catch_up(repository, args.through)
+            print(f"Wrote {result.rows:,} expenses for {result.rules:,} rules in {result.seconds:.3f} s")
+    except (LookupError, ValueError, sqlite3.Error) as error:
+        print(f"Recurring {args.action} failed: {error}", file=sys.stderr)
+        return 1
+    finally:
+        repository.close()
+    return 0
+
+
+def command_fx_load(args):
+    repository = ExpenseRepository(args.db)
+    try:
+        loaded = fx.load_rates(repository, args.file)
+    except (OSError, ValueError, sqlite3.Error) as error:
+        print(f"Loading rates failed: {error}", file=sys.stderr)
+        return 1
+    finally:
+        repository.close()
+    print(f"Loaded {loaded:,} exchange rates.")
+    return 0
+
+
+def command_fx_total(args):
+    repository = ExpenseRepository(args.db)
+    try:
+        start, end = args.period or (None, None)
+        args.to = known_currency(repository, args.to)
+        total = fx.FxConverter(repository).total(args.to, ExpenseFilter(start, end))
+    except (LookupError, ValueError, sqlite3.Error) as error:
+        print(f"Conversion failed: {error}", file=sys.stderr)
+        return 1
+    finally:
+        repository.close()
+    print(format_amount(total, args.to))
+    return 0
+
+
+def command_serve(args):
+    # Only serve needs asyncio and the server; every other command starts without them
+    import asyncio
+
+    import api_server
+
+    def ready(address):
+        # loadtest.py waits for this line to learn the port when started with --port 0
+        print(f"Serving {args.db} on http://{address[0]}:{address[1]}", flush=True)
+
+    try:
+        # Options left out take the server's defaults
+        options = {name: value for name, value in (("host", args.host), ("port", args.port),
+                                                   ("readers", args.readers)) if value is not None}
+        asyncio.run(api_server.serve(args.db, on_ready=ready, **options))
+    except KeyboardInterrupt:
+        pass
+    except (OSError, sqlite3.Error) as error:
+        print(f"Server failed: {error}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Expense Tracker command line tools")
+    parser.add_argument("--db", default="expense.db", help="database file (default: expense.db)")
+    parser.add_argument("--profile", metavar="FILE", help="write cProfile stats of the command to FILE")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="bulk import CSV or OFX bank exports")
+    import_parser.add_argument("files", nargs="+", help="CSV (date, amount[, category, currency, description]) or OFX files")
+    import_parser.add_argument("--currency", default="USD",
+                               help="currency for CSV rows without a currency column (any code in the database)")
+    import_parser.add_argument("--category", default=importer.DEFAULT_CATEGORY,
+                               help="category for rows without a category column")
+    import_parser.add_argument("--batch-size", type=int, default=importer.BATCH_SIZE,
+                               help="rows per executemany batch")
+    import_parser.set_defaults(handler=command_import)
+
+    export_parser = commands.add_parser("export", help="stream expenses to CSV, JSON Lines or Parquet")
+    export_parser.add_argument("file", help="output file; the format follows the extension unless --format is given")
+    export_parser.add_argument("--format", choices=sorted(exporter.WRITERS), help="csv, jsonl or parquet")
+    export_parser.add_argument("--period", type=period_bounds, help="only this year (yyyy) or month (yyyy-mm)")
+    export_parser.add_argument("--page-size", type=int, default=exporter.PAGE_SIZE,
+                               help="rows read per keyset page")
+    export_parser.set_defaults(handler=command_export)
+
+    totals_parser = commands.add_parser("totals", help="print sum and count per group")
+    totals_parser.add_argument("--by", nargs="+", default=["category", "currency"],
+                               choices=sorted(ExpenseRepository.GROUP_COLUMNS), help="columns to group by")
+    totals_parser.add_argument("--period", type=period_bounds, help="only this year (yyyy) or month (yyyy-mm)")
+    totals_parser.set_defaults(handler=command_totals)
+
+    stats_parser = commands.add_parser("stats", help="count, total, mean, median and 90th percentile per group")
+    stats_parser.add_argument("--by", nargs="+", default=["category"], choices=analytics.GROUP_KEYS,
+                              help="columns to group by")
+    stats_parser.add_argument("--currency", help="only expenses in this currency (otherwise grouped by currency)")
+    stats_parser.add_argument("--period", type=period_bounds, help="only this year (yyyy) or month (yyyy-mm)")
+    stats_parser.set_defaults(handler=command_stats)
+
+    report_parser = commands.add_parser("report", help="sum, count, min and max per group across many databases")
+    report_parser.add_argument("files", nargs="+", help="expense databases, e.g. one per person and year")
+    report_parser.add_argument("--by", nargs="+", default=["month", "category", "currency"],
+                               choices=sorted(ExpenseRepository.GROUP_COLUMNS), help="columns to group by")
+    report_parser.add_argument("--period", type=period_bounds, help="only this year (yyyy) or month (yyyy-mm)")
+    report_parser.add_argument("--workers", type=int, help="worker processes (default: one per CPU)")
+    report_parser.set_defaults(handler=command_report)
+
+    rollups_parser = commands.add_parser("rollups", help="rebuild or verify the monthly summary tables")
+    rollups_parser.add_argument("action", choices=["check", "rebuild"])
+    rollups_parser.set_defaults(handler=command_rollups)
+
+    journal_parser = commands.add_parser("journal", help="change journal: incremental changes, undo/redo, compaction")
+    journal_parser.add_argument("action", choices=["changes", "head", "undo", "redo", "compact"])
+    journal_parser.add_argument("--since", type=int, default=0, help="changes: only entries after this seq")
+    journal_parser.add_argument("--limit", type=int, default=10000, help="changes: at most this many entries")
+    journal_parser.add_argument("--keep", type=int, default=JOURNAL_KEEP_BATCHES,
+                                help="compact: number of newest batches to keep")
+    journal_parser.set_defaults(handler=command_journal)
+
+    categories_parser = commands.add_parser("categories", help="list the categories or add new ones")
+    categories_parser.add_argument("action", choices=["list", "add"])
+    categories_parser.add_argument("names", nargs="*", help="add: category names")
+    categories_parser.set_defaults(handler=command_categories)
+
+    currencies_parser = commands.add_parser("currencies", help="list the currencies or add one with its formatting")
+    currencies_parser.add_argument("action", choices=["list", "add"])
+    currencies_parser.add_argument("code", nargs="?", help="add: ISO currency code, e.g. KWD")
+    currencies_parser.add_argument("--symbol", help="add: symbol shown before amounts (default: the code)")
+    currencies_parser.add_argument("--decimal-sep", default=".", help="add: decimal separator (default: .)")
+    currencies_parser.add_argument("--thousand-sep", default=",", help="add: thousands separator (default: ,)")
+    currencies_parser.add_argument("--decimals", type=int, default=2, help="add: digits after the decimal separator")
+    currencies_parser.set_defaults(handler=command_currencies)
+
+    recurring_parser = commands.add_parser("recurring", help="recurring expenses: add, list or delete rules, "
+                                                              "write the occurrences that are due")
+    recurring_parser.add_argument("action", choices=["add", "list", "delete", "run"])
+    recurring_parser.add_argument("id", nargs="?", type=int, help="delete: rule id")
+    recurring_parser.add_argument("--category", help="add: category of the expenses")
+    recurring_parser.add_argument("--amount", help="add: amount per occurrence, e.g. 12.99")
+    recurring_parser.add_argument("--currency", default="USD", help="any currency code in the database")
+    recurring_parser.add_argument("--description", default="", help="add: description of the expenses")
+    recurring_parser.add_argument("--every", default="monthly", choices=recurring.FREQUENCIES)
+    recurring_parser.add_argument("--interval", type=int, default=1, help="add: repeat every N weeks/months/years")
+    recurring_parser.add_argument("--start", default=datetime.date.today().isoformat(),
+                                  help="add: first occurrence, yyyy-mm-dd (default: today)")
+    recurring_parser.add_argument("--end", help="add: last possible occurrence, yyyy-mm-dd")
+    recurring_parser.add_argument("--through", type=datetime.date.fromisoformat,
+                                  help="run: write occurrences up to this date (default: today)")
+    recurring_parser.set_defaults(handler=command_recurring)
+
+    fx_parser = commands.add_parser("fx", help="exchange rates and converted totals")
+    fx_commands = fx_parser.add_subparsers(dest="fx_command", required=True)
+    fx_load_parser = fx_commands.add_parser("load", help="load rates from a CSV file (date, currency, rate per 1 EUR)")
+    fx_load_parser.add_argument("file")
+    fx_load_parser.set_defaults(handler=command_fx_load)
+    fx_total_parser = fx_commands.add_parser("total", help="total of all expenses converted to one currency")
+    fx_total_parser.add_argument("--to", default=fx.BASE_CURRENCY, help="any currency code in the database")
+    fx_total_parser.add_argument("--period", type=period_bounds, help="only this year (yyyy) or month (yyyy-mm)")
+    fx_total_parser.set_defaults(handler=command_fx_total)
+
+    serve_parser = commands.add_parser("serve", help="local HTTP/JSON API: add, list, filter and total expenses")
+    serve_parser.add_argument("--host", help="address to listen on (default: 127.0.0.1)")
+    serve_parser.add_argument("--port", type=int, help="port to listen on, 0 for any free port (default: 8765)")
+    serve_parser.add_argument("--readers", type=int, help="pooled read connections (default: 4)")
+    serve_parser.set_defaults(handler=command_serve)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    with profiling.capture(args.profile):
+        return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1109 @@
+"""Qt-free data layer: the expense repository, dates, filtering and aggregation.
+
+Only the standard library is used and sqlite3 is imported on first use, so
+scripts, servers and batch jobs can import this module without PyQt5 or a
+display. The GUI in main.py is a thin client of ExpenseRepository.
+"""
+import json
+import os
+import sys
+from collections import namedtuple
+from contextlib import contextmanager
+
+# Amount helpers live in amount_format; re-exported here for existing callers
+from amount_format import (
+    CURRENCY_DATA, UNKNOWN_CURRENCY, amount_format, decimal_to_minor, format_amount, format_amounts, format_decimal,
+    minor_unit_factor, parse_amount, register_currencies, register_currency
+)
+from profiling import increment, timed
+
+# Bumped whenever open_database gains a migration step; stored in PRAGMA user_version
+SCHEMA_VERSION = 9
+
+# Rows rewritten per transaction by data migrations, so other connections can
+# keep reading and writing between batches
+MIGRATION_BATCH = 50000
+
+# Gap between consecutive position keys; inserts take the midpoint of two keys,
+# so roughly log2(POSITION_GAP) inserts fit between two rows before a rebalance
+POSITION_GAP = 1 << 20
+
+# compact_journal keeps this many of the newest journal batches, which is
+# also how many steps back undo can go after a compaction
+JOURNAL_KEEP_BATCHES = 1000
+
+# Every write transaction that opens a batch numbered a multiple of this
+# compacts the journal before it commits, whichever connection wrote it, so
+# the journal stays between JOURNAL_KEEP_BATCHES and that plus this many batches
+JOURNAL_COMPACT_EVERY = 100
+
+# Categories every new database starts with; users add more to the categories table
+CATEGORIES = [
+    "Rent", "Utilities", "House Payment", "Internet", "Savings (Acorn)", "Savings Account",
+    "Medicaid", "GoodRX", "Medication Payment", "Medicare (Part B)", "Medicare (Part A)",
+    "American Health Insurance", "Czech Health Insurance", "German Health Insurance",
+    "Slovak Health Insurance", "American Dental Insurance", "Czech Dental Insurance",
+    "German Dental Insurance", "Slovak Dental Insurance", "Teeth Cleaning", "Night Guard",
+    "Dental Work", "Uber Ride", "Bus Ride", "Tram Ride", "Subway Ride", "Train Ride",
+    "Train (Snack)", "Train (Drink)", "Taxi Ride", "Plane Ticket",
+    "Plane (Select Seating)", "Plane (Upgrade Seat)", "Plane (Baggage Payment)",
+    "Plane (Internet Payment)", "Plane (Buy Alcohol)", "Plane (Buy Snack)",
+    "Food Delivery", "Takeout", "Dining Out", "Food", "Dessert", "Drinks", "Alcohol",
+    "Marijuana", "Clothing", "Shoes", "Regular Book Purchase",
+    "Regular Newspaper Purchase", "Furniture", "Mattress", "Painting", "Kitchen Appliance",
+    "Computer", "Printer", "Electronics", "TV Payment", "Dishware/Tableware", "Cutlery",
+    "Household Cleaning Supplies", "Miscellaneous Apartment Items", "Google One",
+    "New York Times", "Der Spiegel", "Amazon Prime", "Amazon (Purchase Video)",
+    "Amazon Kindle (Purchase Book)", "Amazon Kindle (Audio Book)", "YouTube Music Premium",
+    "DVD", "CD", "Crunchyroll Subscription", "Crunchyroll Merchandise",
+    "Czech Phone Payment", "German Phone Payment", "Google Phone Payment", "Netflix",
+    "Disney+", "ChatGPT", "App Deploying Service", "Payment for AI", "Disney+ Package",
+    "Hulu", "ESPN", "Adobe Scan", "Duolingo", "Tinder", "New York Times Cooking",
+    "Adobe Acrobat Reader: Edit PDF"
+]
+
+# One change from the journal: before/after are records (id, date, category,
+# amount, currency, description, position), None for the side that does not exist
+JournalEntry = namedtuple("JournalEntry", "seq op expense_id before after")
+
+# Criteria for listing expenses; None means "any". start/end are an ISO date
+# range [start, end), min/max_amount are minor units, text is a full-text
+# search over description and category
+ExpenseFilter = namedtuple(
+    "ExpenseFilter", "start end category currency min_amount max_amount text", defaults=(None,) * 7)
+
+
+def display_date(iso_date):
+    """Turn a stored yyyy-mm-dd date into the dd-mm-yyyy form shown in the GUI."""
+    if len(iso_date) == 10 and iso_date[4] == '-':
+        return f"{iso_date[8:10]}-{iso_date[5:7]}-{iso_date[0:4]}"
+    return iso_date
+
+
+def period_bounds(period):
+    """Return the [start, end) ISO date range for "yyyy" or "yyyy-mm"."""
+    if len(period) == 4:
+        return f"{int(period):04d}-01-01", f"{int(period) + 1:04d}-01-01"
+    year, month = int(period[:4]), int(period[5:7])
+    if len(period) != 7 or period[4] != '-' or not 1 <= month <= 12:
+        raise ValueError(f"Invalid period {period!r}, expected yyyy or yyyy-mm")
+    if month == 12:
+        return f"{year:04d}-12-01", f"{year + 1:04d}-01-01"
+    return f"{year:04d}-{month:02d}-01", f"{year:04d}-{month + 1:02d}-01"
+
+
+# Amounts are integer minor units (cents, or whole yen for zero-decimal currencies);
+# category and currency are small integer keys into the categories and currencies tables
+EXPENSES_COLUMNS = (
+    "(id INTEGER PRIMARY KEY, date TEXT, category_id INTEGER REFERENCES categories (id), amount INTEGER, "
+    "currency_id INTEGER REFERENCES currencies (id), description TEXT, position INTEGER)")
+
+# The layout before schema version 8, with category and currency names in every row
+LEGACY_EXPENSES_COLUMNS = (
+    "(id INTEGER PRIMARY KEY, date TEXT, category TEXT, amount INTEGER, currency TEXT, description TEXT, position INTEGER)")
+
+
+# Connection tuning applied by open_database:
+# - WAL lets readers run alongside the writer, and with synchronous=NORMAL a
+#   commit appends to the log without an fsync (only checkpoints sync), which
+#   is still safe against application crashes and corruption;
+# - mmap and a larger page cache keep hot pages out of read() calls;
+# - busy_timeout makes a second connection wait for the writer instead of
+#   failing immediately with "database is locked".
+TUNING_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,  # negative means KiB, so 64 MiB
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+
+# sqlite3 keeps this many prepared statements per connection, keyed by SQL
+# text; every query here is built from a small fixed set of strings, so
+# repeated calls reuse a compiled statement instead of preparing it again
+STATEMENT_CACHE_SIZE = 256
+
+
+def open_database(path, pragmas=TUNING_PRAGMAS, check_same_thread=True, read_only=False):
+    """Open the expense database with sqlite3, creating or migrating the schema.
+
+    The connection is in autocommit mode (isolation_level=None); callers
+    group statements with explicit BEGIN/COMMIT. pragmas defaults to the
+    TUNING_PRAGMAS profile; pass {} for SQLite's defaults. Pass
+    check_same_thread=False only when the caller makes sure a single thread
+    uses the connection at a time (as api_server's pool does).
+
+    read_only=True opens an existing file with SQLite's mode=ro and changes
+    nothing in it: no schema work and no pragmas (journal_mode would write
+    the header). A file whose schema is not exactly SCHEMA_VERSION raises
+    sqlite3.DatabaseError rather than being read with the wrong layout.
+    """
+    import sqlite3
+
+    if read_only:
+        from urllib.request import pathname2url
+
+        connection = sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro", uri=True,
+                                     isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE,
+                                     check_same_thread=check_same_thread)
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            connection.close()
+            raise sqlite3.DatabaseError(f"{path} has schema version {version}, expected {SCHEMA_VERSION}; "
+                                        f"open it once with the app to migrate it")
+        return connection
+
+    connection = sqlite3.connect(path, isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE,
+                                 check_same_thread=check_same_thread)
+    for name, value in pragmas.items():
+        connection.execute(f"PRAGMA {name} = {value}")
+    connection.execute(f"CREATE TABLE IF NOT EXISTS expenses {EXPENSES_COLUMNS}")
+    migrate(connection)
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_expenses_position ON expenses (position)")
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses (date)")
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_expenses_category_date ON expenses (category_id, date)")
+    return connection
+
+
+def migrate(connection):
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+
+    if version < 1:
+        # Databases from before the position column: the old ids were the
+        # display order, so they seed the position keys
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(expenses)")]
+        if "position" not in columns:
+            with connection:
+                connection.execute("BEGIN")
+                connection.execute("ALTER TABLE expenses ADD COLUMN position INTEGER")
+                connection.execute("UPDATE expenses SET position = id * ?", (POSITION_GAP,))
+
+    if version < 2:
+        migrate_iso_dates(connection)
+
+    # Versions 3 (search index) and 4 (rollups) are built by migrate_lookup_keys
+    # (version 8) for the current table layout
+
+    if version < 5:
+        # Exchange rates for fx.py: 1 unit of the base currency (EUR) buys `rate` units of `currency`
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS fx_rates (currency TEXT NOT NULL, date TEXT NOT NULL, rate REAL NOT NULL, "
+            "PRIMARY KEY (currency, date)) WITHOUT ROWID")
+
+    if version < 6:
+        migrate_minor_units(connection)
+
+    if version < 7:
+        with connection:
+            connection.execute("BEGIN")
+            create_journal(connection)
+
+    if version < 8:
+        migrate_lookup_keys(connection)
+
+    if version < 9:
+        with connection:
+            connection.execute("BEGIN")
+            create_recurring_rules(connection)
+
+    connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def migrate_iso_dates(connection):
+    """Rewrite dd-MM-yyyy dates as yyyy-mm-dd, one id range per transaction.
+
+    Only rows still in the old format match the GLOB, so an interrupted
+    migration simply resumes where it stopped.
+    """
+    last_id = connection.execute("SELECT COALESCE(MAX(id), 0) FROM expenses").fetchone()[0]
+    for first_id in range(0, last_id + 1, MIGRATION_BATCH):
+        with connection:
+            connection.execute("BEGIN")
+            connection.execute(
+                "UPDATE expenses SET date = substr(date, 7, 4) || '-' || substr(date, 4, 2) || '-' || substr(date, 1, 2) "
+                "WHERE id BETWEEN ? AND ? AND date GLOB '[0-9][0-9]-[0-9][0-9]-[0-9][0-9][0-9][0-9]'",
+                (first_id, first_id + MIGRATION_BATCH - 1))
+
+
+def migrate_minor_units(connection):
+    """Convert REAL amounts into integer minor units.
+
+    SQLite cannot change a column's type, and integers written to a REAL
+    column are stored as floats again, so the table is rebuilt. This drops
+    its triggers; the search index and rollups are rebuilt by
+    migrate_lookup_keys, which always follows. Tables that already have an
+    INTEGER amount are left alone.
+    """
+    column_types = {row[1]: row[2].upper() for row in connection.execute("PRAGMA table_info(expenses)")}
+    if column_types.get("amount") != "REAL":
+        return
+
+    factors = " ".join(f"WHEN '{currency}' THEN {10 ** data['decimals']}" for currency, data in CURRENCY_DATA.items())
+    with connection:
+        connection.execute("BEGIN")
+        connection.execute(f"CREATE TABLE expenses_minor {LEGACY_EXPENSES_COLUMNS}")
+        connection.execute(
+            "INSERT INTO expenses_minor (id, date, category, amount, currency, description, position) "
+            f"SELECT id, date, category, CAST(ROUND(amount * CASE currency {factors} ELSE 100 END) AS INTEGER), "
+            "currency, description, position FROM expenses")
+        connection.execute("DROP TABLE expenses")
+        connection.execute("ALTER TABLE expenses_minor RENAME TO expenses")
+
+
+CURRENCY_COLUMNS = ("symbol", "decimal_sep", "thousand_sep", "decimals")
+
+
+def create_lookup_tables(connection):
+    """Create categories and currencies and seed them with CATEGORIES and CURRENCY_DATA.
+
+    Names and codes are never changed in place once rows point at them: the
+    search index and the journal images hold the text.
+    """
+    connection.execute("CREATE TABLE IF NOT EXISTS categories (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS currencies (id INTEGER PRIMARY KEY, code TEXT NOT NULL UNIQUE, "
+        "symbol TEXT NOT NULL, decimal_sep TEXT NOT NULL, thousand_sep TEXT NOT NULL, decimals INTEGER NOT NULL)")
+    connection.executemany("INSERT OR IGNORE INTO categories (name) VALUES (?)", ((name,) for name in CATEGORIES))
+    connection.executemany(
+        "INSERT OR IGNORE INTO currencies (code, symbol, decimal_sep, thousand_sep, decimals) VALUES (?, ?, ?, ?, ?)",
+        ((code, *(data[column] for column in CURRENCY_COLUMNS)) for code, data in CURRENCY_DATA.items()))
+
+
+def migrate_lookup_keys(connection):
+    """Replace the category and currency text of every row by keys into categories and currencies.
+
+    Names and codes used by existing rows but missing from the defaults are
+    added first (unknown currencies get UNKNOWN_CURRENCY's formatting). The
+    table is rebuilt in one transaction, like migrate_minor_units, and the
+    search index and rollups, which are keyed the same way, are recreated.
+    """
+    with connection:
+        connection.execute("BEGIN")
+        create_lookup_tables(connection)
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(expenses)")]
+        if "category" in columns:
+            connection.execute(
+                "INSERT OR IGNORE INTO categories (name) "
+                "SELECT DISTINCT category FROM expenses WHERE category IS NOT NULL ORDER BY category")
+            connection.execute(
+                "INSERT OR IGNORE INTO currencies (code, symbol, decimal_sep, thousand_sep, decimals) "
+                "SELECT DISTINCT currency, ?, ?, ?, ? FROM expenses WHERE currency IS NOT NULL ORDER BY currency",
+                tuple(UNKNOWN_CURRENCY[column] for column in CURRENCY_COLUMNS))
+            connection.execute(f"CREATE TABLE expenses_keyed {EXPENSES_COLUMNS}")
+            connection.execute(
+                "INSERT INTO expenses_keyed (id, date, category_id, amount, currency_id, description, position) "
+                "SELECT e.id, e.date, categories.id, e.amount, currencies.id, e.description, e.position "
+                "FROM expenses AS e LEFT JOIN categories ON categories.name = e.category "
+                "LEFT JOIN currencies ON currencies.code = e.currency")
+            connection.execute("DROP TABLE expenses")
+            connection.execute("ALTER TABLE expenses_keyed RENAME TO expenses")
+        connection.execute("DROP TABLE IF EXISTS expenses_fts")
+        connection.execute("DROP TABLE IF EXISTS expense_rollups")
+        create_search_index(connection)
+        create_rollups(connection)
+        rebuild_rollups(connection)
+
+
+def create_recurring_rules(connection):
+    """Create recurring_rules for recurring.py.
+
+    generated counts the occurrences already written to expenses and
+    next_date is the first one still due, NULL once the rule has ended, so
+    finding due rules is an index range scan.
+    """
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS recurring_rules (id INTEGER PRIMARY KEY, "
+        "category_id INTEGER REFERENCES categories (id), amount INTEGER NOT NULL, "
+        "currency_id INTEGER REFERENCES currencies (id), description TEXT NOT NULL DEFAULT '', "
+        "frequency TEXT NOT NULL CHECK (frequency IN ('weekly', 'monthly', 'yearly')), "
+        "interval INTEGER NOT NULL DEFAULT 1 CHECK (interval >= 1), start_date TEXT NOT NULL, end_date TEXT, "
+        "generated INTEGER NOT NULL DEFAULT 0, next_date TEXT)")
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_recurring_rules_next_date ON recurring_rules (next_date)")
+
+
+def create_search_index(connection):
+    """Create the FTS5 index over description and category and fill it.
+
+    It is an external-content table kept in sync by triggers, so every
+    writer, not just this module, updates it. The text lives only in the
+    tables: expense_search_content joins each row's description with its
+    category name.
+    """
+    connection.execute(
+        "CREATE VIEW IF NOT EXISTS expense_search_content AS "
+        "SELECT expenses.id AS id, expenses.description AS description, categories.name AS category "
+        "FROM expenses LEFT JOIN categories ON categories.id = expenses.category_id")
+    connection.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS expenses_fts USING fts5("
+        "description, category, content='expense_search_content', content_rowid='id')")
+    connection.executescript("""
+        CREATE TRIGGER IF NOT EXISTS expenses_fts_insert AFTER INSERT ON expenses BEGIN
+            INSERT INTO expenses_fts (rowid, description, category)
+            VALUES (new.id, new.description, (SELECT name FROM categories WHERE id = new.category_id));
+        END;
+        CREATE TRIGGER IF NOT EXISTS expenses_fts_delete AFTER DELETE ON expenses BEGIN
+            INSERT INTO expenses_fts (expenses_fts, rowid, description, category)
+            VALUES ('delete', old.id, old.description, (SELECT name FROM categories WHERE id = old.category_id));
+        END;
+        CREATE TRIGGER IF NOT EXISTS expenses_fts_update AFTER UPDATE OF description, category_id ON expenses BEGIN
+            INSERT INTO expenses_fts (expenses_fts, rowid, description, category)
+            VALUES ('delete', old.id, old.description, (SELECT name FROM categories WHERE id = old.category_id));
+            INSERT INTO expenses_fts (rowid, description, category)
+            VALUES (new.id, new.description, (SELECT name FROM categories WHERE id = new.category_id));
+        END;
+    """)
+    connection.execute("INSERT INTO expenses_fts (expenses_fts) VALUES ('rebuild')")
+
+
+# Recomputes expense_rollups from scratch; also the reference for check_rollups.
+# A missing category or currency is bucketed under key 0
+ROLLUP_QUERY = """
+    SELECT substr(date, 1, 7), COALESCE(category_id, 0), COALESCE(currency_id, 0), SUM(amount), COUNT(*)
+    FROM expenses GROUP BY 1, 2, 3
+"""
+
+
+def create_rollups(connection):
+    """Create the month x category x currency aggregate table and its triggers.
+
+    The triggers adjust one bucket per changed row, so the table is always
+    current and dashboard queries read O(buckets) rows instead of O(rows).
+    """
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS expense_rollups (
+            month TEXT NOT NULL, category_id INTEGER NOT NULL, currency_id INTEGER NOT NULL,
+            total INTEGER NOT NULL, count INTEGER NOT NULL,
+            PRIMARY KEY (month, category_id, currency_id)
+        ) WITHOUT ROWID;
+        CREATE TRIGGER IF NOT EXISTS expense_rollups_insert AFTER INSERT ON expenses BEGIN
+            INSERT INTO expense_rollups (month, category_id, currency_id, total, count)
+            VALUES (substr(new.date, 1, 7), COALESCE(new.category_id, 0), COALESCE(new.currency_id, 0), new.amount, 1)
+            ON CONFLICT (month, category_id, currency_id) DO UPDATE SET total = total + excluded.total, count = count + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS expense_rollups_delete AFTER DELETE ON expenses BEGIN
+            UPDATE expense_rollups SET total = total - old.amount, count = count - 1
+            WHERE month = substr(old.date, 1, 7) AND category_id = COALESCE(old.category_id, 0)
+              AND currency_id = COALESCE(old.currency_id, 0);
+            DELETE FROM expense_rollups
+            WHERE month = substr(old.date, 1, 7) AND category_id = COALESCE(old.category_id, 0)
+              AND currency_id = COALESCE(old.currency_id, 0) AND count = 0;
+        END;
+        CREATE TRIGGER IF NOT EXISTS expense_rollups_update
+        AFTER UPDATE OF date, category_id, currency_id, amount ON expenses BEGIN
+            UPDATE expense_rollups SET total = total - old.amount, count = count - 1
+            WHERE month = substr(old.date, 1, 7) AND category_id = COALESCE(old.category_id, 0)
+              AND currency_id = COALESCE(old.currency_id, 0);
+            DELETE FROM expense_rollups
+            WHERE month = substr(old.date, 1, 7) AND category_id = COALESCE(old.category_id, 0)
+              AND currency_id = COALESCE(old.currency_id, 0) AND count = 0;
+            INSERT INTO expense_rollups (month, category_id, currency_id, total, count)
+            VALUES (substr(new.date, 1, 7), COALESCE(new.category_id, 0), COALESCE(new.currency_id, 0), new.amount, 1)
+            ON CONFLICT (month, category_id, currency_id) DO UPDATE SET total = total + excluded.total, count = count + 1;
+        END;
+    """)
+
+
+def rebuild_rollups(connection):
+    """Recompute expense_rollups from the expenses table (inside the caller's transaction)."""
+    connection.execute("DELETE FROM expense_rollups")
+    connection.execute(f"INSERT INTO expense_rollups (month, category_id, currency_id, total, count) {ROLLUP_QUERY}")
+
+
+def create_journal(connection):
+    """Create the append-only change journal (see ExpenseRepository.undo and changes_since).
+
+    Every logical write opens a batch in journal_batches ("do" for user
+    actions, "undo"/"redo" for their reversal, target naming the batch
+    reversed) and appends one journal row per changed expense with JSON row
+    images before and/or after the change. Both are written in the same
+    transaction as the change itself, so the journal never disagrees with
+    the table after a crash. journal_state remembers the last seq removed
+    by compaction.
+    """
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS journal_batches (batch INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, "
+        "label TEXT, target INTEGER, undone INTEGER NOT NULL DEFAULT 0)")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS journal (seq INTEGER PRIMARY KEY AUTOINCREMENT, batch INTEGER NOT NULL, "
+        "op TEXT NOT NULL, expense_id INTEGER NOT NULL, before_image TEXT, after_image TEXT)")
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_journal_batch ON journal (batch)")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS journal_state (id INTEGER PRIMARY KEY CHECK (id = 1), "
+        "compacted_through INTEGER NOT NULL)")
+    connection.execute("INSERT OR IGNORE INTO journal_state (id, compacted_through) VALUES (1, 0)")
+
+
+def search_query(text):
+    """Turn free text into an FTS5 query matching rows that contain every word as a prefix."""
+    words = text.split()
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
+class LookupTable:
+    """In-memory copy of a small id <-> name table such as categories.
+
+    Names are interned, so all the records that mention a category share one
+    string. Each connection has its own copy, loaded when it opens; an id or
+    name it does not know makes it reload, which is how entries added through
+    another connection show up. on_loaded, if given, is called after every
+    load.
+    """
+
+    def __init__(self, connection, table, name_column, extra_columns=(), on_loaded=None):
+        self.connection = connection
+        self.on_loaded = on_loaded
+        self.select = f"SELECT id, {name_column} FROM {table}"
+        columns = (name_column,) + tuple(extra_columns)
+        self.insert = (f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) "
+                       f"VALUES ({', '.join('?' * len(columns))})")
+        self.load()
+
+    def load(self):
+        # id -> name, with NULL (a row from before the column was required) mapping to None
+        self.names = {None: None}
+        self.ids = {}
+        for key, name in self.connection.execute(self.select):
+            name = sys.intern(name)
+            self.names[key] = name
+            self.ids[name] = key
+        if self.on_loaded is not None:
+            self.on_loaded()
+
+    def name(self, key):
+        """The name for key; ids added by another connection are found by reloading."""
+        if key not in self.names:
+            self.load()
+        return self.names.get(key)
+
+    def id(self, name):
+        """The id of name, or None if there is no such entry."""
+        key = self.ids.get(name)
+        if key is None and name is not None:
+            self.load()
+            key = self.ids.get(name)
+        return key
+
+    def register(self, name, *extra_values):
+        """The id of name, inserting it first if it is new (inside the caller's transaction, if any)."""
+        key = self.id(name)
+        if key is None and name is not None:
+            self.connection.execute(self.insert, (name, *extra_values))
+            self.load()
+            key = self.ids[name]
+        return key
+
+
+class ExpenseRepository:
+    """All reads and writes of the expenses table.
+
+    Records are tuples (id, date, category, amount, currency, description,
+    position), ordered for display by position, newest (highest) first.
+    Amounts are integer minor units, so SUM is exact.
+    Dates are ISO yyyy-mm-dd text, indexed on (date) and (category_id, date),
+    so date ranges are index range scans. Reads accept an ExpenseFilter,
+    which is pushed down into SQL. Errors surface as sqlite3.Error.
+
+    Rows store category and currency as integer keys; the repository
+    translates names and codes through its LookupTable caches, so callers
+    only ever see the text. A name or code that is not in the tables yet is
+    added on first write.
+
+    Every write goes through the journal (create_journal), which gives undo,
+    redo and changes_since for incremental consumers. It compacts itself
+    every JOURNAL_COMPACT_EVERY batches (see transaction). Position-only updates
+    from rebalance_positions are not journaled, so a restored expense keeps
+    the position it had, which may no longer be exactly between its old
+    neighbours after a rebalance.
+    """
+
+    SELECT_COLUMNS = "SELECT id, date, category_id, amount, currency_id, description, position FROM expenses"
+
+    # Row image stored in the journal; the record without its id, with names rather than keys
+    JOURNAL_IMAGE = (
+        "json_array(date, (SELECT name FROM categories WHERE categories.id = expenses.category_id), amount, "
+        "(SELECT code FROM currencies WHERE currencies.id = expenses.currency_id), description, position)")
+
+    # SQL expressions the aggregation helpers may group by, over expenses and over expense_rollups
+    GROUP_COLUMNS = {
+        "category": "category_id",
+        "currency": "currency_id",
+        "month": "substr(date, 1, 7)",
+        "year": "substr(date, 1, 4)",
+    }
+    ROLLUP_COLUMNS = {
+        "category": "category_id",
+        "currency": "currency_id",
+        "month": "month",
+        "year": "substr(month, 1, 4)",
+    }
+    # What a grouped key is shown as
+    GROUP_NAMES = {
+        "category": "(SELECT name FROM categories WHERE categories.id = {})",
+        "currency": "(SELECT code FROM currencies WHERE currencies.id = {})",
+    }
+
+    def __init__(self, path="expense.db", pragmas=TUNING_PRAGMAS, check_same_thread=True, read_only=False):
+        self.path = path
+        self.connection = open_database(path, pragmas, check_same_thread, read_only)
+        self.categories = LookupTable(self.connection, "categories", "name")
+        # Whenever the codes are (re)loaded, their formats are too, so currencies added through
+        # another connection are formatted with their own rules and not UNKNOWN_CURRENCY's
+        self.currencies = LookupTable(self.connection, "currencies", "code", CURRENCY_COLUMNS,
+                                      self.register_currency_formats)
+        self.compaction_due = False
+        self.open_batches = []
+
+    def close(self):
+        self.connection.close()
+
+    @contextmanager
+    def transaction(self, mode="IMMEDIATE"):
+        """Run the block as one transaction, rolled back if it raises.
+
+        Writes use BEGIN IMMEDIATE, which takes the write lock up front, so
+        two connections never deadlock upgrading a read lock; read-only
+        snapshots pass mode="DEFERRED". Journal batches the block opened
+        but wrote no entries to are dropped, so they never become the target
+        of an undo. When start_batch found the journal due for compaction,
+        it is compacted last, in the same transaction.
+        """
+        self.connection.execute(f"BEGIN {mode}")
+        try:
+            yield self.connection
+            if self.open_batches:
+                self.drop_empty_batches(self.open_batches)
+            if self.compaction_due:
+                self.drop_journal_batches(JOURNAL_KEEP_BATCHES)
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            # Entries registered inside the transaction are gone again
+            self.categories.load()
+            self.currencies.load()
+            raise
+        finally:
+            self.compaction_due = False
+            self.open_batches = []
+        self.connection.execute("COMMIT")
+
+    def currency_formats(self):
+        """{code: formatting rules} of every currency in this database, as in CURRENCY_DATA."""
+        return {code: dict(zip(CURRENCY_COLUMNS, values)) for code, *values in self.connection.execute(
+            f"SELECT code, {', '.join(CURRENCY_COLUMNS)} FROM currencies ORDER BY id")}
+
+    def register_currency_formats(self):
+        """Make the formatting of currencies added to this database known to amount_format."""
+        register_currencies(self.currency_formats())
+
+    def category_names(self):
+        """Every category name, sorted for display."""
+        self.categories.load()
+        return sorted(self.categories.ids)
+
+    def add_category(self, name):
+        """Add a category (a no-op if it exists) and return its id."""
+        name = name.strip()
+        if not name:
+            raise ValueError("A category needs a name")
+        return self.categories.register(name)
+
+    def add_currency(self, code, symbol, decimal_sep, thousand_sep, decimals):
+        """Add a currency with its formatting rules and return its id.
+
+        Built-in codes and codes already in the table keep their rules.
+        """
+        currency_data = {"symbol": symbol, "decimal_sep": decimal_sep, "thousand_sep": thousand_sep,
+                         "decimals": decimals}
+        if not code.isalpha() or not 3 <= len(code) <= 4:
+            raise ValueError(f"Invalid currency code {code!r}")
+        if decimal_sep == thousand_sep or not decimal_sep or not 0 <= decimals <= 4:
+            raise ValueError("A currency needs distinct separators and 0 to 4 decimals")
+        return self.currencies.register(code.upper(), *(currency_data[column] for column in CURRENCY_COLUMNS))
+
+    def category_id(self, name):
+        """The key for category name, adding the category if it is new."""
+        key = self.categories.ids.get(name)
+        return key if key is not None or name is None else self.categories.register(name)
+
+    def currency_id(self, code):
+        """The key for currency code; codes not in the table are added with their CURRENCY_DATA rules."""
+        key = self.currencies.ids.get(code)
+        if key is not None or code is None:
+            return key
+        currency_data = CURRENCY_DATA.get(code, UNKNOWN_CURRENCY)
+        return self.currencies.register(code, *(currency_data[column] for column in CURRENCY_COLUMNS))
+
+    @timed("db.records")
+    def records(self, rows):
+        """Turn rows of SELECT_COLUMNS into records with category names and currency codes."""
+        increment("db.rows_read", len(rows))
+        try:
+            category_names, currency_codes = self.categories.names, self.currencies.names
+            return [(expense_id, date, category_names[category_id], amount, currency_codes[currency_id],
+                     description, position)
+                    for expense_id, date, category_id, amount, currency_id, description, position in rows]
+        except KeyError:
+            # A key added by another connection: reload, and map anything still unknown to None
+            self.categories.load()
+            self.currencies.load()
+            category_name, currency_code = self.categories.names.get, self.currencies.names.get
+            return [(expense_id, date, category_name(category_id), amount, currency_code(currency_id),
+                     description, position)
+                    for expense_id, date, category_id, amount, currency_id, description, position in rows]
+
+    def group_clauses(self, group_by, columns, missing=None):
+        """Return (SELECT list, GROUP BY list, ORDER BY list) for group_by over GROUP_COLUMNS or ROLLUP_COLUMNS.
+
+        Rows are grouped by the integer keys; each group's category name or
+        currency code is looked up once, in SQL, and the groups are sorted
+        by what is shown. A group without one (key 0 or NULL) shows as
+        missing, an SQL literal, or as NULL.
+        """
+        keys = [columns[column] for column in group_by]
+        shown = []
+        for column, key in zip(group_by, keys):
+            if column in self.GROUP_NAMES:
+                key = self.GROUP_NAMES[column].format(key)
+                if missing is not None:
+                    key = f"COALESCE({key}, {missing})"
+            shown.append(key)
+        return ", ".join(shown), ", ".join(keys), ", ".join(str(index + 1) for index in range(len(keys)))
+
+    def filter_conditions(self, expense_filter):
+        """Return (SQL conditions, parameters) for an ExpenseFilter, to be joined with AND."""
+        conditions, parameters = [], []
+        if expense_filter is None:
+            return conditions, parameters
+
+        if expense_filter.start is not None:
+            conditions.append("date >= ?")
+            parameters.append(expense_filter.start)
+        if expense_filter.end is not None:
+            conditions.append("date < ?")
+            parameters.append(expense_filter.end)
+        # An unknown name gives a NULL key, which matches no row
+        if expense_filter.category is not None:
+            conditions.append("category_id = ?")
+            parameters.append(self.categories.id(expense_filter.category))
+        if expense_filter.currency is not None:
+            conditions.append("currency_id = ?")
+            parameters.append(self.currencies.id(expense_filter.currency))
+        if expense_filter.min_amount is not None:
+            conditions.append("amount >= ?")
+            parameters.append(expense_filter.min_amount)
+        if expense_filter.max_amount is not None:
+            conditions.append("amount <= ?")
+            parameters.append(expense_filter.max_amount)
+        if expense_filter.text and expense_filter.text.strip():
+            conditions.append("id IN (SELECT rowid FROM expenses_fts WHERE expenses_fts MATCH ?)")
+            parameters.append(search_query(expense_filter.text))
+        return conditions, parameters
+
+    @timed("db.fetch_page")
+    def fetch_page(self, after=None, limit=256, expense_filter=None):
+        """Return up to limit records in display order, continuing below after.
+
+        after is the (position, id) of the last record already held, so
+        paging is a keyset seek instead of an OFFSET scan.
+        """
+        conditions, parameters = self.filter_conditions(expense_filter)
+        if after is not None:
+            conditions.append("(position, id) < (?, ?)")
+            parameters.extend(after)
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        return self.records(self.connection.execute(
+            f"{self.SELECT_COLUMNS} {where}ORDER BY position DESC, id DESC LIMIT ?",
+            parameters + [limit]).fetchall())
+
+    @timed("db.fetch_by_id")
+    def fetch_by_id(self, after_id=0, limit=10000, expense_filter=None):
+        """Return up to limit records with id > after_id in id order.
+
+        For exports and batch jobs that walk the whole table: every page is
+        a range seek on the primary key, so the cost per page does not grow
+        with how far into the table it is.
+        """
+        conditions, parameters = self.filter_conditions(expense_filter)
+        conditions.append("id > ?")
+        parameters.append(after_id)
+        return self.records(self.connection.execute(
+            f"{self.SELECT_COLUMNS} WHERE {' AND '.join(conditions)} ORDER BY id LIMIT ?",
+            parameters + [limit]).fetchall())
+
+    def get(self, expense_id):
+        rows = self.records(self.connection.execute(f"{self.SELECT_COLUMNS} WHERE id = ?", (expense_id,)).fetchall())
+        return rows[0] if rows else None
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM expenses").fetchone()[0]
+
+    @timed("db.add")
+    def add(self, date, category, amount, currency, description):
+        """Append an expense after the current last position and return its record."""
+        with self.transaction():
+            batch = self.start_batch("Add expense")
+            position = self.connection.execute(
+                "SELECT COALESCE(MAX(position), 0) FROM expenses").fetchone()[0] + POSITION_GAP
+            record = self.insert_at(position, date, category, amount, currency, description)
+            self.journal_insert(batch, record[0])
+            return record
+
+    @timed("db.insert_after")
+    def insert_after(self, expense_id, date, category, amount, currency, description):
+        """Insert an expense directly after expense_id.
+
+        Returns (record, rebalanced); when rebalanced is true every position
+        changed, so callers holding positions must reload.
+        """
+        with self.transaction():
+            batch = self.start_batch("Insert expense")
+            position, rebalanced = self.position_after(expense_id)
+            record = self.insert_at(position, date, category, amount, currency, description)
+            self.journal_insert(batch, record[0])
+            return record, rebalanced
+
+    def insert_at(self, position, date, category, amount, currency, description):
+        category_id, currency_id = self.category_id(category), self.currency_id(currency)
+        cursor = self.connection.execute(
+            "INSERT INTO expenses (position, date, category_id, amount, currency_id, description) "
+            "VALUES (?, ?, ?, ?, ?, ?)", (position, date, category_id, amount, currency_id, description))
+        return (cursor.lastrowid, date, self.categories.names[category_id], amount, self.currencies.names[currency_id],
+                description, position)
+
+    @timed("db.add_many")
+    def add_many(self, rows, batch_size=5000, progress=None, label="Add expenses"):
+        """Append (date, category, amount, currency, description) rows in one transaction.
+
+        rows is consumed batch_size at a time, so a generator is never fully
+        materialised. progress, if given, is called with the running row
+        count after each batch. All rows are one journal batch named label,
+        so a single undo removes them. Returns the number of rows written.
+        """
+        with self.transaction():
+            return self.insert_many(rows, batch_size, progress, label)
+
+    def insert_many(self, rows, batch_size=5000, progress=None, label="Add expenses"):
+        """add_many inside the caller's transaction."""
+        from itertools import islice
+
+        written = 0
+        rows = iter(rows)
+        category_id, currency_id = self.category_id, self.currency_id
+        journal_batch = self.start_batch(label)
+        first_position = next_position = self.connection.execute(
+            "SELECT COALESCE(MAX(position), 0) FROM expenses").fetchone()[0]
+        while True:
+            batch = []
+            for date, category, amount, currency, description in islice(rows, batch_size):
+                next_position += POSITION_GAP
+                batch.append((next_position, date, category_id(category), amount, currency_id(currency), description))
+            if not batch:
+                break
+            self.connection.executemany(
+                "INSERT INTO expenses (position, date, category_id, amount, currency_id, description) "
+                "VALUES (?, ?, ?, ?, ?, ?)", batch)
+            written += len(batch)
+            if progress is not None:
+                progress(written)
+        # Every new row sorts above the old maximum position, so one statement journals them all
+        self.connection.execute(
+            f"INSERT INTO journal (batch, op, expense_id, after_image) SELECT ?, 'insert', id, "
+            f"{self.JOURNAL_IMAGE} FROM expenses WHERE position > ? ORDER BY id", (journal_batch, first_position))
+        return written
+
+    @timed("db.delete")
+    def delete(self, expense_id):
+        with self.transaction():
+            self.journaled_delete(self.start_batch("Delete expense"), expense_id)
+
+    @timed("db.update")
+    def update(self, expense_id, date, category, amount, currency, description):
+        """Change every field of an expense except its position; returns the new record."""
+        with self.transaction():
+            self.journaled_update(self.start_batch("Edit expense"), expense_id,
+                                  (date, category, amount, currency, description, None))
+            return self.get(expense_id)
+
+    def start_batch(self, label, kind="do", target=None):
+        """Open a journal batch inside the caller's transaction and return its number."""
+        batch = self.connection.execute(
+            "INSERT INTO journal_batches (kind, label, target) VALUES (?, ?, ?)", (kind, label, target)).lastrowid
+        self.open_batches.append(batch)
+        # Batch numbers are shared by all connections, so every writer takes its turn at compacting
+        if batch % JOURNAL_COMPACT_EVERY == 0:
+            self.compaction_due = True
+        return batch
+
+    def drop_empty_batches(self, batches):
+        """Delete those of batches that have no journal entries (an empty add_many, a missing id)."""
+        self.connection.executemany(
+            "DELETE FROM journal_batches WHERE batch = ? AND NOT EXISTS (SELECT 1 FROM journal WHERE batch = ?)",
+            [(batch, batch) for batch in batches])
+
+    def journal_insert(self, batch, expense_id):
+        """Journal an expense that was just inserted."""
+        self.connection.execute(
+            f"INSERT INTO journal (batch, op, expense_id, after_image) "
+            f"SELECT ?, 'insert', id, {self.JOURNAL_IMAGE} FROM expenses WHERE id = ?", (batch, expense_id))
+
+    def journaled_delete(self, batch, expense_id):
+        self.connection.execute(
+            f"INSERT INTO journal (batch, op, expense_id, before_image) "
+            f"SELECT ?, 'delete', id, {self.JOURNAL_IMAGE} FROM expenses WHERE id = ?", (batch, expense_id))
+        self.connection.execute("DELETE FROM expenses WHERE id = ?", (expense_id,))
+
+    def journaled_update(self, batch, expense_id, image):
+        """Overwrite an expense with image (date, category, amount, currency, description, position).
+
+        A position of None keeps the current one.
+        """
+        row = self.connection.execute(f"SELECT {self.JOURNAL_IMAGE} FROM expenses WHERE id = ?", (expense_id,)).fetchone()
+        if row is None:
+            raise LookupError(f"Expense {expense_id} no longer exists.")
+        date, category, amount, currency, description, position = image
+        self.connection.execute(
+            "UPDATE expenses SET date = ?, category_id = ?, amount = ?, currency_id = ?, description = ?, "
+            "position = COALESCE(?, position) WHERE id = ?",
+            (date, self.category_id(category), amount, self.currency_id(currency), description, position, expense_id))
+        self.connection.execute(
+            f"INSERT INTO journal (batch, op, expense_id, before_image, after_image) "
+            f"SELECT ?, 'update', id, ?, {self.JOURNAL_IMAGE} FROM expenses WHERE id = ?",
+            (batch, row[0], expense_id))
+
+    def journaled_restore(self, batch, expense_id, image):
+        """Re-insert an expense under its old id from a journal image."""
+        date, category, amount, currency, description, position = image
+        self.connection.execute(
+            "INSERT INTO expenses (id, position, date, category_id, amount, currency_id, description) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (expense_id, position, date, self.category_id(category), amount, self.currency_id(currency), description))
+        self.journal_insert(batch, expense_id)
+
+    @timed("db.undo")
+    def undo(self):
+        """Revert the newest user action that is still applied; return its label, or None if there is none.
+
+        The reversal is itself journaled (as an "undo" batch), so
+        changes_since consumers simply see the compensating changes.
+        """
+        with self.transaction():
+            row = self.connection.execute(
+                "SELECT batch, label FROM journal_batches WHERE kind = 'do' AND undone = 0 "
+                "ORDER BY batch DESC LIMIT 1").fetchone()
+            if row is None:
+                return None
+            target, label = row
+            batch = self.start_batch(label, "undo", target)
+            entries = self.connection.execute(
+                "SELECT op, expense_id, before_image FROM journal WHERE batch = ? ORDER BY seq DESC", (target,)).fetchall()
+            for op, expense_id, before in entries:
+                if op == "insert":
+                    self.journaled_delete(batch, expense_id)
+                elif op == "delete":
+                    self.journaled_restore(batch, expense_id, json.loads(before))
+                else:
+                    self.journaled_update(batch, expense_id, json.loads(before))
+            self.connection.execute("UPDATE journal_batches SET undone = 1 WHERE batch = ?", (target,))
+            return label
+
+    @timed("db.redo")
+    def redo(self):
+        """Re-apply the most recently undone action; return its label, or None if there is none.
+
+        Only actions undone since the last new user action can be redone.
+        """
+        with self.transaction():
+            row = self.connection.execute(
+                "SELECT undo.target, undo.label FROM journal_batches AS undo "
+                "JOIN journal_batches AS done ON done.batch = undo.target "
+                "WHERE undo.kind = 'undo' AND done.undone = 1 AND undo.batch > "
+                "(SELECT COALESCE(MAX(batch), 0) FROM journal_batches WHERE kind = 'do') "
+                "ORDER BY undo.batch DESC LIMIT 1").fetchone()
+            if row is None:
+                return None
+            target, label = row
+            batch = self.start_batch(label, "redo", target)
+            entries = self.connection.execute(
+                "SELECT op, expense_id, after_image FROM journal WHERE batch = ? ORDER BY seq", (target,)).fetchall()
+            for op, expense_id, after in entries:
+                if op == "insert":
+                    self.journaled_restore(batch, expense_id, json.loads(after))
+                elif op == "delete":
+                    self.journaled_delete(batch, expense_id)
+                else:
+                    self.journaled_update(batch, expense_id, json.loads(after))
+            self.connection.execute("UPDATE journal_batches SET undone = 0 WHERE batch = ?", (target,))
+            return label
+
+    def journal_head(self):
+        """The newest journal seq; a consumer that has copied the table starts following changes from here."""
+        return self.connection.execute("SELECT COALESCE(MAX(seq), 0) FROM journal").fetchone()[0]
+
+    @timed("db.changes_since")
+    def changes_since(self, seq=0, limit=10000):
+        """Return up to limit JournalEntry rows with seq > seq, oldest first.
+
+        Raises LookupError when entries after seq have been compacted away;
+        the consumer then has to copy the table again and continue from
+        journal_head().
+        """
+        compacted_through = self.connection.execute("SELECT compacted_through FROM journal_state").fetchone()[0]
+        if seq < compacted_through:
+            raise LookupError(f"Journal entries up to {compacted_through} were compacted; resynchronise from a full copy")
+        rows = self.connection.execute(
+            "SELECT seq, op, expense_id, before_image, after_image FROM journal WHERE seq > ? ORDER BY seq LIMIT ?",
+            (seq, limit)).fetchall()
+        return [JournalEntry(entry_seq, op, expense_id,
+                             (expense_id, *json.loads(before)) if before else None,
+                             (expense_id, *json.loads(after)) if after else None)
+                for entry_seq, op, expense_id, before, after in rows]
+
+    def compact_journal(self, keep_batches=JOURNAL_KEEP_BATCHES):
+        """Drop all but the newest keep_batches journal batches; returns the number of entries removed."""
+        with self.transaction():
+            return self.drop_journal_batches(keep_batches)
+
+    def drop_journal_batches(self, keep_batches):
+        """compact_journal inside the caller's transaction."""
+        row = self.connection.execute(
+            "SELECT batch FROM journal_batches ORDER BY batch DESC LIMIT 1 OFFSET ?", (keep_batches,)).fetchone()
+        if row is None:
+            return 0
+        # Batches are written under the write lock, so their seqs never interleave
+        self.connection.execute(
+            "UPDATE journal_state SET compacted_through = "
+            "MAX(compacted_through, (SELECT COALESCE(MAX(seq), 0) FROM journal WHERE batch <= ?))", row)
+        removed = self.connection.execute("DELETE FROM journal WHERE batch <= ?", row).rowcount
+        self.connection.execute("DELETE FROM journal_batches WHERE batch <= ?", row)
+        return removed
+
+    def position_after(self, expense_id):
+        """Return (position, rebalanced) for a new row directly after expense_id.
+
+        Takes the midpoint between the expense and its successor. When the two
+        keys are adjacent all positions are spread out again first, which is
+        the only step that touches more than a couple of index entries.
+        """
+        rebalanced = False
+        while True:
+            row = self.connection.execute(
+                "SELECT position, (SELECT MIN(position) FROM expenses WHERE position > e.position) "
+                "FROM expenses AS e WHERE id = ?", (expense_id,)).fetchone()
+            if row is None:
+                raise LookupError(f"Expense {expense_id} no longer exists.")
+
+            position, next_position = row
+            if next_position is None:
+                return position + POSITION_GAP, rebalanced
+            if next_position - position > 1 or rebalanced:
+                return (position + next_position) // 2, rebalanced
+
+            self.rebalance_positions()
+            rebalanced = True
+
+    def rebalance_positions(self):
+        """Renumber every position to a multiple of POSITION_GAP, keeping the order.
+
+        Runs inside the caller's transaction.
+        """
+        ids = [row[0] for row in self.connection.execute("SELECT id FROM expenses ORDER BY position, id")]
+        self.connection.executemany(
+            "UPDATE expenses SET position = ? WHERE id = ?",
+            (((index + 1) * POSITION_GAP, expense_id) for index, expense_id in enumerate(ids)))
+
+    @timed("db.totals")
+    def totals(self, group_by=("category", "currency"), expense_filter=None):
+        """Return (*group values, sum, count) rows, e.g. totals(("month", "currency")).
+
+        expense_filter limits the rows summed; see period_bounds for the date
+        range of whole months and years. Filters that only select whole
+        months, a category or a currency are answered from expense_rollups.
+        """
+        if self.rollups_cover(expense_filter):
+            return self.rollup_totals(group_by, expense_filter)
+
+        shown, keys, order = self.group_clauses(group_by, self.GROUP_COLUMNS)
+        conditions, parameters = self.filter_conditions(expense_filter)
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        return self.connection.execute(
+            f"SELECT {shown}, SUM(amount), COUNT(*) FROM expenses {where}GROUP BY {keys} ORDER BY {order}",
+            parameters).fetchall()
+
+    @timed("db.aggregates")
+    def aggregates(self, group_by=("month", "category", "currency"), expense_filter=None):
+        """Return (*group values, sum, count, min, max) rows from a scan of the expenses table.
+
+        These partial aggregates merge exactly across databases (see
+        report_engine), which the rollups cannot do for min and max.
+        """
+        shown, keys, order = self.group_clauses(group_by, self.GROUP_COLUMNS)
+        conditions, parameters = self.filter_conditions(expense_filter)
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        return self.connection.execute(
+            f"SELECT {shown}, SUM(amount), COUNT(*), MIN(amount), MAX(amount) FROM expenses {where}"
+            f"GROUP BY {keys} ORDER BY {order}", parameters).fetchall()
+
+    def rollups_cover(self, expense_filter):
+        if expense_filter is None:
+            return True
+        if expense_filter.min_amount is not None or expense_filter.max_amount is not None or expense_filter.text:
+            return False
+        return all(bound is None or bound.endswith("-01")
+                   for bound in (expense_filter.start, expense_filter.end))
+
+    @timed("db.rollup_totals")
+    def rollup_totals(self, group_by=("month", "category", "currency"), expense_filter=None):
+        """Like totals(), but summed from expense_rollups; the filter must satisfy rollups_cover."""
+        expense_filter = expense_filter or ExpenseFilter()
+        # Rows without a category or currency are bucketed under key 0 and shown as ''
+        shown, keys, order = self.group_clauses(group_by, self.ROLLUP_COLUMNS, missing="''")
+        conditions, parameters = [], []
+        if expense_filter.start is not None:
+            conditions.append("month >= ?")
+            parameters.append(expense_filter.start[:7])
+        if expense_filter.end is not None:
+            conditions.append("month < ?")
+            parameters.append(expense_filter.end[:7])
+        if expense_filter.category is not None:
+            conditions.append("category_id = ?")
+            parameters.append(self.categories.id(expense_filter.category))
+        if expense_filter.currency is not None:
+            conditions.append("currency_id = ?")
+            parameters.append(self.currencies.id(expense_filter.currency))
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        return self.connection.execute(
+            f"SELECT {shown}, SUM(total), SUM(count) FROM expense_rollups {where}GROUP BY {keys} ORDER BY {order}",
+            parameters).fetchall()
+
+    @timed("db.rollup_years")
+    def rollup_years(self):
+        return [row[0] for row in self.connection.execute(
+            "SELECT DISTINCT substr(month, 1, 4) FROM expense_rollups ORDER BY 1 DESC")]
+
+    def rebuild_rollups(self):
+        with self.transaction():
+            rebuild_rollups(self.connection)
+
+    def check_rollups(self):
+        """Compare expense_rollups with a full recompute.
+
+        Returns a list of (month, category, currency, stored, expected)
+        mismatches, where stored/expected are (total, count) or None for a
+        missing bucket. An empty list means the rollups are correct.
+        """
+        with self.transaction("DEFERRED"):
+            expected = {tuple(row[:3]): tuple(row[3:]) for row in self.connection.execute(ROLLUP_QUERY)}
+            stored = {tuple(row[:3]): tuple(row[3:]) for row in self.connection.execute(
+                "SELECT month, category_id, currency_id, total, count FROM expense_rollups")}
+
+        mismatches = []
+        for bucket in sorted(expected.keys() | stored.keys()):
+            stored_value, expected_value = stored.get(bucket), expected.get(bucket)
+            if stored_value != expected_value:
+                month, category_id, currency_id = bucket
+                mismatches.append((month, self.categories.name(category_id) if category_id else "",
+                                   self.currencies.name(currency_id) if currency_id else "",
+                                   stored_value, expected_value))
+        return mismatches
@@ -0,0 +1,146 @@
+"""Streaming export of the expenses table to CSV, JSON Lines or Parquet.
+
+The table is walked with keyset pagination on the primary key
+(ExpenseRepository.fetch_by_id: WHERE id > ? ORDER BY id LIMIT n) and each
+page is written before the next one is read. Memory therefore stays at one
+page, whatever the size of the ledger. Every format has the same columns:
+
+    id, date (ISO yyyy-mm-dd), category, amount, currency, description
+
+amount is an exact decimal in major units of the row's currency ("12.50",
+"1234" for yen). CSV and JSONL write it as a string so that no float
+rounding creeps in, and Parquet writes it as decimal128(18, 2) (more digits
+if a currency with more decimals has been added). The file is
+written next to its destination and renamed into place when complete, so a
+failed or cancelled export never leaves a truncated file behind.
+
+Parquet needs pyarrow, which is imported only when a Parquet export starts.
+Nothing here imports Qt; the GUI and expense_cli.py both call export_file.
+"""
+import csv
+import json
+import os
+import time
+from collections import namedtuple
+
+from expense_core import CURRENCY_DATA, format_decimal
+from profiling import timed
+
+PAGE_SIZE = 50000
+COLUMNS = ("id", "date", "category", "amount", "currency", "description")
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".parquet": "parquet"}
+
+
+def parquet_scale():
+    # Enough decimal digits for every known currency, including ones added to the database
+    return max(data['decimals'] for data in CURRENCY_DATA.values())
+
+
+class ExportResult(namedtuple("ExportResult", "rows seconds")):
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else float(self.rows)
+
+
+def iter_pages(repository, expense_filter=None, page_size=PAGE_SIZE):
+    """Yield lists of (id, date, category, amount, currency, description) rows in id order."""
+    after_id = 0
+    while True:
+        page = repository.fetch_by_id(after_id, page_size, expense_filter)
+        if not page:
+            return
+        after_id = page[-1][0]
+        yield [(expense_id, date, category, format_decimal(amount, currency), currency, description)
+               for expense_id, date, category, amount, currency, description, _ in page]
+        if len(page) < page_size:
+            return
+
+
+def write_csv(output_path, pages, progress=None):
+    written = 0
+    with open(output_path, "w", newline="", encoding="utf-8") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(COLUMNS)
+        for page in pages:
+            writer.writerows(page)
+            written += len(page)
+            if progress is not None:
+                progress(written)
+    return written
+
+
+def write_jsonl(output_path, pages, progress=None):
+    written = 0
+    with open(output_path, "w", encoding="utf-8") as jsonl_file:
+        for page in pages:
+            jsonl_file.writelines(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + "\n" for row in page)
+            written += len(page)
+            if progress is not None:
+                progress(written)
+    return written
+
+
+def write_parquet(output_path, pages, progress=None):
+    """Write one row group per page; needs pyarrow."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet export needs pyarrow (pip install pyarrow)") from None
+
+    schema = pyarrow.schema([
+        ("id", pyarrow.int64()),
+        ("date", pyarrow.date32()),
+        ("category", pyarrow.string()),
+        ("amount", pyarrow.decimal128(18, parquet_scale())),
+        ("currency", pyarrow.string()),
+        ("description", pyarrow.string()),
+    ])
+    written = 0
+    with pyarrow.parquet.ParquetWriter(output_path, schema) as writer:
+        for page in pages:
+            ids, dates, categories, amounts, currencies, descriptions = zip(*page)
+            # Dates and amounts go through Arrow's string casts, which parse them in C
+            writer.write_table(pyarrow.Table.from_arrays([
+                pyarrow.array(ids, pyarrow.int64()),
+                pyarrow.array(dates, pyarrow.string()).cast(pyarrow.date32()),
+                pyarrow.array(categories, pyarrow.string()),
+                pyarrow.array(amounts, pyarrow.string()).cast(schema.field("amount").type),
+                pyarrow.array(currencies, pyarrow.string()),
+                pyarrow.array(descriptions, pyarrow.string()),
+            ], schema=schema))
+            written += len(page)
+            if progress is not None:
+                progress(written)
+    return written
+
+
+WRITERS = {"csv": write_csv, "jsonl": write_jsonl, "parquet": write_parquet}
+
+
+@timed("export.file")
+def export_file(repository, path, export_format=None, expense_filter=None, page_size=PAGE_SIZE, progress=None):
+    """Export the expenses matching expense_filter to path and time it.
+
+    export_format is "csv", "jsonl" or "parquet". If it is None it comes
+    from the file extension. progress, if given, is called with the running
+    row count after each page.
+    """
+    if export_format is None:
+        export_format = FORMATS.get(os.path.splitext(path)[1].lower())
+        if export_format is None:
+            raise ValueError(f"{path}: unknown export format, use one of {', '.join(sorted(FORMATS))}")
+
+    start = time.perf_counter()
+    partial_path = path + ".part"
+    try:
+        # One read transaction: every page comes from the same snapshot, and under
+        # WAL writers carry on meanwhile
+        with repository.transaction("DEFERRED"):
+            written = WRITERS[export_format](partial_path, iter_pages(repository, expense_filter, page_size), progress)
+        os.replace(partial_path, path)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    return ExportResult(written, time.perf_counter() - start)
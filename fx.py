@@ -0,0 +1,158 @@
+"""Currency conversion from a local, dated table of exchange rates.
+
+Rates live in the fx_rates table and are loaded from CSV files (no live
+service). Like the ECB reference rates they are quoted against EUR: on
+`date`, 1 EUR bought `rate` units of `currency`. A conversion uses the most
+recent rate on or before the expense date.
+
+FxConverter keeps every rate in memory, caches single lookups per
+(currency, date) and converts whole columns of major-unit amounts at once
+with NumPy when it is installed (pure Python otherwise). Totals are pre-aggregated per
+(date, currency) in SQL first, so converting millions of rows only touches
+a few thousand groups.
+"""
+import csv
+import datetime
+import math
+from bisect import bisect_right
+from functools import lru_cache
+
+from expense_core import minor_unit_factor
+from profiling import timed
+
+BASE_CURRENCY = "EUR"
+
+
+def iso_date(text):
+    # Rates are looked up by comparing ISO date strings, so nothing else may get into the table
+    try:
+        return datetime.date.fromisoformat(text.strip()).isoformat()
+    except ValueError:
+        raise ValueError(f"date must be yyyy-mm-dd, got {text!r}") from None
+
+
+def read_rates_csv(path):
+    """Yield (currency, date, rate) from a CSV file with date (ISO yyyy-mm-dd), currency and rate columns."""
+    with open(path, newline="", encoding="utf-8-sig") as csv_file:
+        reader = csv.reader(csv_file)
+        header = [name.strip().lower() for name in next(reader, [])]
+        missing = {"date", "currency", "rate"} - set(header)
+        if missing:
+            raise ValueError(f"{path}: missing column(s) {', '.join(sorted(missing))}")
+
+        date_column, currency_column, rate_column = (header.index(name) for name in ("date", "currency", "rate"))
+        for line_number, record in enumerate(reader, start=2):
+            if not any(record):
+                continue
+            try:
+                rate = float(record[rate_column])
+                if not math.isfinite(rate) or rate <= 0:
+                    raise ValueError(f"rate must be positive, got {rate}")
+                yield record[currency_column].strip().upper(), iso_date(record[date_column]), rate
+            except (ValueError, IndexError) as error:
+                raise ValueError(f"{path}:{line_number}: {error}") from None
+
+
+def load_rates(repository, path):
+    """Insert or replace the rates from a CSV file in one transaction; returns the row count."""
+    rates = list(read_rates_csv(path))
+    with repository.transaction():
+        repository.connection.executemany(
+            "INSERT OR REPLACE INTO fx_rates (currency, date, rate) VALUES (?, ?, ?)", rates)
+    return len(rates)
+
+
+class FxConverter:
+    """Converts amounts between currencies with the rates in fx_rates.
+
+    The rate tables are read once; create a new converter after loading
+    new rates.
+    """
+
+    def __init__(self, repository):
+        self.repository = repository
+        self.dates = {BASE_CURRENCY: [""]}
+        self.rates = {BASE_CURRENCY: [1.0]}
+        for currency, date, rate in repository.connection.execute(
+                "SELECT currency, date, rate FROM fx_rates ORDER BY currency, date"):
+            if currency == BASE_CURRENCY:
+                continue
+            self.dates.setdefault(currency, []).append(date)
+            self.rates.setdefault(currency, []).append(rate)
+        self.arrays = None
+        self.rate = lru_cache(maxsize=65536)(self.lookup_rate)
+
+    def lookup_rate(self, currency, date):
+        """Units of currency per 1 EUR on date (the latest rate on or before it)."""
+        dates = self.dates.get(currency)
+        if dates is None:
+            raise LookupError(f"No exchange rates for {currency}")
+        index = bisect_right(dates, date) - 1
+        if index < 0:
+            raise LookupError(f"No {currency} exchange rate on or before {date}")
+        return self.rates[currency][index]
+
+    def convert(self, amount, currency, date, target=BASE_CURRENCY):
+        if currency == target:
+            return amount
+        return amount / self.rate(currency, date) * self.rate(target, date)
+
+    def convert_column(self, amounts, currencies, dates, target=BASE_CURRENCY):
+        """Convert parallel sequences of amounts, currency codes and ISO dates to target.
+
+        Returns a list, or a NumPy array when NumPy is installed.
+        """
+        try:
+            import numpy
+        except ImportError:
+            return [self.convert(amount, currency, date, target)
+                    for amount, currency, date in zip(amounts, currencies, dates)]
+
+        amounts = numpy.asarray(amounts, dtype=numpy.float64)
+        currencies = numpy.asarray(currencies)
+        days = numpy.asarray(dates, dtype="datetime64[D]")
+        factors = numpy.empty(len(amounts), dtype=numpy.float64)
+
+        # One searchsorted per currency instead of one lookup per row
+        target_rates = self.rates_at(numpy, target, days)
+        for currency in numpy.unique(currencies):
+            mask = currencies == currency
+            factors[mask] = target_rates[mask] / self.rates_at(numpy, str(currency), days[mask])
+        return amounts * factors
+
+    def rates_at(self, numpy, currency, days):
+        if self.arrays is None:
+            self.arrays = {}
+        if currency not in self.arrays:
+            if currency not in self.dates:
+                raise LookupError(f"No exchange rates for {currency}")
+            if currency == BASE_CURRENCY:
+                rate_days = numpy.array(["0001-01-01"], dtype="datetime64[D]")
+            else:
+                rate_days = numpy.array(self.dates[currency], dtype="datetime64[D]")
+            self.arrays[currency] = (rate_days, numpy.array(self.rates[currency], dtype=numpy.float64))
+
+        rate_days, rates = self.arrays[currency]
+        indexes = numpy.searchsorted(rate_days, days, side="right") - 1
+        if len(indexes) and indexes.min() < 0:
+            first_missing = numpy.datetime_as_string(days[indexes < 0].min())
+            raise LookupError(f"No {currency} exchange rate on or before {first_missing}")
+        return rates[indexes]
+
+    @timed("fx.total")
+    def total(self, target=BASE_CURRENCY, expense_filter=None):
+        """Sum of the (filtered) expenses converted to target at each expense's date.
+
+        Returns integer minor units of target.
+        """
+        conditions, parameters = self.repository.filter_conditions(expense_filter)
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        groups = self.repository.connection.execute(
+            f"SELECT date, currency_id, SUM(amount) FROM expenses {where}GROUP BY date, currency_id", parameters).fetchall()
+        if not groups:
+            return 0
+        dates, currency_ids, amounts = zip(*groups)
+        currencies = [self.repository.currencies.name(currency_id) for currency_id in currency_ids]
+        amounts = [amount / minor_unit_factor(currency) for amount, currency in zip(amounts, currencies)]
+        total = float(sum(self.convert_column(amounts, currencies, dates, target)))
+        return round(total * minor_unit_factor(target))
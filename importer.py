@@ -0,0 +1,155 @@
+"""Streaming CSV/OFX import of bank exports into the expenses table.
+
+Files are parsed as generators, so memory does not grow with the size of the
+export, and rows are written with executemany in batches inside a single
+transaction (ExpenseRepository.add_many). Nothing here imports Qt; the GUI
+and expense_cli.py both call import_file.
+"""
+import csv
+import os
+import re
+import time
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache
+
+from expense_core import CURRENCY_DATA, decimal_to_minor, parse_amount
+from profiling import timed
+
+DEFAULT_CATEGORY = "Uncategorized"
+BATCH_SIZE = 5000
+
+# Accepted spellings of a date in bank exports; stored as ISO yyyy-mm-dd
+DATE_FORMATS = ("%d-%m-%Y", "%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y", "%Y%m%d")
+
+# OFX 1.x is SGML with unclosed leaf tags, OFX 2.x is XML; this matches both
+OFX_TAG = re.compile(r"<(/?)([A-Za-z0-9.]+)>([^<\r\n]*)")
+
+
+class ImportResult(namedtuple("ImportResult", "rows seconds")):
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else float(self.rows)
+
+
+@lru_cache(maxsize=4096)
+def parse_date(text):
+    # Exports repeat the same few hundred dates, so strptime runs once per distinct value
+    text = text.strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised date {text!r}")
+
+
+def read_csv(path, currency="USD", category=DEFAULT_CATEGORY):
+    """Yield (date, category, amount, currency, description) rows from a CSV file.
+
+    The file needs a header with at least "date" and "amount" columns;
+    "category", "currency" and "description" are optional and fall back to
+    the given defaults. Amounts are parsed with the separators of the row's
+    currency. The delimiter (comma, semicolon or tab) is taken from the header.
+    """
+    with open(path, newline="", encoding="utf-8-sig") as csv_file:
+        # Pick the delimiter from the header line; csv.Sniffer is far too slow on large samples
+        header_line = csv_file.readline()
+        csv_file.seek(0)
+        delimiter = max(",;\t", key=header_line.count)
+
+        reader = csv.reader(csv_file, delimiter=delimiter)
+        header = [name.strip().lower() for name in next(reader, [])]
+        missing = {"date", "amount"} - set(header)
+        if missing:
+            raise ValueError(f"{path}: missing column(s) {', '.join(sorted(missing))}")
+
+        date_column = header.index("date")
+        amount_column = header.index("amount")
+        category_column = header.index("category") if "category" in header else None
+        currency_column = header.index("currency") if "currency" in header else None
+        description_column = header.index("description") if "description" in header else None
+
+        for line_number, record in enumerate(reader, start=2):
+            if not any(record):
+                continue
+            try:
+                row_currency = record[currency_column].strip().upper() if currency_column is not None else currency
+                if row_currency not in CURRENCY_DATA:
+                    raise ValueError(f"unknown currency {row_currency!r}")
+                yield (
+                    parse_date(record[date_column]),
+                    record[category_column].strip() if category_column is not None else category,
+                    parse_amount(record[amount_column].strip(), row_currency),
+                    row_currency,
+                    record[description_column].strip() if description_column is not None else "",
+                )
+            except (ValueError, IndexError) as error:
+                raise ValueError(f"{path}:{line_number}: {error}") from None
+
+
+def read_ofx(path, category=DEFAULT_CATEGORY):
+    """Yield (date, category, amount, currency, description) rows from an OFX file.
+
+    Every STMTTRN block becomes one expense. OFX amounts are signed from the
+    account's point of view, so debits (negative TRNAMT) are stored as
+    positive expenses and credits as negative ones.
+    """
+    currency = "USD"
+    transaction = None
+    with open(path, encoding="utf-8", errors="replace") as ofx_file:
+        for line in ofx_file:
+            for closing, tag, value in OFX_TAG.findall(line):
+                tag = tag.upper()
+                value = value.strip()
+                if tag == "CURDEF" and value:
+                    currency = value.upper()
+                elif tag == "STMTTRN":
+                    if not closing:
+                        transaction = {}
+                    elif transaction is not None:
+                        yield ofx_row(path, transaction, currency, category)
+                        transaction = None
+                elif transaction is not None and not closing and value:
+                    transaction[tag] = value
+
+
+def ofx_row(path, transaction, currency, category):
+    try:
+        # DTPOSTED looks like 20240131 or 20240131120000[-5:EST]
+        currency = transaction.get("CURRENCY", currency)
+        if currency not in CURRENCY_DATA:
+            raise ValueError(f"unknown currency {currency!r}")
+        date = parse_date(transaction["DTPOSTED"][:8])
+        # TRNAMT always uses a decimal point, whatever the currency's own separators
+        amount = -decimal_to_minor(transaction["TRNAMT"].replace(",", "."), currency)
+    except (KeyError, ValueError) as error:
+        raise ValueError(f"{path}: bad transaction {transaction.get('FITID', '')!r}: {error}") from None
+    description = transaction.get("NAME", "")
+    if transaction.get("MEMO"):
+        description = f"{description} {transaction['MEMO']}".strip()
+    return (date, category, amount, currency, description)
+
+
+def read_file(path, currency="USD", category=DEFAULT_CATEGORY):
+    if path.lower().endswith((".ofx", ".qfx")):
+        return read_ofx(path, category)
+    return read_csv(path, currency, category)
+
+
+def import_rows(repository, rows, batch_size=BATCH_SIZE, progress=None, label="Import"):
+    """Append rows to the expenses table in one transaction and time it.
+
+    rows is any iterable of (date, category, amount, currency, description);
+    see ExpenseRepository.add_many. On error nothing is written. The whole
+    import is one journal batch called label, undone in one step.
+    """
+    start = time.perf_counter()
+    imported = repository.add_many(rows, batch_size, progress, label)
+    return ImportResult(imported, time.perf_counter() - start)
+
+
+@timed("import.file")
+def import_file(repository, path, currency="USD", category=DEFAULT_CATEGORY, batch_size=BATCH_SIZE, progress=None):
+    return import_rows(repository, read_file(path, currency, category), batch_size, progress,
+                       f"Import {os.path.basename(path)}")
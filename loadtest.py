@@ -0,0 +1,198 @@
+"""Load test for the HTTP/JSON API (api_server.py): requests/sec and latency percentiles.
+
+    python loadtest.py --url http://127.0.0.1:8765 --connections 16 --duration 10
+    python loadtest.py --db /tmp/load.db --rows 100000 --output load.json
+
+With --url it drives a server that is already running. With --db it
+starts `expense_cli.py serve` on that database and a free port, fills a new
+database with generate_ledger from bench.py first (--rows), and stops the
+server at the end.
+
+Each connection keeps one HTTP/1.1 keep-alive socket and sends requests
+back to back for --duration seconds, picked at random (seeded) with the
+weights in --mix: list pages, filtered lists, totals and adds. Latency is
+measured per request from sending to the last byte of the response. The
+report gives requests/sec and p50/p90/p99/max latency per kind and overall;
+any response other than 200/201 counts as an error and makes the exit
+status 1.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+from expense_core import CATEGORIES, CURRENCY_DATA
+
+DEFAULT_MIX = {"list": 50, "filter": 25, "totals": 15, "add": 10}
+
+
+def make_request(kind, generator):
+    """Return (method, target, body) for one request of the given kind."""
+    if kind == "list":
+        return "GET", f"/expenses?limit={generator.choice((50, 100, 500))}", None
+    if kind == "filter":
+        year = generator.randrange(2015, 2026)
+        return "GET", f"/expenses?period={year}&category={generator.choice(CATEGORIES[:20]).replace(' ', '+')}", None
+    if kind == "totals":
+        return "GET", f"/totals?by=month,currency&period={generator.randrange(2015, 2026)}", None
+    currency = generator.choice(sorted(CURRENCY_DATA))
+    body = json.dumps({
+        "date": f"2025-{generator.randrange(1, 13):02d}-{generator.randrange(1, 29):02d}",
+        "category": generator.choice(CATEGORIES),
+        "amount": f"{generator.uniform(0.5, 500):.2f}",
+        "currency": currency,
+        "description": "load test",
+    }).encode("utf-8")
+    return "POST", "/expenses", body
+
+
+async def read_response(reader):
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def client(host, port, deadline, mix, seed, latencies, errors):
+    generator = random.Random(seed)
+    kinds, weights = list(mix), list(mix.values())
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            kind = generator.choices(kinds, weights)[0]
+            method, target, body = make_request(kind, generator)
+            request = f"{method} {target} HTTP/1.1\r\nHost: {host}\r\n"
+            if body is not None:
+                request += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            start = time.perf_counter()
+            writer.write(request.encode("latin-1") + b"\r\n" + (body or b""))
+            status = await read_response(reader)
+            latencies[kind].append(time.perf_counter() - start)
+            if status not in (200, 201):
+                errors[kind] += 1
+    finally:
+        writer.close()
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))]
+
+
+def summarize(latencies, seconds):
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "requests_per_second": round(len(values) / seconds, 1),
+        **{f"p{int(fraction * 100)}_ms": round(percentile(values, fraction) * 1000, 3) for fraction in (0.5, 0.9, 0.99)},
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+async def run_load(host, port, connections, duration, mix, seed):
+    latencies = {kind: [] for kind in mix}
+    errors = {kind: 0 for kind in mix}
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*(client(host, port, deadline, mix, seed + index, latencies, errors)
+                           for index in range(connections)))
+    seconds = time.perf_counter() - start
+
+    results = {kind: {**summarize(latencies[kind], seconds), "errors": errors[kind]} for kind in mix}
+    results["all"] = {**summarize([value for values in latencies.values() for value in values], seconds),
+                      "errors": sum(errors.values())}
+    return results
+
+
+def start_server(db, rows, seed):
+    """Start expense_cli.py serve on db and a free port; returns (process, host, port)."""
+    if not os.path.exists(db) and rows:
+        import bench
+        from expense_core import ExpenseRepository
+
+        repository = ExpenseRepository(db)
+        try:
+            bench.generate_ledger(repository, rows, seed)
+        finally:
+            repository.close()
+
+    cli = os.path.join(os.path.dirname(os.path.abspath(__file__)), "expense_cli.py")
+    process = subprocess.Popen([sys.executable, cli, "--db", db, "serve", "--port", "0"],
+                               stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith("Serving"):
+        process.kill()
+        raise SystemExit(f"Server did not start: {line.strip() or 'no output'}")
+    address = urlsplit(line.split()[-1])
+    return process, address.hostname, address.port
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in DEFAULT_MIX or not weight.isdigit():
+            raise argparse.ArgumentTypeError(f"expected kind=weight with kinds {', '.join(DEFAULT_MIX)}, got {part!r}")
+        mix[kind] = int(weight)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="base URL of a running server, e.g. http://127.0.0.1:8765")
+    target.add_argument("--db", help="start a server on this database (created with --rows if missing)")
+    parser.add_argument("--rows", type=int, default=100000, help="ledger size when --db does not exist yet")
+    parser.add_argument("--connections", type=int, default=16, help="concurrent keep-alive connections")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="request weights, e.g. list=50,filter=25,totals=15,add=10")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write JSON results here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    process = None
+    if args.url:
+        address = urlsplit(args.url)
+        host, port = address.hostname, address.port or 80
+    else:
+        process, host, port = start_server(args.db, args.rows, args.seed)
+    try:
+        results = asyncio.run(run_load(host, port, args.connections, args.duration, args.mix, args.seed))
+    finally:
+        if process is not None:
+            # Ctrl+C equivalent, so the server closes its connections cleanly
+            process.send_signal(signal.SIGINT if os.name == "posix" else signal.SIGTERM)
+            process.wait()
+
+    results = {"connections": args.connections, "duration": args.duration, "mix": args.mix, "results": results}
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    else:
+        print(text)
+
+    overall = results["results"]["all"]
+    print(f"{overall['requests']:,} requests, {overall['requests_per_second']:,.0f} req/s, "
+          f"p50 {overall['p50_ms']} ms, p99 {overall['p99_ms']} ms, {overall['errors']} error(s)", file=sys.stderr)
+    return 1 if overall["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,579 @@
 from PyQt5.QtWidgets import (
-    QApplication, QWidget, QTableWidgetItem, QMessageBox, QLabel, QLineEdit, QHeaderView,
-    QComboBox, QPushButton, QDateEdit, QTableWidget, QVBoxLayout, QHBoxLayout, QSizePolicy
+    QApplication, QWidget, QMessageBox, QLabel, QLineEdit, QHeaderView,
+    QComboBox, QPushButton, QDateEdit, QTableView, QVBoxLayout, QHBoxLayout, QSizePolicy,
+    QFileDialog, QTabWidget, QTableWidget, QTableWidgetItem, QProgressDialog, QShortcut
 )
-from PyQt5.QtSql import QSqlDatabase, QSqlQuery
-from PyQt5.QtCore import QDate, QRegularExpression, Qt
-from PyQt5.QtGui import QRegularExpressionValidator, QFont
+from PyQt5.QtCore import QDate, QRegularExpression, Qt, QAbstractTableModel, QModelIndex, QTimer
+from PyQt5.QtGui import QRegularExpressionValidator, QColor, QFont, QKeySequence, QPainter
+import bisect
 import sys
+import time
+import os
 import re
-import platform
+import sqlite3
+
+from expense_core import (
+    CURRENCY_DATA, ExpenseFilter, ExpenseRepository, amount_format, display_date, format_amount,
+    format_amounts, parse_amount, period_bounds
+)
+import analytics
+import profiling
+import recurring
+from db_worker import DatabaseThread
+from profiling import timed
+
+
+class ExpenseTableModel(QAbstractTableModel):
+    """Lazily loaded view of the expenses table.
+
+    Rows are pulled from the repository in windows of FETCH_SIZE as the view
+    scrolls (canFetchMore/fetchMore) and only the raw records are kept; the
+    amount is formatted when the view asks for it, so nothing is built for
+    rows that are never painted. The first window after a reload is only
+    FIRST_FETCH_SIZE rows, about a screenful, so it arrives and paints sooner.
+
+    Rows are ordered by their position key, newest on top. Each record keeps
+    its position as a hidden seventh field for keyset pagination. Only rows
+    matching expense_filter are fetched; the filtering happens in SQL.
+
+    With a DatabaseThread, pages are fetched on the worker thread and
+    appended when they arrive, and a reload cancels a fetch still in flight;
+    without one (benchmarks, scripts) they are read inline.
+
+    Mutations are applied as row-level deltas (insert_record, remove_record)
+    instead of a reload. Set EXPENSE_TRACKER_CHECK_CONSISTENCY=1 to compare
+    the loaded rows against the database after every edit.
+    """
+
+    HEADERS = ["Id", "Date", "Category", "Amount", "Currency", "Description"]
+    FETCH_SIZE = 256
+    FIRST_FETCH_SIZE = 64
+    CHECK_CONSISTENCY = os.environ.get("EXPENSE_TRACKER_CHECK_CONSISTENCY") == "1"
+
+    def __init__(self, repository, database=None, parent=None):
+        super().__init__(parent)
+        self.repository = repository
+        self.database = database
+        self.expense_filter = ExpenseFilter()
+        self.rows = []
+        self.exhausted = False
+        self.pending = None
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+
+        record = self.rows[index.row()]
+        column = index.column()
+        if column == 0:
+            return str(record[0])
+        if column == 1:
+            return display_date(record[1])
+        if column == 3:
+            return format_amount(record[3], record[4])
+        return record[column]
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        return not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.exhausted or self.pending is not None:
+            return
+
+        # Keyset pagination: continue below the last (position, id) we already hold
+        after = (self.rows[-1][6], self.rows[-1][0]) if self.rows else None
+        if self.database is not None:
+            self.pending = self.database.submit(ExpenseRepository.fetch_page, after, self.page_size(),
+                                                self.expense_filter, on_result=self.append_page,
+                                                on_error=self.fetch_failed)
+            return
+
+        try:
+            batch = self.repository.fetch_page(after, self.page_size(), self.expense_filter)
+        except sqlite3.Error as error:
+            self.fetch_failed(error)
+            return
+        self.append_page(batch)
+
+    def page_size(self):
+        # A reload (which cancels any fetch in flight) is the only way back to no rows
+        return self.FETCH_SIZE if self.rows else self.FIRST_FETCH_SIZE
+
+    def fetch_failed(self, error):
+        print("Database Error in fetchMore:", error)
+        self.pending = None
+        self.exhausted = True
+
+    @timed("ui.append_page")
+    def append_page(self, batch):
+        profiling.increment("ui.pages_appended")
+        self.pending = None
+        if len(batch) < self.page_size():
+            self.exhausted = True
+
+        if batch:
+            first = len(self.rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(batch) - 1)
+            self.rows.extend(batch)
+            self.endInsertRows()
+
+    @timed("ui.model_reload")
+    def reload(self):
+        if self.pending is not None:
+            self.pending.cancel()
+            self.pending = None
+        self.beginResetModel()
+        self.rows = []
+        self.exhausted = False
+        self.endResetModel()
+        self.fetchMore()
+
+    def set_filter(self, expense_filter):
+        self.expense_filter = expense_filter
+        self.reload()
+
+    def is_filtered(self):
+        return self.expense_filter != ExpenseFilter()
+
+    def expense_id(self, row):
+        return self.rows[row][0]
+
+    @timed("ui.insert_record")
+    def insert_record(self, row, record):
+        if self.pending is not None and not self.rows:
+            # The first page is still being read and may or may not see this record
+            self.reload()
+            return
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.rows.insert(row, tuple(record))
+        self.endInsertRows()
+
+    @timed("ui.remove_record")
+    def remove_record(self, row):
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.rows[row]
+        self.endRemoveRows()
+
+    def verify_consistency(self):
+        """Raise AssertionError if the loaded rows differ from the database."""
+        expected = self.repository.fetch_page(None, len(self.rows), self.expense_filter)
+        if expected != self.rows:
+            mismatch = next((row for row, pair in enumerate(zip(expected, self.rows)) if pair[0] != pair[1]),
+                            min(len(expected), len(self.rows)))
+            raise AssertionError(f"Expense model out of sync with database at row {mismatch}")
+
+    def check_consistency(self):
+        if self.CHECK_CONSISTENCY:
+            self.verify_consistency()
+
+
+class ExpenseTableView(QTableView):
+    """The expenses table; its repaints (cell formatting included) are timed as ui.table_paint."""
+
+    @timed("ui.table_paint")
+    def paintEvent(self, event):
+        super().paintEvent(event)
+
+
+class SummaryPanel(QWidget):
+    """Totals per month x category x currency, read from the expense_rollups table.
+
+    The rollups are maintained by triggers, so a refresh costs O(buckets)
+    whatever the size of the ledger. Refreshes are skipped while the panel
+    is hidden and done on the next show instead. The query runs on the
+    DatabaseThread; a newer refresh cancels one still in flight. The widgets
+    themselves are only built when the tab is first shown, off the startup path.
+    """
+
+    HEADERS = ["Month", "Category", "Currency", "Total", "Count"]
+
+    def __init__(self, database, font, parent=None):
+        super().__init__(parent)
+        self.database = database
+        self.panel_font = font
+        self.dirty = True
+        self.pending = None
+        self.table = None
+
+    def build(self):
+        font = self.panel_font
+        self.period_label = QLabel("Period:")
+        self.period_label.setFont(font)
+        self.period = QComboBox()
+        self.period.setFont(font)
+        self.period.currentIndexChanged.connect(self.refresh)
+
+        self.table = QTableWidget(0, len(self.HEADERS))
+        self.table.setHorizontalHeaderLabels(self.HEADERS)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setFont(font)
+
+        self.period_row = QHBoxLayout()
+        self.period_row.addWidget(self.period_label)
+        self.period_row.addWidget(self.period, stretch=1)
+        self.panel_layout = QVBoxLayout()
+        self.panel_layout.addLayout(self.period_row)
+        self.panel_layout.addWidget(self.table)
+        self.setLayout(self.panel_layout)
+
+    def mark_dirty(self):
+        self.dirty = True
+        if self.isVisible():
+            self.refresh()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if self.table is None:
+            self.build()
+        if self.dirty:
+            self.refresh()
+
+    @staticmethod
+    def load(repository, period):
+        """Worker-thread half of refresh: the available years and the rollup rows for period."""
+        expense_filter = ExpenseFilter(*period_bounds(period)) if period else None
+        return repository.rollup_years(), repository.rollup_totals(("month", "category", "currency"), expense_filter)
+
+    def refresh(self):
+        if self.pending is not None:
+            self.pending.cancel()
+        period = self.period.currentText() if self.period.currentIndex() > 0 else None
+        self.pending = self.database.submit(self.load, period, on_result=self.show_rows, on_error=self.load_failed)
+
+    def load_failed(self, error):
+        self.pending = None
+        print("Database Error in SummaryPanel.refresh:", error)
+
+    @timed("ui.summary_rows")
+    def show_rows(self, result):
+        self.pending = None
+        self.dirty = False
+        years, rows = result
+        self.update_periods(years)
+
+        totals = format_amounts([row[3] for row in rows], [row[2] for row in rows])
+        self.table.setRowCount(len(rows))
+        for row, ((month, category, currency, _, count), total) in enumerate(zip(rows, totals)):
+            for column, text in enumerate((month, category, currency, total, str(count))):
+                item = QTableWidgetItem(text)
+                if column >= 3:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(row, column, item)
+
+    def update_periods(self, years):
+        periods = ["All time"] + years
+        if periods != [self.period.itemText(index) for index in range(self.period.count())]:
+            current = self.period.currentText()
+            self.period.blockSignals(True)
+            self.period.clear()
+            self.period.addItems(periods)
+            self.period.setCurrentIndex(max(self.period.findText(current), 0))
+            self.period.blockSignals(False)
+
+
+class BarChart(QWidget):
+    """Bars for a short series of (label, value), e.g. monthly totals; labels thin out when they would overlap."""
+
+    BAR_COLOR = QColor(70, 130, 180)
+    MARGIN = 8
+
+    def __init__(self, font, parent=None):
+        super().__init__(parent)
+        self.setFont(font)
+        self.setMinimumHeight(160)
+        self.labels = []
+        self.values = []
+        self.caption = ""
+
+    def set_series(self, labels, values, caption=""):
+        self.labels = labels
+        self.values = values
+        self.caption = caption
+        self.update()
+
+    @timed("ui.chart_paint")
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        metrics = painter.fontMetrics()
+        painter.drawText(self.MARGIN, self.MARGIN + metrics.ascent(), self.caption)
+        if not self.values:
+            return
+        top = self.MARGIN * 2 + metrics.height()
+        bottom = self.height() - self.MARGIN - metrics.height()
+        width = (self.width() - 2 * self.MARGIN) / len(self.values)
+        highest = max(max(self.values), 1)
+        # Every step-th label, so that neighbouring labels do not run into each other
+        step = max(1, int((metrics.horizontalAdvance("0000-00") + self.MARGIN) // max(width, 1)) + 1)
+        for index, (label, value) in enumerate(zip(self.labels, self.values)):
+            left = self.MARGIN + index * width
+            height = max(value, 0) / highest * (bottom - top)
+            painter.fillRect(int(left + 1), int(bottom - height), max(int(width) - 2, 1), int(height), self.BAR_COLOR)
+            if index % step == 0:
+                painter.drawText(int(left), self.height() - self.MARGIN - metrics.descent(), label)
+
+
+class ChartsPanel(QWidget):
+    """Monthly spending chart and per-category statistics for one currency and period.
+
+    Answered from an analytics.AnalyticsCache (NumPy columns of the
+    expenses table) instead of SQL, so a redraw takes milliseconds even on
+    millions of expenses. The cache is built on the DatabaseThread the first
+    time the tab is shown; after that a refresh only replays the journal
+    entries written since (AnalyticsCache.sync). Like SummaryPanel, changes
+    made while the tab is hidden wait for the next show. Only added as a tab
+    when NumPy is installed.
+    """
+
+    HEADERS = ["Category", "Count", "Total", "Mean", "Median", "90th pct", "vs. year before"]
+
+    def __init__(self, database, font, parent=None):
+        super().__init__(parent)
+        self.database = database
+        self.panel_font = font
+        self.dirty = True
+        self.pending = None
+        self.cache = None
+        self.table = None
+
+    def build(self):
+        font = self.panel_font
+        self.currency = QComboBox()
+        self.currency.setFont(font)
+        self.currency.currentIndexChanged.connect(self.redraw)
+        self.period = QComboBox()
+        self.period.setFont(font)
+        self.period.currentIndexChanged.connect(self.redraw)
+        self.status = QLabel()
+        self.status.setFont(font)
+
+        self.chart = BarChart(font)
+        self.table = QTableWidget(0, len(self.HEADERS))
+        self.table.setHorizontalHeaderLabels(self.HEADERS)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setFont(font)
+
+        self.options_row = QHBoxLayout()
+        for label, combo in (("Currency:", self.currency), ("Period:", self.period)):
+            label = QLabel(label)
+            label.setFont(font)
+            self.options_row.addWidget(label)
+            self.options_row.addWidget(combo, stretch=1)
+        self.options_row.addWidget(self.status)
+        self.panel_layout = QVBoxLayout()
+        self.panel_layout.addLayout(self.options_row)
+        self.panel_layout.addWidget(self.chart, stretch=1)
+        self.panel_layout.addWidget(self.table, stretch=1)
+        self.setLayout(self.panel_layout)
+
+    def mark_dirty(self):
+        self.dirty = True
+        if self.isVisible():
+            self.refresh()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if self.table is None:
+            self.build()
+        if self.dirty:
+            self.refresh()
+
+    def refresh(self):
+        if self.pending is not None:
+            # The cache is being built or synced on the worker; sync again once that is done
+            self.dirty = True
+            return
+        self.dirty = False
+        if self.cache is None:
+            self.status.setText("Loading...")
+        self.pending = self.database.submit(analytics.synced, self.cache, on_result=self.cache_synced,
+                                            on_error=self.load_failed)
+
+    def load_failed(self, error):
+        self.pending = None
+        print("Database Error in ChartsPanel.refresh:", error)
+
+    def cache_synced(self, cache):
+        self.pending = None
+        self.cache = cache
+        if self.dirty and self.isVisible():
+            self.refresh()
+            return
+        self.update_choices()
+        self.redraw()
+
+    def update_choices(self):
+        currencies = self.cache.currencies_used()
+        years = self.cache.years()
+        for combo, items in ((self.currency, currencies), (self.period, ["All time"] + years[::-1])):
+            if items != [combo.itemText(index) for index in range(combo.count())]:
+                current = combo.currentText()
+                combo.blockSignals(True)
+                combo.clear()
+                combo.addItems(items)
+                combo.setCurrentIndex(max(combo.findText(current), 0))
+                combo.blockSignals(False)
+
+    def redraw(self):
+        # The worker replaces the cache's columns while it syncs; the result redraws anyway
+        if self.cache is None or self.pending is not None:
+            return
+        with timed("ui.charts_redraw"):
+            start = time.perf_counter()
+            currency = self.currency.currentText()
+            if not currency:
+                self.chart.set_series([], [], "No expenses")
+                self.table.setRowCount(0)
+                self.status.setText("")
+                return
+            period = self.period.currentText() if self.period.currentIndex() > 0 else None
+            expense_filter = ExpenseFilter(*period_bounds(period), currency=currency) if period else \
+                ExpenseFilter(currency=currency)
+            months = self.cache.month_over_month(expense_filter)
+            caption = f"Spending per month ({currency})"
+            if months and months[-1].change is not None:
+                caption += f", {months[-1].month}: {months[-1].change:+.1%} on the month before"
+            self.chart.set_series([change.month for change in months], [change.total for change in months], caption)
+            self.show_statistics(self.cache.statistics(("category",), expense_filter),
+                                 self.previous_totals(period, currency), currency)
+            self.status.setText(f"{len(self.cache):,} expenses, "
+                                f"{(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def previous_totals(self, period, currency):
+        """Category totals of the year before period (None for all time), to compare with."""
+        if period is None:
+            return {}
+        previous = ExpenseFilter(*period_bounds(f"{int(period) - 1:04d}"), currency=currency)
+        return {category: total for category, total, _ in self.cache.totals(("category",), previous)}
+
+    def show_statistics(self, rows, previous, currency):
+        self.table.setRowCount(len(rows))
+        amounts = format_amounts([round(value) for row in rows for value in row[2:6]], [currency] * (4 * len(rows)))
+        for row, (category, count, total, *_) in enumerate(rows):
+            before = previous.get(category)
+            change = f"{(total - before) / abs(before):+.1%}" if before else ""
+            texts = [category or "", f"{count:,}", *amounts[4 * row:4 * row + 4], change]
+            for column, text in enumerate(texts):
+                item = QTableWidgetItem(text)
+                if column > 0:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(row, column, item)
+
+
+class ProfilePanel(QWidget):
+    """Debug view of profiling.snapshot(): timings, counters and the slow operations log.
+
+    Only added as a tab when profiling is on (EXPENSE_TRACKER_PROFILE=1). It
+    refreshes every REFRESH_MS while visible; Save writes the same JSON as
+    EXPENSE_TRACKER_PROFILE_JSON does at exit.
+    """
+
+    HEADERS = ["Operation", "Count", "Total ms", "Mean ms", "p50 ms", "p95 ms", "Max ms"]
+    REFRESH_MS = 1000
+
+    def __init__(self, font, parent=None):
+        super().__init__(parent)
+        self.timings = self.make_table(self.HEADERS, font)
+        self.counters = self.make_table(["Counter", "Value"], font)
+        self.slow = self.make_table(["Time", f"Slow operation (>= {profiling.SLOW_MS:g} ms)", "ms"], font)
+
+        self.reset_button = QPushButton("Reset")
+        self.reset_button.clicked.connect(self.reset)
+        self.save_button = QPushButton("Save JSON...")
+        self.save_button.clicked.connect(self.save)
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(self.REFRESH_MS)
+        self.refresh_timer.timeout.connect(self.refresh)
+
+        self.lower_row = QHBoxLayout()
+        self.lower_row.addWidget(self.counters, stretch=1)
+        self.lower_row.addWidget(self.slow, stretch=2)
+        self.button_row = QHBoxLayout()
+        self.button_row.addStretch(1)
+        self.button_row.addWidget(self.reset_button)
+        self.button_row.addWidget(self.save_button)
+        self.panel_layout = QVBoxLayout()
+        self.panel_layout.addWidget(self.timings, stretch=2)
+        self.panel_layout.addLayout(self.lower_row, stretch=1)
+        self.panel_layout.addLayout(self.button_row)
+        self.setLayout(self.panel_layout)
+
+    @staticmethod
+    def make_table(headers, font):
+        table = QTableWidget(0, len(headers))
+        table.setHorizontalHeaderLabels(headers)
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        table.setEditTriggers(QTableWidget.NoEditTriggers)
+        table.setFont(font)
+        return table
+
+    @staticmethod
+    def fill(table, rows):
+        table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for column, text in enumerate(values):
+                item = QTableWidgetItem(text)
+                if column > 0:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                table.setItem(row, column, item)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh()
+        self.refresh_timer.start()
+
+    def hideEvent(self, event):
+        self.refresh_timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        snapshot = profiling.snapshot()
+        self.fill(self.timings, [
+            (name, f"{timing['count']:,}", f"{timing['total_ms']:,.1f}", f"{timing['mean_ms']:.3f}",
+             f"{timing['p50_ms']:g}", f"{timing['p95_ms']:g}", f"{timing['max_ms']:.1f}")
+            for name, timing in snapshot["timings"].items()])
+        self.fill(self.counters, [(name, f"{value:,}") for name, value in snapshot["counters"].items()])
+        self.fill(self.slow, [(entry["time"][11:], entry["name"], f"{entry['ms']:.1f}")
+                              for entry in reversed(snapshot["slow"])])
+
+    def reset(self):
+        profiling.reset()
+        self.refresh()
+
+    def save(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Save Profile", "profile.json", "JSON (*.json)")
+        if not path:
+            return
+        try:
+            profiling.dump(path)
+        except OSError as error:
+            QMessageBox.critical(self, "Save Failed", str(error))
+
 
 class ExpenseApp(QWidget):
-    def __init__(self):
+    def __init__(self, repository, database):
         super().__init__()
+        self.repository = repository
+        self.database = database
         self.resize(800, 600)  # Increased window width
         self.setWindowTitle("Expense Tracker 2.0")
 
@@ -59,7 +621,7 @@ class ExpenseApp(QWidget):
                 border-color: #000000 transparent transparent transparent;
                 margin-right: 4px; /* Adjust to align arrow properly */
             }
-            QTableWidget {
+            QTableView {
                 background-color: #ffffff; /* White background */
                 color: #000000; /* Black text */
                 gridline-color: #dcdcdc; /* Light gray grid lines */
@@ -86,13 +648,10 @@ class ExpenseApp(QWidget):
             }
         """)
 
-        # Determine the operating system
-        system_platform = platform.system()
-
-        # Set professional font for labels and inputs
-        if system_platform == 'Windows':
+        # Set professional font for labels and inputs (sys.platform: the platform module is slow to import)
+        if sys.platform == 'win32':
             professional_font_name = "Segoe UI"
-        elif system_platform == 'Darwin':  # Mac OS
+        elif sys.platform == 'darwin':  # Mac OS
             professional_font_name = "Helvetica Neue"
         else:
             professional_font_name = "Arial"  # As a fallback for Linux or others
@@ -103,30 +662,7 @@ class ExpenseApp(QWidget):
         self.table_font = QFont(professional_font_name, 10)
 
         # Currency data with symbols and formatting
-        self.currency_data = {
-            'USD': {'symbol': '$', 'decimal_sep': '.', 'thousand_sep': ','},
-            'EUR': {'symbol': '€', 'decimal_sep': ',', 'thousand_sep': '.'},
-            'GBP': {'symbol': '£', 'decimal_sep': '.', 'thousand_sep': ','},
-            'JPY': {'symbol': '¥', 'decimal_sep': '.', 'thousand_sep': ','},
-            'AUD': {'symbol': '$', 'decimal_sep': '.', 'thousand_sep': ','},
-            'CAD': {'symbol': '$', 'decimal_sep': '.', 'thousand_sep': ','},
-            'CHF': {'symbol': 'CHF', 'decimal_sep': '.', 'thousand_sep': '\''},
-            'CNY': {'symbol': '¥', 'decimal_sep': '.', 'thousand_sep': ','},
-            'SEK': {'symbol': 'kr', 'decimal_sep': ',', 'thousand_sep': ' '},
-            'NZD': {'symbol': '$', 'decimal_sep': '.', 'thousand_sep': ','},
-            'CZK': {'symbol': 'Kč', 'decimal_sep': ',', 'thousand_sep': ' '},
-            'PLN': {'symbol': 'zł', 'decimal_sep': ',', 'thousand_sep': ' '},
-            'HUF': {'symbol': 'Ft', 'decimal_sep': ',', 'thousand_sep': ' '},
-            'DKK': {'symbol': 'kr', 'decimal_sep': ',', 'thousand_sep': '.'},
-            'NOK': {'symbol': 'kr', 'decimal_sep': ',', 'thousand_sep': ' '},
-            'RUB': {'symbol': '₽', 'decimal_sep': ',', 'thousand_sep': ' '},
-            'TRY': {'symbol': '₺', 'decimal_sep': ',', 'thousand_sep': '.'},
-            'ISK': {'symbol': 'kr', 'decimal_sep': '.', 'thousand_sep': ','},
-            'RON': {'symbol': 'lei', 'decimal_sep': ',', 'thousand_sep': '.'},
-            'HRK': {'symbol': 'kn', 'decimal_sep': ',', 'thousand_sep': '.'},
-            'SKK': {'symbol': 'Sk', 'decimal_sep': ',', 'thousand_sep': ' '},  # Slovak Koruna (historic)
-            # Add more currencies as needed
-        }
+        self.currency_data = CURRENCY_DATA
 
         self.date_box = QDateEdit()
         self.date_box.setDate(QDate.currentDate())
@@ -152,6 +688,16 @@ class ExpenseApp(QWidget):
         self.currency_label.setFont(professional_font)
         self.currency_dropdown.setFont(professional_font)
 
+        # Anything but "Once" turns the expense into a rule in recurring_rules
+        self.repeat_label = QLabel("Repeat:")
+        self.repeat_label.setFont(professional_font)
+        self.repeat_dropdown = QComboBox()
+        self.repeat_dropdown.setFont(professional_font)
+        for text, frequency in (("Once", None), ("Every week", "weekly"), ("Every month", "monthly"),
+                                ("Every year", "yearly")):
+            self.repeat_dropdown.addItem(text, frequency)
+        self.repeat_dropdown.setToolTip("Add Expense only: repeat from the chosen date, catching up to today")
+
         self.description_label = QLabel("Description:")
         self.description_label.setFont(professional_font)
         self.description.setFont(professional_font)
@@ -159,14 +705,20 @@ class ExpenseApp(QWidget):
         self.add_button = QPushButton("Add Expense")
         self.insert_button = QPushButton("Insert Expense")
         self.delete_button = QPushButton("Delete Expense")
+        self.import_button = QPushButton("Import...")
+        self.export_button = QPushButton("Export...")
         self.add_button.clicked.connect(self.add_expense)
         self.insert_button.clicked.connect(self.insert_expense)
         self.delete_button.clicked.connect(self.delete_expense)
+        self.import_button.clicked.connect(self.import_expenses)
+        self.export_button.clicked.connect(self.export_expenses)
 
         # Apply professional font to buttons
         self.add_button.setFont(professional_font)
         self.insert_button.setFont(professional_font)
         self.delete_button.setFont(professional_font)
+        self.import_button.setFont(professional_font)
+        self.export_button.setFont(professional_font)
 
         # Populate currency dropdown with currencies
         self.currency_dropdown.addItems(sorted(self.currency_data.keys()))
@@ -197,35 +749,73 @@ class ExpenseApp(QWidget):
         # Placeholder for the validator, will be set in update_currency_formatting
         self.validator = None
 
-        self.table = QTableWidget()
-        self.table.setColumnCount(6)  # ID, date, category, amount, currency, description
-        self.table.setHorizontalHeaderLabels(["Id", "Date", "Category", "Amount", "Currency", "Description"])
+        self.model = ExpenseTableModel(self.repository, self.database, self)
+        # The worker opens its connection and reads the first screenful while the rest of the
+        # window is built; the rows arrive through the event loop once the window is shown
+        self.load_table()
+        # Work that can wait until the window is on screen (see paintEvent)
+        self.deferred_startup = True
+
+        self.table = ExpenseTableView()
+        self.table.setModel(self.model)  # ID, date, category, amount, currency, description
+        self.table.setSelectionBehavior(QTableView.SelectRows)
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        # Fixed row heights so the view never measures rows it is not painting
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
         self.table.setFont(self.table_font)  # Set professional font for table
 
-        self.dropdown.addItems(sorted([
-            "Rent", "Utilities", "House Payment", "Internet", "Savings (Acorn)", "Savings Account",
-            "Medicaid", "GoodRX", "Medication Payment", "Medicare (Part B)", "Medicare (Part A)",
-            "American Health Insurance", "Czech Health Insurance", "German Health Insurance",
-            "Slovak Health Insurance", "American Dental Insurance", "Czech Dental Insurance",
-            "German Dental Insurance", "Slovak Dental Insurance", "Teeth Cleaning", "Night Guard",
-            "Dental Work", "Uber Ride", "Bus Ride", "Tram Ride", "Subway Ride", "Train Ride",
-            "Train (Snack)", "Train (Drink)", "Taxi Ride", "Plane Ticket",
-            "Plane (Select Seating)", "Plane (Upgrade Seat)", "Plane (Baggage Payment)",
-            "Plane (Internet Payment)", "Plane (Buy Alcohol)", "Plane (Buy Snack)",
-            "Food Delivery", "Takeout", "Dining Out", "Food", "Dessert", "Drinks", "Alcohol",
-            "Marijuana", "Clothing", "Shoes", "Regular Book Purchase",
-            "Regular Newspaper Purchase", "Furniture", "Mattress", "Painting", "Kitchen Appliance",
-            "Computer", "Printer", "Electronics", "TV Payment", "Dishware/Tableware", "Cutlery",
-            "Household Cleaning Supplies", "Miscellaneous Apartment Items", "Google One",
-            "New York Times", "Der Spiegel", "Amazon Prime", "Amazon (Purchase Video)",
-            "Amazon Kindle (Purchase Book)", "Amazon Kindle (Audio Book)", "YouTube Music Premium",
-            "DVD", "CD", "Crunchyroll Subscription", "Crunchyroll Merchandise",
-            "Czech Phone Payment", "German Phone Payment", "Google Phone Payment", "Netflix",
-            "Disney+", "ChatGPT", "App Deploying Service", "Payment for AI", "Disney+ Package",
-            "Hulu", "ESPN", "Adobe Scan", "Duolingo", "Tinder", "New York Times Cooking",
-            "Adobe Acrobat Reader: Edit PDF"
-        ]))
+        # Categories come from the database; typing a new name adds it with the expense
+        self.categories = self.repository.category_names()
+        self.dropdown.setEditable(True)
+        self.dropdown.setInsertPolicy(QComboBox.NoInsert)
+        self.dropdown.addItems(self.categories)
+
+        # Filter bar: every field is pushed down into the SQL of the table model
+        self.filter_from = QDateEdit()
+        self.filter_to = QDateEdit()
+        for filter_date in (self.filter_from, self.filter_to):
+            # The minimum date stands for "no limit" and is shown as "Any"
+            filter_date.setMinimumDate(QDate(1900, 1, 1))
+            filter_date.setSpecialValueText("Any")
+            filter_date.setDate(filter_date.minimumDate())
+            filter_date.setCalendarPopup(True)
+            filter_date.setFont(professional_font)
+            filter_date.dateChanged.connect(self.schedule_filter)
+        self.filter_category = QComboBox()
+        self.filter_category.addItem("All categories")
+        self.filter_category.addItems(self.categories)
+        self.filter_currency = QComboBox()
+        self.filter_currency.addItem("All currencies")
+        self.filter_currency.addItems(sorted(self.currency_data.keys()))
+        for filter_combo in (self.filter_category, self.filter_currency):
+            filter_combo.setFont(professional_font)
+            filter_combo.currentIndexChanged.connect(self.schedule_filter)
+        self.filter_min_amount = QLineEdit()
+        self.filter_min_amount.setPlaceholderText("Min amount")
+        self.filter_max_amount = QLineEdit()
+        self.filter_max_amount.setPlaceholderText("Max amount")
+        self.search_box = QLineEdit()
+        self.search_box.setPlaceholderText("Search description or category")
+        for filter_text in (self.filter_min_amount, self.filter_max_amount, self.search_box):
+            filter_text.setFont(professional_font)
+            filter_text.textChanged.connect(self.schedule_filter)
+        self.filter_from_label = QLabel("From:")
+        self.filter_from_label.setFont(professional_font)
+        self.filter_to_label = QLabel("To:")
+        self.filter_to_label.setFont(professional_font)
+
+        # Debounce: typing restarts the timer, the query runs once input pauses
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(250)
+        self.filter_timer.timeout.connect(self.apply_filter)
+
+        # Ctrl+Z / Ctrl+Y (platform equivalents) step through the change journal;
+        # inside a text field they still undo typing first
+        self.undo_shortcut = QShortcut(QKeySequence.Undo, self)
+        self.undo_shortcut.activated.connect(self.undo)
+        self.redo_shortcut = QShortcut(QKeySequence.Redo, self)
+        self.redo_shortcut.activated.connect(self.redo)
 
         # Layouts
         self.master_layout = QVBoxLayout()
@@ -233,6 +823,8 @@ class ExpenseApp(QWidget):
         self.row2a = QHBoxLayout()
         self.row2b = QHBoxLayout()
         self.row3 = QHBoxLayout()
+        self.filter_row1 = QHBoxLayout()
+        self.filter_row2 = QHBoxLayout()
 
         # Add widgets to row1 with stretch factors
         self.row1.addWidget(self.date_label)
@@ -245,6 +837,8 @@ class ExpenseApp(QWidget):
         self.row2a.addWidget(self.amount)
         self.row2a.addWidget(self.currency_label)
         self.row2a.addWidget(self.currency_dropdown)
+        self.row2a.addWidget(self.repeat_label)
+        self.row2a.addWidget(self.repeat_dropdown)
 
         # Add widgets to row2b with stretch factors
         self.row2b.addWidget(self.description_label)
@@ -254,329 +848,385 @@ class ExpenseApp(QWidget):
         self.row3.addWidget(self.add_button)
         self.row3.addWidget(self.insert_button)
         self.row3.addWidget(self.delete_button)
+        self.row3.addWidget(self.import_button)
+        self.row3.addWidget(self.export_button)
 
         self.master_layout.addLayout(self.row1)
         self.master_layout.addLayout(self.row2a)
         self.master_layout.addLayout(self.row2b)
+        # Add filter widgets to the two filter rows
+        self.filter_row1.addWidget(self.filter_from_label)
+        self.filter_row1.addWidget(self.filter_from)
+        self.filter_row1.addWidget(self.filter_to_label)
+        self.filter_row1.addWidget(self.filter_to)
+        self.filter_row1.addWidget(self.filter_category, stretch=1)
+        self.filter_row1.addWidget(self.filter_currency)
+        self.filter_row2.addWidget(self.filter_min_amount)
+        self.filter_row2.addWidget(self.filter_max_amount)
+        self.filter_row2.addWidget(self.search_box, stretch=1)
+
+        # Expenses tab: filter bar and table; Summary tab: rollup dashboard; Charts tab: analytics cache
+        self.expenses_tab = QWidget()
+        self.expenses_layout = QVBoxLayout()
+        self.expenses_layout.setContentsMargins(0, 0, 0, 0)
+        self.expenses_layout.addLayout(self.filter_row1)
+        self.expenses_layout.addLayout(self.filter_row2)
+        self.expenses_layout.addWidget(self.table)
+        self.expenses_tab.setLayout(self.expenses_layout)
+
+        self.summary = SummaryPanel(self.database, self.table_font)
+        self.charts = ChartsPanel(self.database, self.table_font) if analytics.available() else None
+
+        self.tabs = QTabWidget()
+        self.tabs.setFont(professional_font)
+        self.tabs.addTab(self.expenses_tab, "Expenses")
+        self.tabs.addTab(self.summary, "Summary")
+        if self.charts is not None:
+            self.tabs.addTab(self.charts, "Charts")
+        if profiling.ENABLED:
+            self.profile_panel = ProfilePanel(self.table_font)
+            self.tabs.addTab(self.profile_panel, "Profile")
+
         self.master_layout.addLayout(self.row3)
-        self.master_layout.addWidget(self.table)
+        self.master_layout.addWidget(self.tabs)
 
         self.setLayout(self.master_layout)
 
         # Initialize currency formatting
         self.update_currency_formatting()
 
-        self.load_table()
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.deferred_startup:
+            self.deferred_startup = False
+            # Started from the event loop after the first paint: the catch-up's Python work on the
+            # worker thread would otherwise compete with building and painting the window for the GIL
+            QTimer.singleShot(0, self.catch_up_recurring)
 
     def update_currency_formatting(self):
-        currency = self.currency_dropdown.currentText()
-        decimal_sep = self.currency_data[currency]['decimal_sep']
-        thousand_sep = self.currency_data[currency]['thousand_sep']
-
         # Update the regular expression validator
-        escaped_decimal_sep = re.escape(decimal_sep)
-        escaped_thousand_sep = re.escape(thousand_sep)
-
-        reg_ex_pattern = f"^-?[0-9{escaped_thousand_sep}]*{escaped_decimal_sep}?[0-9]*$"
-
-        reg_ex = QRegularExpression(reg_ex_pattern)
+        reg_ex = QRegularExpression(self.current_amount_format().input_pattern)
         validator = QRegularExpressionValidator(reg_ex, self.amount)
         self.amount.setValidator(validator)
 
         # Update the amount field to reformat existing text if any
         self.format_amount()
 
+    def current_amount_format(self):
+        return amount_format(self.currency_dropdown.currentText())
+
     def format_amount(self):
         """Format the amount with commas/periods as user types, according to currency."""
-        cursor_pos = self.amount.cursorPosition()
-        text = self.amount.text()
-
-        currency = self.currency_dropdown.currentText()
-        decimal_sep = self.currency_data[currency]['decimal_sep']
-        thousand_sep = self.currency_data[currency]['thousand_sep']
-
-        # Remove thousand separators to work with the raw number
-        text_without_thousand_sep = text.replace(thousand_sep, '')
-        # Keep track of the position of the cursor in the text without thousand separators
-        cursor_pos_without_thousand_sep = cursor_pos - text[:cursor_pos].count(thousand_sep)
-
-        if text_without_thousand_sep:
-            try:
-                # Check for negative sign
-                negative = False
-                if text_without_thousand_sep.startswith('-'):
-                    negative = True
-                    text_without_thousand_sep = text_without_thousand_sep[1:]
-                    cursor_pos_without_thousand_sep -= 1
-
-                # Separate integer and decimal parts
-                if decimal_sep in text_without_thousand_sep:
-                    integer_part, decimal_part = text_without_thousand_sep.split(decimal_sep, 1)
-                else:
-                    integer_part = text_without_thousand_sep
-                    decimal_part = ''
-
-                # Remove any non-digit characters
-                integer_part = re.sub(r'\D', '', integer_part)
-                decimal_part = re.sub(r'\D', '', decimal_part)
-
-                # Format the integer part with thousand separators
-                if integer_part:
-                    reversed_integer = integer_part[::-1]
-                    grouped = [reversed_integer[i:i+3] for i in range(0, len(reversed_integer), 3)]
-                    integer_part_with_thousand_sep = thousand_sep.join(grouped)[::-1]
-                else:
-                    integer_part_with_thousand_sep = ''
-
-                # Reconstruct the formatted text
-                if decimal_part != '':
-                    formatted_text = integer_part_with_thousand_sep + decimal_sep + decimal_part
-                else:
-                    # Check if user typed a decimal separator at the end
-                    if decimal_sep in text_without_thousand_sep and text_without_thousand_sep.endswith(decimal_sep):
-                        formatted_text = integer_part_with_thousand_sep + decimal_sep
-                    else:
-                        formatted_text = integer_part_with_thousand_sep
-
-                if negative:
-                    formatted_text = '-' + formatted_text
-                    cursor_pos_without_thousand_sep += 1
-
-                # Update the cursor position based on the new formatted text
-                new_cursor_pos = 0
-                idx_without_thousand_sep = 0
-                for idx_with_thousand_sep, char in enumerate(formatted_text):
-                    if idx_without_thousand_sep >= cursor_pos_without_thousand_sep:
-                        break
-                    if char != thousand_sep:
-                        idx_without_thousand_sep += 1
-                    new_cursor_pos += 1
-
-                self.amount.blockSignals(True)
-                self.amount.setText(formatted_text)
-                self.amount.setCursorPosition(new_cursor_pos)
-                self.amount.blockSignals(False)
-            except ValueError:
-                # If input is not a valid number, do not format
-                pass
-        else:
+        with timed("ui.format_amount"):
+            text, cursor = self.current_amount_format().reformat_input(self.amount.text(),
+                                                                       self.amount.cursorPosition())
             self.amount.blockSignals(True)
-            self.amount.clear()
+            self.amount.setText(text)
+            self.amount.setCursorPosition(cursor)
             self.amount.blockSignals(False)
 
     def load_table(self):
-        self.table.setRowCount(0)
-
-        query = QSqlQuery("SELECT * FROM expenses ORDER BY id DESC")
-        row = 0
-        while query.next():
-            expense_id = query.value(0)
-            date = query.value(1)
-            category = query.value(2)
-            amount = query.value(3)
-            currency = query.value(4)
-            description = query.value(5)
-
-            self.table.insertRow(row)
-
-            # Get the currency data
-            currency_data = self.currency_data.get(currency, {'symbol': '', 'decimal_sep': '.', 'thousand_sep': ','})
-            symbol = currency_data['symbol']
-            decimal_sep = currency_data['decimal_sep']
-            thousand_sep = currency_data['thousand_sep']
-
-            # Format the amount
-            amount_str = "{:,.2f}".format(amount)
-            # Replace the decimal point and thousand separator as per currency
-            amount_str = amount_str.replace(',', 'TEMP').replace('.', decimal_sep).replace('TEMP', thousand_sep)
-            formatted_amount = f"{symbol}{amount_str}"
-
-            # Create table items with professional font
-            item_id = QTableWidgetItem(str(expense_id))
-            item_date = QTableWidgetItem(date)
-            item_category = QTableWidgetItem(category)
-            item_amount = QTableWidgetItem(formatted_amount)
-            item_currency = QTableWidgetItem(currency)
-            item_description = QTableWidgetItem(description)
-
-            # Set professional font to table items using self.table_font
-            item_id.setFont(self.table_font)
-            item_date.setFont(self.table_font)
-            item_category.setFont(self.table_font)
-            item_amount.setFont(self.table_font)
-            item_currency.setFont(self.table_font)
-            item_description.setFont(self.table_font)
-
-            self.table.setItem(row, 0, item_id)
-            self.table.setItem(row, 1, item_date)
-            self.table.setItem(row, 2, item_category)
-            self.table.setItem(row, 3, item_amount)
-            self.table.setItem(row, 4, item_currency)
-            self.table.setItem(row, 5, item_description)
-
-            row += 1
+        self.model.reload()
 
-    def add_expense(self):
-        date = self.date_box.date().toString("dd-MM-yyyy")
-        category = self.dropdown.currentText()
+    def schedule_filter(self):
+        self.filter_timer.start()
+
+    def read_filter(self):
+        """Build an ExpenseFilter from the filter bar; unparsable amounts are ignored."""
+        def filter_date(date_edit, days=0):
+            if date_edit.date() == date_edit.minimumDate():
+                return None
+            return date_edit.date().addDays(days).toString("yyyy-MM-dd")
+
+        def filter_amount(line_edit):
+            try:
+                return parse_amount(line_edit.text(), amount_currency)
+            except ValueError:
+                return None
+
+        currency = self.filter_currency.currentText() if self.filter_currency.currentIndex() > 0 else None
+        # Amount bounds are typed with the separators of the filtered (or form) currency
+        amount_currency = currency or self.currency_dropdown.currentText()
+        return ExpenseFilter(
+            start=filter_date(self.filter_from),
+            end=filter_date(self.filter_to, days=1),  # "To" is inclusive
+            category=self.filter_category.currentText() if self.filter_category.currentIndex() > 0 else None,
+            currency=currency,
+            min_amount=filter_amount(self.filter_min_amount),
+            max_amount=filter_amount(self.filter_max_amount),
+            text=self.search_box.text().strip() or None,
+        )
+
+    def apply_filter(self):
+        expense_filter = self.read_filter()
+        if expense_filter != self.model.expense_filter:
+            self.model.set_filter(expense_filter)
+
+    def read_form(self):
+        """Return (date, category, amount, currency, description) from the form, or None if invalid."""
+        date = self.date_box.date().toString("yyyy-MM-dd")
+        category = self.dropdown.currentText().strip()
         amount_text = self.amount.text()
         description = self.description.text()
         currency = self.currency_dropdown.currentText()
-        decimal_sep = self.currency_data[currency]['decimal_sep']
-        thousand_sep = self.currency_data[currency]['thousand_sep']
-
-        # Remove thousand separators
-        amount_text = amount_text.replace(thousand_sep, '')
-        # Replace decimal separator with '.'
-        amount_text = amount_text.replace(decimal_sep, '.')
 
+        if not category:
+            QMessageBox.warning(self, "Invalid Input", "Please choose or type a category.")
+            return None
         try:
-            amount = float(amount_text)
+            amount = parse_amount(amount_text, currency)
         except ValueError:
             QMessageBox.warning(self, "Invalid Input", "Please enter a valid amount.")
-            return
+            return None
 
-        # Get the next available id using COALESCE to handle empty tables
-        query = QSqlQuery("SELECT COALESCE(MAX(id), 0) FROM expenses")
-        if query.next():
-            max_id = int(query.value(0))
-        else:
-            max_id = 0
-
-        new_id = max_id + 1
-
-        insert_query = QSqlQuery()
-        insert_query.prepare("INSERT INTO expenses (id, date, category, amount, currency, description) VALUES (?, ?, ?, ?, ?, ?)")
-        insert_query.addBindValue(new_id)
-        insert_query.addBindValue(date)
-        insert_query.addBindValue(category)
-        insert_query.addBindValue(amount)
-        insert_query.addBindValue(currency)
-        insert_query.addBindValue(description)
-        if not insert_query.exec_():
-            error = insert_query.lastError().text()
-            QMessageBox.critical(self, "Database Error", error)
-            print("Database Error in add_expense:", error)  # Optional: Print error to console
+        return date, category, amount, currency, description
+
+    def remember_category(self, category):
+        """Offer a category that was just added to the database in both dropdowns."""
+        if category in self.categories:
             return
+        index = bisect.bisect(self.categories, category)
+        self.categories.insert(index, category)
+        self.dropdown.insertItem(index, category)
+        self.filter_category.insertItem(index + 1, category)  # after "All categories"
 
+    def reset_form(self):
         # Reset input fields
         self.date_box.setDate(QDate.currentDate())
         self.dropdown.setCurrentIndex(0)
         self.currency_dropdown.setCurrentIndex(0)
+        self.repeat_dropdown.setCurrentIndex(0)
         self.amount.clear()
         self.description.clear()
 
-        self.load_table()
+    def expenses_changed(self):
+        self.summary.mark_dirty()
+        if self.charts is not None:
+            self.charts.mark_dirty()
 
-    def insert_expense(self):
-        selected_row = self.table.currentRow()
-        if selected_row == -1:
-            QMessageBox.warning(self, "No Row Selected", "Please select a row to insert the new expense after.")
+    def show_database_error(self, operation, error):
+        QMessageBox.critical(self, "Database Error", str(error))
+        print(f"Database Error in {operation}:", error)  # Optional: Print error to console
+
+    def add_expense(self):
+        expense = self.read_form()
+        if expense is None:
+            return
+        if self.repeat_dropdown.currentData() is not None:
+            self.add_recurring_expense(expense, self.repeat_dropdown.currentData())
             return
 
-        # Get the selected row's ID
-        selected_id = int(self.table.item(selected_row, 0).text())
-
-        # Shift all the rows with id >= selected_id + 1
-        shift_query = QSqlQuery()
-        shift_query.prepare("UPDATE expenses SET id = id + 1 WHERE id >= ?")
-        shift_query.addBindValue(selected_id + 1)
-        if not shift_query.exec_():
-            error = shift_query.lastError().text()
-            QMessageBox.critical(self, "Database Error", error)
-            print("Database Error in shift_query:", error)  # Optional: Print error to console
+        try:
+            record = self.repository.add(*expense)
+        except sqlite3.Error as error:
+            self.show_database_error("add_expense", error)
             return
 
-        # Insert new expense at the next ID
-        date = self.date_box.date().toString("dd-MM-yyyy")
-        category = self.dropdown.currentText()
-        amount_text = self.amount.text()
-        description = self.description.text()
-        currency = self.currency_dropdown.currentText()
-        decimal_sep = self.currency_data[currency]['decimal_sep']
-        thousand_sep = self.currency_data[currency]['thousand_sep']
+        self.remember_category(record[2])
+        self.reset_form()
 
-        # Remove thousand separators
-        amount_text = amount_text.replace(thousand_sep, '')
-        # Replace decimal separator with '.'
-        amount_text = amount_text.replace(decimal_sep, '.')
+        if self.model.is_filtered():
+            # The new expense may not match the filter; refetching the first page is cheap
+            self.load_table()
+        else:
+            # The new expense has the highest position, so it goes on top
+            self.model.insert_record(0, record)
+        self.model.check_consistency()
+        self.expenses_changed()
 
+    def add_recurring_expense(self, expense, frequency):
+        date, category, amount, currency, description = expense
         try:
-            amount = float(amount_text)
-        except ValueError:
-            QMessageBox.warning(self, "Invalid Input", "Please enter a valid amount.")
+            recurring.add_rule(self.repository, category, amount, currency, description, frequency, date)
+            # Writes this occurrence and any others between the chosen date and today, in one batch
+            recurring.catch_up(self.repository)
+        except (sqlite3.Error, ValueError) as error:
+            self.show_database_error("add_recurring_expense", error)
             return
 
-        insert_query = QSqlQuery()
-        insert_query.prepare("INSERT INTO expenses (id, date, category, amount, currency, description) VALUES (?, ?, ?, ?, ?, ?)")
-        insert_query.addBindValue(selected_id + 1)
-        insert_query.addBindValue(date)
-        insert_query.addBindValue(category)
-        insert_query.addBindValue(amount)
-        insert_query.addBindValue(currency)
-        insert_query.addBindValue(description)
-        if not insert_query.exec_():
-            error = insert_query.lastError().text()
-            QMessageBox.critical(self, "Database Error", error)
-            print("Database Error in insert_expense:", error)  # Optional: Print error to console
+        self.remember_category(category)
+        self.reset_form()
+        self.load_table()
+        self.expenses_changed()
+
+    def catch_up_recurring(self):
+        self.database.submit(recurring.catch_up, on_result=self.recurring_caught_up,
+                             on_error=lambda error: print("Database Error in catch_up:", error))
+
+    def recurring_caught_up(self, result):
+        if result.rows:
+            self.load_table()
+            self.expenses_changed()
+
+    def insert_expense(self):
+        selected_row = self.table.currentIndex().row()
+        if selected_row == -1:
+            QMessageBox.warning(self, "No Row Selected", "Please select a row to insert the new expense after.")
             return
 
-        # Reset input fields
-        self.date_box.setDate(QDate.currentDate())
-        self.dropdown.setCurrentIndex(0)
-        self.currency_dropdown.setCurrentIndex(0)
-        self.amount.clear()
-        self.description.clear()
+        expense = self.read_form()
+        if expense is None:
+            return
 
-        self.load_table()
+        try:
+            record, rebalanced = self.repository.insert_after(self.model.expense_id(selected_row), *expense)
+        except (sqlite3.Error, LookupError) as error:
+            self.show_database_error("insert_expense", error)
+            return
+
+        self.remember_category(record[2])
+        self.reset_form()
+
+        if rebalanced or self.model.is_filtered():
+            # Every position changed, so the loaded keys are stale, or the
+            # new expense may not match the filter
+            self.load_table()
+        else:
+            # The new expense sorts directly above the selected row
+            self.model.insert_record(selected_row, record)
+        self.model.check_consistency()
+        self.expenses_changed()
 
     def delete_expense(self):
-        selected_row = self.table.currentRow()
+        selected_row = self.table.currentIndex().row()
         if selected_row == -1:
             QMessageBox.warning(self, "No Expense Chosen", "Please choose an expense to delete.")
             return
 
-        expense_id = int(self.table.item(selected_row, 0).text())
+        expense_id = self.model.expense_id(selected_row)
 
         confirm = QMessageBox.question(self, "Are you sure?", "Delete expense?", QMessageBox.Yes | QMessageBox.No)
 
         if confirm == QMessageBox.No:
             return
 
-        query = QSqlQuery()
-        query.prepare("DELETE FROM expenses WHERE id = ?")
-        query.addBindValue(expense_id)
-        if not query.exec_():
-            error = query.lastError().text()
-            QMessageBox.critical(self, "Database Error", error)
-            print("Database Error in delete_expense:", error)  # Optional: Print error to console
+        try:
+            self.repository.delete(expense_id)
+        except sqlite3.Error as error:
+            self.show_database_error("delete_expense", error)
             return
 
-        # Reorder the remaining IDs after deletion
-        reorder_query = QSqlQuery()
-        reorder_query.prepare("UPDATE expenses SET id = id - 1 WHERE id > ?")
-        reorder_query.addBindValue(expense_id)
-        if not reorder_query.exec_():
-            error = reorder_query.lastError().text()
-            QMessageBox.critical(self, "Database Error", error)
-            print("Database Error in reorder_query:", error)  # Optional: Print error to console
+        self.model.remove_record(selected_row)
+        self.model.check_consistency()
+        self.expenses_changed()
+
+    def undo(self):
+        try:
+            label = self.repository.undo()
+        except (sqlite3.Error, LookupError) as error:
+            self.show_database_error("undo", error)
             return
+        self.journal_replayed("Undo", label)
 
+    def redo(self):
+        try:
+            label = self.repository.redo()
+        except (sqlite3.Error, LookupError) as error:
+            self.show_database_error("redo", error)
+            return
+        self.journal_replayed("Redo", label)
+
+    def journal_replayed(self, action, label):
+        self.setWindowTitle(f"Expense Tracker 2.0 - {action}: {label}" if label else "Expense Tracker 2.0")
+        if label is None:
+            return
+        # An undo can touch any number of rows (a whole import), so refetch instead of patching
         self.load_table()
+        self.expenses_changed()
 
-# Initialize the database
-database = QSqlDatabase.addDatabase("QSQLITE")
-database.setDatabaseName("expense.db")
-if not database.open():
-    QMessageBox.critical(None, "Error", "Could not open your database")
-    sys.exit(1)
+    def closeEvent(self, event):
+        self.database.close()
+        super().closeEvent(event)
+
+    def show_progress(self, title, text):
+        progress = QProgressDialog(text, "Cancel", 0, 0, self)
+        progress.setWindowTitle(title)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(0)
+        return progress
+
+    def import_expenses(self):
+        import importer
+
+        path, _ = QFileDialog.getOpenFileName(self, "Import Expenses", "", "Bank exports (*.csv *.ofx *.qfx);;All files (*)")
+        if not path:
+            return
+
+        # The import runs on the worker thread and holds the write lock until it
+        # commits, so the window stays modal (but painted) until it is done
+        self.import_progress = self.show_progress("Import", f"Importing {os.path.basename(path)}...")
+
+        # Rows without their own category/currency take the ones currently selected in the form
+        task = self.database.submit(importer.import_file, path, self.currency_dropdown.currentText(),
+                                    self.dropdown.currentText(), on_result=self.import_finished,
+                                    on_error=self.import_failed, on_progress=self.import_progressed)
+        # A cancelled import is rolled back on the worker thread; nothing was written
+        self.import_progress.canceled.connect(task.cancel)
+
+    def import_progressed(self, rows):
+        self.import_progress.setLabelText(f"Imported {rows:,} expenses...")
+
+    def import_failed(self, error):
+        self.import_progress.reset()
+        QMessageBox.critical(self, "Import Failed", str(error))
+        print("Import Error:", error)  # Optional: Print error to console
+
+    def import_finished(self, result):
+        self.import_progress.reset()
+        # The file may have brought categories of its own
+        for category in self.repository.category_names():
+            self.remember_category(category)
+        self.load_table()
+        self.expenses_changed()
+        QMessageBox.information(self, "Import Complete",
+                                f"Imported {result.rows:,} expenses in {result.seconds:.2f} s "
+                                f"({result.rows_per_second:,.0f} rows/sec).")
+
+    def export_expenses(self):
+        import exporter
+
+        path, selected = QFileDialog.getSaveFileName(
+            self, "Export Expenses", "expenses.csv", "CSV (*.csv);;JSON Lines (*.jsonl);;Parquet (*.parquet)")
+        if not path:
+            return
+        if os.path.splitext(path)[1].lower() not in exporter.FORMATS:
+            # No (known) extension typed: take it from the chosen file type
+            path += re.search(r"\(\*(\.\w+)\)", selected).group(1) if selected else ".csv"
+
+        # Exports what the filter bar currently shows, read from one snapshot on the worker thread
+        self.export_progress = self.show_progress("Export", f"Exporting to {os.path.basename(path)}...")
+        task = self.database.submit(exporter.export_file, path, None, self.model.expense_filter,
+                                    on_result=self.export_finished, on_error=self.export_failed,
+                                    on_progress=self.export_progressed)
+        self.export_progress.canceled.connect(task.cancel)
+
+    def export_progressed(self, rows):
+        self.export_progress.setLabelText(f"Exported {rows:,} expenses...")
+
+    def export_failed(self, error):
+        self.export_progress.reset()
+        QMessageBox.critical(self, "Export Failed", str(error))
+        print("Export Error:", error)  # Optional: Print error to console
+
+    def export_finished(self, result):
+        self.export_progress.reset()
+        QMessageBox.information(self, "Export Complete",
+                                f"Exported {result.rows:,} expenses in {result.seconds:.2f} s "
+                                f"({result.rows_per_second:,.0f} rows/sec).")
 
-# Adjust the table schema
-query = QSqlQuery()
-query.exec_("CREATE TABLE IF NOT EXISTS expenses (id INTEGER PRIMARY KEY, date TEXT, category TEXT, amount REAL, currency TEXT, description TEXT)")
 
 if __name__ == "__main__":
     app = QApplication([])
-    main = ExpenseApp()
+
+    # Initialize the database
+    try:
+        repository = ExpenseRepository("expense.db")
+    except sqlite3.Error as error:
+        QMessageBox.critical(None, "Error", f"Could not open your database: {error}")
+        sys.exit(1)
+
+    main = ExpenseApp(repository, DatabaseThread(repository.path))
     main.show()
-    app.exec_()
+    # EXPENSE_TRACKER_CPROFILE=path profiles the whole session on the GUI thread
+    with profiling.capture(profiling.CPROFILE_PATH):
+        app.exec_()
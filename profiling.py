@@ -0,0 +1,218 @@
+"""Opt-in timing instrumentation for database calls and GUI refreshes.
+
+    EXPENSE_TRACKER_PROFILE=1 python main.py
+    EXPENSE_TRACKER_PROFILE_JSON=profile.json python expense_cli.py totals
+    EXPENSE_TRACKER_CPROFILE=main.prof python main.py
+    python expense_cli.py --profile totals.prof totals --by month
+
+Hot paths are wrapped with timed(), as a decorator or a context manager:
+
+    @timed("db.fetch_page")
+    def fetch_page(self, ...):
+
+    with timed("ui.summary_rows"):
+        ...
+
+Every timed name collects a count, total, max and a histogram over
+HISTOGRAM_BOUNDS_MS, from which snapshot() estimates p50/p95; increment() keeps
+plain counters. Any single timing at or above SLOW_MS (environment
+EXPENSE_TRACKER_SLOW_MS, default 50) is printed to stderr and kept in the
+slow operations log (the last SLOW_LOG_SIZE entries). The GUI shows all of
+it in a Profile tab; EXPENSE_TRACKER_PROFILE_JSON writes snapshot() to a
+file at exit.
+
+Profiling is switched on by EXPENSE_TRACKER_PROFILE=1 or
+EXPENSE_TRACKER_PROFILE_JSON when this module is first imported. When it is
+off, @timed returns the function itself and timed() a shared do-nothing
+context manager, so the instrumented code runs as if it were not there.
+Timings are recorded from any thread (the database worker included).
+
+cProfile is separate and independent of the above: capture(path) profiles
+the calling thread for the duration of a with block and writes pstats to
+path, for `python -m pstats` or snakeviz. main.py wraps the event loop in
+it when EXPENSE_TRACKER_CPROFILE is set, and expense_cli.py has --profile.
+"""
+import atexit
+import datetime
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+DUMP_PATH = os.environ.get("EXPENSE_TRACKER_PROFILE_JSON") or None
+CPROFILE_PATH = os.environ.get("EXPENSE_TRACKER_CPROFILE") or None
+ENABLED = os.environ.get("EXPENSE_TRACKER_PROFILE") == "1" or DUMP_PATH is not None
+SLOW_MS = float(os.environ.get("EXPENSE_TRACKER_SLOW_MS", "50"))
+SLOW_LOG_SIZE = 200
+
+# Upper bounds of the histogram buckets; the last bucket takes everything slower
+HISTOGRAM_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_lock = threading.Lock()
+_timings = {}
+_counters = {}
+_slow = deque(maxlen=SLOW_LOG_SIZE)
+
+
+class Timing:
+    """Aggregate of every recorded duration for one name."""
+
+    __slots__ = ("count", "total_ms", "max_ms", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+
+    def add(self, milliseconds):
+        self.count += 1
+        self.total_ms += milliseconds
+        self.max_ms = max(self.max_ms, milliseconds)
+        # First bound >= milliseconds; past the last bound is the overflow bucket
+        self.buckets[bisect_left(HISTOGRAM_BOUNDS_MS, milliseconds)] += 1
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of timings (max for the last bucket)."""
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(HISTOGRAM_BOUNDS_MS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def as_dict(self):
+        labels = [f"<={bound}ms" for bound in HISTOGRAM_BOUNDS_MS] + [f">{HISTOGRAM_BOUNDS_MS[-1]}ms"]
+        return {
+            "count": self.count,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(0.5), 3),
+            "p95_ms": round(self.percentile(0.95), 3),
+            "max_ms": round(self.max_ms, 3),
+            "histogram": {label: count for label, count in zip(labels, self.buckets) if count},
+        }
+
+
+def record(name, milliseconds):
+    """Add one duration under name; also logs it if it is slow."""
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            timing = _timings[name] = Timing()
+        timing.add(milliseconds)
+        if milliseconds >= SLOW_MS:
+            _slow.append((datetime.datetime.now().isoformat(timespec="milliseconds"), name, round(milliseconds, 3)))
+    if milliseconds >= SLOW_MS:
+        print(f"Slow operation: {name} took {milliseconds:.1f} ms", file=sys.stderr)
+
+
+def increment(name, amount=1):
+    """Add amount to the counter name (no-op while profiling is off)."""
+    if ENABLED:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + amount
+
+
+class _Timer:
+    """What timed() returns while profiling is on; a new one per call, so with blocks may nest or run in threads."""
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, function):
+        name = self.name
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, (time.perf_counter() - start) * 1000)
+        return wrapper
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, (time.perf_counter() - self.start) * 1000)
+        return False
+
+
+class _Disabled:
+    __slots__ = ()
+
+    def __call__(self, function):
+        return function
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_DISABLED = _Disabled()
+
+
+def timed(name):
+    """Time a function (as a decorator) or a with block under name."""
+    return _Timer(name) if ENABLED else _DISABLED
+
+
+def snapshot():
+    """Everything recorded so far as a JSON-ready dict; timings sorted by total time, slowest first."""
+    with _lock:
+        timings = sorted(_timings.items(), key=lambda item: item[1].total_ms, reverse=True)
+        return {
+            "enabled": ENABLED,
+            "slow_ms": SLOW_MS,
+            "timings": {name: timing.as_dict() for name, timing in timings},
+            "counters": dict(sorted(_counters.items())),
+            "slow": [{"time": when, "name": name, "ms": milliseconds} for when, name, milliseconds in _slow],
+        }
+
+
+def reset():
+    with _lock:
+        _timings.clear()
+        _counters.clear()
+        _slow.clear()
+
+
+def dump(path):
+    """Write snapshot() to path as JSON."""
+    with open(path, "w") as output:
+        json.dump(snapshot(), output, indent=2)
+        output.write("\n")
+
+
+@contextmanager
+def capture(path):
+    """cProfile the calling thread inside the with block and write the stats to path; no-op when path is None."""
+    if path is None:
+        yield None
+        return
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+
+if DUMP_PATH is not None:
+    atexit.register(dump, DUMP_PATH)
@@ -0,0 +1,119 @@
+"""Recurring expenses: subscriptions, rent and other fixed payments.
+
+A rule in the recurring_rules table says "this expense, every N weeks,
+months or years from start_date (until end_date)". catch_up writes every
+occurrence that is due but not written yet:
+
+    rule_id = add_rule(repository, "Netflix", 1549, "USD", "Standard plan", "monthly", "2024-01-15")
+    catch_up(repository)            # at startup: everything due up to today
+
+All due rules are handled in one transaction: the occurrences go in through
+one batched insert (ExpenseRepository.insert_many), sorted by date, and
+each rule's count of written occurrences moves forward in the same
+transaction. Running it again, from any connection, finds nothing left to
+do, and a crash leaves either everything or nothing written. The batch is
+one journal entry, so a single undo takes a whole catch-up back; the rules
+still count those occurrences as written and do not recreate them.
+
+Monthly and yearly rules keep the day of start_date and use the last day
+of shorter months (a rule from the 31st is due on Feb 28 or 29).
+"""
+import calendar
+import datetime
+import time
+from collections import namedtuple
+
+from profiling import timed
+
+FREQUENCIES = ("weekly", "monthly", "yearly")
+
+RecurringRule = namedtuple(
+    "RecurringRule", "id category amount currency description frequency interval start_date end_date next_date")
+
+CatchUpResult = namedtuple("CatchUpResult", "rows rules seconds")
+
+
+def occurrence(start, frequency, interval, index):
+    """The date of occurrence number index (0 is start itself) of a rule."""
+    if frequency == "weekly":
+        return start + datetime.timedelta(weeks=interval * index)
+    months = interval * index * (12 if frequency == "yearly" else 1)
+    year, month = divmod(start.month - 1 + months, 12)
+    year += start.year
+    # Always from start's day, so a rule from the 31st returns to the 31st after February
+    return datetime.date(year, month + 1, min(start.day, calendar.monthrange(year, month + 1)[1]))
+
+
+def add_rule(repository, category, amount, currency, description, frequency, start_date, interval=1, end_date=None):
+    """Store a rule (amount in minor units, dates ISO yyyy-mm-dd) and return its id.
+
+    Nothing is written to expenses until the next catch_up.
+    """
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"Unknown frequency {frequency!r}, expected one of {', '.join(FREQUENCIES)}")
+    if interval < 1:
+        raise ValueError("interval must be at least 1")
+    start = datetime.date.fromisoformat(start_date.strip())
+    # Stored as ISO text, which catch_up compares with next_date as strings
+    end = datetime.date.fromisoformat(end_date.strip()) if end_date is not None else None
+    if end is not None and end < start:
+        raise ValueError("end_date is before start_date")
+
+    with repository.transaction():
+        return repository.connection.execute(
+            "INSERT INTO recurring_rules (category_id, amount, currency_id, description, frequency, interval, "
+            "start_date, end_date, generated, next_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?)",
+            (repository.category_id(category), amount, repository.currency_id(currency), description, frequency,
+             interval, start.isoformat(), end.isoformat() if end else None, start.isoformat())).lastrowid
+
+
+def list_rules(repository):
+    """Every rule as a RecurringRule, ordered by id; next_date is None once a rule has ended."""
+    return [RecurringRule(*row) for row in repository.connection.execute(
+        "SELECT r.id, categories.name, r.amount, currencies.code, r.description, r.frequency, r.interval, "
+        "r.start_date, r.end_date, r.next_date FROM recurring_rules AS r "
+        "LEFT JOIN categories ON categories.id = r.category_id "
+        "LEFT JOIN currencies ON currencies.id = r.currency_id ORDER BY r.id")]
+
+
+def delete_rule(repository, rule_id):
+    """Stop a rule; expenses it has already written stay. Raises LookupError if there is no such rule."""
+    with repository.transaction():
+        if repository.connection.execute("DELETE FROM recurring_rules WHERE id = ?", (rule_id,)).rowcount == 0:
+            raise LookupError(f"No recurring rule {rule_id}")
+
+
+@timed("recurring.catch_up")
+def catch_up(repository, through=None, label="Recurring expenses"):
+    """Write every occurrence due on or before through (default: today) and return a CatchUpResult."""
+    through = through or datetime.date.today()
+    start_time = time.perf_counter()
+    with repository.transaction():
+        due = repository.connection.execute(
+            "SELECT r.id, categories.name, r.amount, currencies.code, r.description, r.frequency, r.interval, "
+            "r.start_date, r.end_date, r.generated FROM recurring_rules AS r "
+            "LEFT JOIN categories ON categories.id = r.category_id "
+            "LEFT JOIN currencies ON currencies.id = r.currency_id "
+            "WHERE r.next_date <= ? ORDER BY r.id", (through.isoformat(),)).fetchall()
+        if not due:
+            return CatchUpResult(0, 0, time.perf_counter() - start_time)
+
+        rows, updates = [], []
+        for rule_id, category, amount, currency, description, frequency, interval, start, end, generated in due:
+            start = datetime.date.fromisoformat(start)
+            end = datetime.date.fromisoformat(end) if end else None
+            last = min(through, end) if end else through
+            index = generated
+            day = occurrence(start, frequency, interval, index)
+            while day <= last:
+                rows.append((day.isoformat(), category, amount, currency, description))
+                index += 1
+                day = occurrence(start, frequency, interval, index)
+            updates.append((index, day.isoformat() if end is None or day <= end else None, rule_id))
+
+        # Oldest first, so the newest occurrence ends up on top of the table like a hand-entered one
+        rows.sort(key=lambda row: row[0])
+        repository.insert_many(rows, label=label)
+        repository.connection.executemany("UPDATE recurring_rules SET generated = ?, next_date = ? WHERE id = ?",
+                                          updates)
+    return CatchUpResult(len(rows), len(due), time.perf_counter() - start_time)
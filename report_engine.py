@@ -0,0 +1,99 @@
+"""Reports over many expense databases at once, e.g. one file per person and year.
+
+Each database is aggregated in its own worker process (ProcessPoolExecutor),
+so the SQLite scans run in parallel instead of taking turns on the GIL.
+Workers return partial aggregates (sum, count, min, max) per group, such as
+month x category x currency, and the parent merges them:
+
+    rows = report(["alice-2024.db", "bob-2024.db"], ("month", "currency"))
+
+Amounts are integer minor units, so sums are exact whatever the merge order.
+The merge still runs in sorted path order and the rows come out sorted by
+group, so the same inputs always give byte-identical output. Inputs are
+opened read-only and left byte-for-byte as they were; files that still need
+a schema migration are refused. Like totals()
+the groups should include currency, because minor units of different
+currencies cannot be added.
+"""
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from expense_core import ExpenseRepository, register_currencies
+
+Aggregate = namedtuple("Aggregate", "total count minimum maximum")
+
+ReportResult = namedtuple("ReportResult", "rows files workers seconds")
+
+
+def aggregate_file(path, group_by, expense_filter=None):
+    """Worker: ({group key tuple: Aggregate}, {currency code: formatting rules}) for one database file.
+
+    The file is opened read-only. The currency rules come back with the
+    aggregates because currencies added to a database are only registered
+    in the process that opened it, which is not the parent's.
+    """
+    # A report must not migrate the inputs or switch them to WAL, so no schema work and no tuning pragmas
+    repository = ExpenseRepository(path, pragmas={}, read_only=True)
+    try:
+        rows = repository.aggregates(group_by, expense_filter)
+        currency_formats = repository.currency_formats()
+    finally:
+        repository.close()
+    width = len(group_by)
+    return {tuple(row[:width]): Aggregate(*row[width:]) for row in rows}, currency_formats
+
+
+def merge(partials):
+    """Combine per-file aggregates, in the order given, into one {key: Aggregate} dict."""
+    merged = {}
+    for partial in partials:
+        for key, aggregate in partial.items():
+            current = merged.get(key)
+            if current is None:
+                merged[key] = aggregate
+            else:
+                merged[key] = Aggregate(current.total + aggregate.total, current.count + aggregate.count,
+                                        min(current.minimum, aggregate.minimum),
+                                        max(current.maximum, aggregate.maximum))
+    return merged
+
+
+def group_sort_key(key):
+    # NULL categories (rows from before categories were required) sort first instead of breaking the sort
+    return tuple((value is not None, value or "") for value in key)
+
+
+def report(paths, group_by=("month", "category", "currency"), expense_filter=None, workers=None):
+    """Aggregate every database in paths and return a ReportResult.
+
+    rows are (*group values, total, count, minimum, maximum) sorted by
+    group. workers defaults to one process per CPU, never more than there
+    are files; with a single worker everything runs in this process.
+    """
+    for column in group_by:
+        if column not in ExpenseRepository.GROUP_COLUMNS:
+            raise ValueError(f"Cannot group by {column!r}")
+    paths = sorted(set(os.path.abspath(path) for path in paths))
+    for path in paths:
+        # sqlite3 would silently create an empty database instead
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"No such database: {path}")
+    workers = max(1, min(workers or os.cpu_count() or 1, len(paths)))
+
+    start = time.perf_counter()
+    arguments = (paths, repeat(tuple(group_by)), repeat(expense_filter))
+    if workers == 1:
+        partials = list(map(aggregate_file, *arguments))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map yields results in path order whichever worker finishes first
+            partials = list(executor.map(aggregate_file, *arguments))
+
+    for _, currency_formats in partials:
+        register_currencies(currency_formats)
+    merged = merge(partial for partial, _ in partials)
+    rows = [(*key, *merged[key]) for key in sorted(merged, key=group_sort_key)]
+    return ReportResult(rows, len(paths), workers, time.perf_counter() - start)
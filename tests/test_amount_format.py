@@ -0,0 +1,71 @@
+"""Round trips of amount_format over seeded random inputs, for every built-in currency and a few custom ones.
+
+reformat_input is also compared against the GUI code it replaced, which
+bench.py keeps (as legacy_*) to time against.
+"""
+import random
+
+import pytest
+
+from amount_format import CURRENCY_DATA, MAX_AMOUNT, AmountFormat
+from bench import legacy_format_amount, legacy_reformat_input
+
+SEED = 20240101
+CASES = 500
+
+# Rules a database can add with `currencies add`, covering every allowed number of decimals
+CUSTOM_CURRENCIES = {
+    "KWD": {"symbol": "KD", "decimal_sep": ".", "thousand_sep": ",", "decimals": 3},
+    "CLF": {"symbol": "UF", "decimal_sep": ",", "thousand_sep": " ", "decimals": 4},
+    "XOF": {"symbol": "CFA", "decimal_sep": ",", "thousand_sep": "'", "decimals": 0},
+    "XTS": {"symbol": "T", "decimal_sep": "'", "thousand_sep": ".", "decimals": 1},
+}
+CURRENCIES = sorted({**CURRENCY_DATA, **CUSTOM_CURRENCIES}.items())
+
+
+def random_typed_amount(generator, currency_data):
+    """Something a user could have in the amount field mid-edit, separators in odd places included."""
+    alphabet = "0123456789" * 3 + currency_data["decimal_sep"] + currency_data["thousand_sep"] * 2 + "-x"
+    text = "".join(generator.choice(alphabet) for _ in range(generator.randrange(0, 16)))
+    return text, generator.randrange(0, len(text) + 1)
+
+
+def random_amount(generator):
+    return round(10 ** generator.uniform(0, 15)) * generator.choice((1, -1))
+
+
+@pytest.mark.parametrize("currency, currency_data", CURRENCIES)
+def test_reformat_input_matches_the_legacy_code_and_is_stable(currency, currency_data):
+    rules = AmountFormat(currency_data)
+    generator = random.Random(f"{SEED}-{currency}")
+    for _ in range(CASES):
+        text, cursor = random_typed_amount(generator, currency_data)
+        expected = legacy_reformat_input(text, cursor, currency_data["decimal_sep"], currency_data["thousand_sep"])
+        actual = rules.reformat_input(text, cursor)
+        assert actual == expected, (text, cursor)
+        assert rules.reformat_input(*actual) == actual, (text, cursor)
+
+
+@pytest.mark.parametrize("currency, currency_data", CURRENCIES)
+def test_parse_inverts_format(currency, currency_data):
+    rules = AmountFormat(currency_data)
+    generator = random.Random(f"{SEED}-{currency}")
+    for _ in range(CASES):
+        amount = random_amount(generator)
+        shown = rules.format(amount)
+        assert rules.parse(shown[len(rules.symbol):]) == amount, shown
+        assert rules.parse_plain(rules.format_plain(amount)) == amount, rules.format_plain(amount)
+        # The legacy code went through floats, which are exact only this far
+        if currency_data["decimals"] == 2 and abs(amount) < 10 ** 11:
+            assert legacy_format_amount(amount / 100, currency_data) == shown
+
+
+@pytest.mark.parametrize("currency, currency_data", CURRENCIES)
+def test_parse_plain_rejects_what_cannot_be_stored(currency, currency_data):
+    rules = AmountFormat(currency_data)
+    largest = rules.format_plain(MAX_AMOUNT)
+    assert rules.parse_plain(largest) == MAX_AMOUNT
+    assert rules.parse_plain("-" + largest) == -MAX_AMOUNT
+    for text in ("1e30", "1E2", "1e999999", "NaN", "-Infinity", "", "12,5x", str(MAX_AMOUNT) + "0"):
+        with pytest.raises(ValueError):
+            rules.parse_plain(text)
@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+
+from expense_core import ExpenseRepository
+
+CLI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "expense_cli.py")
+
+
+def make_shard(path, currency_added):
+    repository = ExpenseRepository(str(path))
+    try:
+        if currency_added:
+            repository.add_currency("KWD", "KD", ".", ",", 3)
+            repository.add_many([("2024-01-05", "Food", 1234, "KWD", "dinar")] * 2)
+        repository.add_many([("2024-01-05", "Food", 1250, "EUR", "euro"), ("2024-02-01", None, 300, "USD", "")])
+    finally:
+        repository.close()
+
+
+def report(paths, workers):
+    # A fresh interpreter per run: the parent must not have seen the shards' currencies before
+    completed = subprocess.run(
+        [sys.executable, CLI, "report", *map(str, paths), "--by", "category", "currency", "--workers", str(workers)],
+        capture_output=True, text=True, check=True)
+    return completed.stdout
+
+
+def test_output_is_the_same_for_any_worker_count(tmp_path):
+    paths = [tmp_path / "a.db", tmp_path / "b.db", tmp_path / "c.db"]
+    for index, path in enumerate(paths):
+        make_shard(path, currency_added=index < 2)
+
+    single = report(paths, 1)
+    assert report(paths, 3) == single
+    # Formatted with the shards' own rules for the added currency, not the 2-decimal fallback
+    assert "Food\tKWD\tKD4.936\t4\tKD1.234\tKD1.234\n" in single
+
+
+def test_missing_category_is_printed_empty(tmp_path):
+    path = tmp_path / "a.db"
+    make_shard(path, currency_added=False)
+    assert report([path], 1).startswith("\tUSD\t")
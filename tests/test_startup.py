@@ -0,0 +1,36 @@
+"""The cold-start budget: a fresh process must show the first screenful of rows within STARTUP_BUDGET_MS."""
+import os
+import subprocess
+import sys
+
+import pytest
+
+import bench
+from expense_core import ExpenseRepository
+
+RUNS = 3
+ROWS = 5000
+
+
+def qt_platform_available():
+    environment = dict(os.environ)
+    environment.setdefault("QT_QPA_PLATFORM", "offscreen")
+    completed = subprocess.run([sys.executable, "-c", "from PyQt5.QtWidgets import QApplication; QApplication([])"],
+                               capture_output=True, env=environment)
+    return completed.returncode == 0
+
+
+@pytest.mark.skipif(not qt_platform_available(), reason="PyQt5 or a Qt platform plugin is not available")
+def test_first_screenful_within_budget(tmp_path):
+    path = str(tmp_path / "startup.db")
+    repository = ExpenseRepository(path)
+    try:
+        bench.generate_ledger(repository, ROWS)
+    finally:
+        repository.close()
+
+    results = bench.startup_benchmarks(path, RUNS)
+    # Missing means a probe crashed or never painted rows, which is worse than slow
+    assert "startup_interactive" in results, "the startup probe did not paint rows in every run"
+    median = results["startup_interactive"]["median_ms"]
+    assert median <= bench.STARTUP_BUDGET_MS, f"first screenful after {median:.0f} ms"